@@ -40,14 +40,32 @@ def main():
                      help='destination port', default='80')
   _parser.add_option('--sport', '--source-port', dest='sport',
                      help='source port', default='1025')
+  _parser.add_option('-f', '--flows-file', dest='flows',
+                     help='file of flows to check instead of a single one, '
+                     'one "src dst sport dport proto" flow per line',
+                     default=None)
   (FLAGS, unused_args) = _parser.parse_args()
 
   defs = naming.Naming(FLAGS.definitions)
   policy_obj = policy.ParsePolicy(open(FLAGS.pol).read(), defs)
+  if FLAGS.flows:
+    CheckFlows(policy_obj, FLAGS.flows)
+    return
   check = aclcheck.AclCheck(policy_obj, src=FLAGS.src, dst=FLAGS.dst,
                             sport=FLAGS.sport, dport=FLAGS.dport,
                             proto=FLAGS.proto)
   print(str(check))
 
+
+def CheckFlows(policy_obj, flows_file):
+  """Print the matches of every flow of flows_file, parsing the policy once."""
+  with open(flows_file) as f:
+    flows = [line.split('#')[0].split() for line in f]
+  flows = [tuple(flow) for flow in flows if flow]
+  checker = aclcheck.FlowChecker(policy_obj)
+  for flow, check in zip(flows, checker.CheckFlows(flows)):
+    print('flow: ' + ' '.join(flow))
+    print(str(check))
+
 if __name__ == '__main__':
   main()
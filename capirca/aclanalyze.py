@@ -0,0 +1,102 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Report the unreachable, redundant and overlapping terms of policies.
+
+Example:
+  aclanalyze --definitions_directory ./def policies/pol/sample.pol
+
+Prints one line per finding of lib/redundancy.py and exits with status 1 when
+there is any, so that it can run in CI.
+"""
+
+import sys
+
+from absl import app
+from absl import flags
+from absl import logging
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import redundancy
+
+FLAGS = flags.FLAGS
+
+
+def SetupFlags():
+  """Setup flags."""
+  flags.DEFINE_string(
+      'definitions_directory', './def',
+      'The directory where network and service definition files can be found.')
+  flags.DEFINE_string(
+      'base_directory', './policies',
+      'The base directory to look for include files.')
+  flags.DEFINE_list(
+      'kinds', ','.join(redundancy.KINDS),
+      'Kinds of findings to report, among %s.' % ', '.join(redundancy.KINDS))
+  flags.DEFINE_integer(
+      'max_pieces', redundancy.MAX_PIECES,
+      'Most disjoint boxes a term is split into before its analysis is '
+      'given up.')
+
+
+def Analyze(policy_files, definitions, base_directory, kinds, max_pieces):
+  """Returns the findings of kinds in policy files.
+
+  Args:
+    policy_files: paths of the policies.
+    definitions: naming.Naming object.
+    base_directory: the directory to look for include files in.
+    kinds: kinds of findings reported.
+    max_pieces: see redundancy.AnalyzeTerms.
+
+  Returns:
+    list of (policy file, redundancy.Finding).
+  """
+  findings = []
+  for policy_file in policy_files:
+    with open(policy_file) as f:
+      pol = policy.ParsePolicy(f.read(), definitions,
+                               base_dir=base_directory,
+                               filename=policy_file)
+    findings.extend((policy_file, finding)
+                    for finding in redundancy.AnalyzePolicy(pol, max_pieces)
+                    if finding.kind in kinds)
+  return findings
+
+
+def main(argv):
+  policy_files = argv[1:]
+  if not policy_files:
+    raise app.UsageError('no policy file given')
+  unknown = set(FLAGS.kinds) - set(redundancy.KINDS)
+  if unknown:
+    raise app.UsageError('unknown kinds: %s' % ', '.join(sorted(unknown)))
+  definitions = naming.Naming(FLAGS.definitions_directory)
+  findings = Analyze(policy_files, definitions, FLAGS.base_directory,
+                     FLAGS.kinds, FLAGS.max_pieces)
+  for policy_file, finding in findings:
+    print('%s: %s' % (policy_file, finding))
+  logging.info('%d findings in %d policies', len(findings), len(policy_files))
+  sys.exit(1 if findings else 0)
+
+
+def EntryPoint():
+  """Read in flags and call main()."""
+  SetupFlags()
+  app.run(main)
+
+
+if __name__ == '__main__':
+  EntryPoint()
@@ -0,0 +1,310 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""A local server answering aclcheck queries from policies kept in memory.
+
+The definitions and the policies are parsed once and kept, as
+aclcheck.FlowChecker objects, until they change on disk. At most every
+--reload_interval seconds, the definitions files are checked by modification
+time and size, and a policy by the hash of its text with includes expanded.
+When definitions change, only the policies using a token whose definition
+changed are parsed again.
+
+Queries are HTTP requests, on localhost or on a Unix socket:
+  GET /check?policy=pol/sample.pol&src=10.1.1.1&dst=200.1.1.1&dport=80&proto=tcp
+answers the matches of one flow, like aclcheck_cmdline.py, and
+  POST /check {"policy": "pol/sample.pol", "flows": [{"dst": "200.1.1.1"}]}
+answers the matches of several flows. Missing flow fields are 'any'. Policy
+paths are relative to --base_directory.
+"""
+
+import http.server
+import json
+import os
+import pathlib
+import socketserver
+import threading
+import time
+from urllib import parse
+
+from absl import app
+from absl import flags
+from absl import logging
+from capirca.lib import aclcheck
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import port
+from capirca.utils import buildcache
+
+FLAGS = flags.FLAGS
+
+FLOW_FIELDS = ('src', 'dst', 'sport', 'dport', 'proto')
+
+
+class Error(Exception):
+  """Base error class."""
+
+
+class PolicyNotFoundError(Error):
+  """The policy does not exist under the base directory."""
+
+
+class _Entry:
+  """A compiled policy and what it was compiled from."""
+
+  def __init__(self, checker, fingerprint, digests, checked):
+    self.checker = checker
+    self.fingerprint = fingerprint
+    # {(def_type, token): TokenDigest} of the tokens the policy looked up.
+    self.digests = digests
+    self.checked = checked
+
+
+class PolicyStore:
+  """Definitions and compiled policies, parsed again when they change."""
+
+  def __init__(self, definitions_directory, base_directory,
+               reload_interval=1.0, clock=time.monotonic):
+    """Initializer.
+
+    Args:
+      definitions_directory: the directory of the .net and .svc files.
+      base_directory: the directory of the policies and their includes.
+      reload_interval: seconds during which files are not checked again.
+      clock: function returning the time in seconds, for tests.
+    """
+    self.definitions_directory = definitions_directory
+    self.base_directory = pathlib.Path(base_directory).resolve()
+    self.reload_interval = reload_interval
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._definitions = None
+    self._definitions_files = None
+    self._definitions_checked = None
+    self._policies = {}
+
+  def Checker(self, policy_file):
+    """Returns the FlowChecker of a policy, parsing it if it changed.
+
+    Args:
+      policy_file: path of the policy, relative to the base directory.
+
+    Returns:
+      aclcheck.FlowChecker of the policy.
+
+    Raises:
+      PolicyNotFoundError: the policy is not a file under the base directory.
+      policy.Error, naming.Error: the policy can't be parsed.
+    """
+    path = (self.base_directory / policy_file).resolve()
+    if (self.base_directory not in path.parents or not path.is_file()):
+      raise PolicyNotFoundError('no policy %s in %s' % (
+          policy_file, self.base_directory))
+    with self._lock:
+      now = self._clock()
+      self._CheckDefinitions(now)
+      entry = self._policies.get(path)
+      if entry is None or (now - entry.checked >= self.reload_interval and
+                           not self._IsFresh(path, entry)):
+        entry = self._Compile(path)
+        self._policies[path] = entry
+      entry.checked = now
+      return entry.checker
+
+  def _DefinitionsFiles(self):
+    files = {}
+    for entry in os.scandir(self.definitions_directory):
+      if entry.name.endswith(('.net', '.svc')):
+        stat = entry.stat()
+        files[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+  def _CheckDefinitions(self, now):
+    """Parse the definitions again if a file changed."""
+    if (self._definitions_checked is not None and
+        now - self._definitions_checked < self.reload_interval):
+      return
+    self._definitions_checked = now
+    files = self._DefinitionsFiles()
+    if files == self._definitions_files:
+      return
+    logging.info('loading definitions from %s', self.definitions_directory)
+    self._definitions = naming.Naming(self.definitions_directory)
+    self._definitions_files = files
+    # policies using a changed token are compiled again.
+    for path, entry in list(self._policies.items()):
+      if any(buildcache.TokenDigest(self._definitions, *key) != digest
+             for key, digest in entry.digests.items()):
+        del self._policies[path]
+
+  def _IsFresh(self, path, entry):
+    return (buildcache.Fingerprint(path, self.base_directory) ==
+            entry.fingerprint)
+
+  def _Compile(self, path):
+    logging.info('parsing %s', path)
+    fingerprint = buildcache.Fingerprint(path, self.base_directory)
+    self._definitions.StartReferenceTracking()
+    try:
+      pol = policy.ParsePolicy(path.read_text(), self._definitions,
+                               base_dir=str(self.base_directory),
+                               filename=str(path))
+    finally:
+      references = self._definitions.StopReferenceTracking()
+    digests = {
+        (def_type, token): buildcache.TokenDigest(self._definitions, def_type,
+                                                  token)
+        for def_type in buildcache.DEFINITION_TYPES
+        for token in references[def_type]}
+    return _Entry(aclcheck.FlowChecker(pol), fingerprint, digests,
+                  self._clock())
+
+
+def _MatchDict(match):
+  return {'filter': match.filter, 'term': match.term, 'action': match.action,
+          'possibles': match.possibles, 'qos': match.qos}
+
+
+def ResultDict(result):
+  """Returns the JSON representation of an aclcheck.CheckResult."""
+  return {'matches': [_MatchDict(m) for m in result.Matches()],
+          'exact_matches': [_MatchDict(m) for m in result.ExactMatches()]}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+  """Answers GET and POST /check requests from the server's PolicyStore."""
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    url = parse.urlparse(self.path)
+    if url.path != '/check':
+      self._Reply(404, {'error': 'unknown path %s' % url.path})
+      return
+    query = dict(parse.parse_qsl(url.query))
+    flow = {field: query[field] for field in FLOW_FIELDS if field in query}
+    self._Check(query.get('policy'), [flow], single=True)
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    if parse.urlparse(self.path).path != '/check':
+      self._Reply(404, {'error': 'unknown path %s' % self.path})
+      return
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+      request = json.loads(self.rfile.read(length))
+      flows = request['flows']
+      policy_file = request['policy']
+    except (ValueError, KeyError, TypeError) as e:
+      self._Reply(400, {'error': 'bad request: %s' % e})
+      return
+    self._Check(policy_file, flows, single=False)
+
+  def _Check(self, policy_file, flows, single):
+    if not policy_file:
+      self._Reply(400, {'error': 'missing policy'})
+      return
+    try:
+      checker = self.server.store.Checker(policy_file)
+      results = [
+          ResultDict(checker.Check(**{field: str(flow[field])
+                                      for field in FLOW_FIELDS
+                                      if field in flow}))
+          for flow in flows]
+    except PolicyNotFoundError as e:
+      self._Reply(404, {'error': str(e)})
+      return
+    except (aclcheck.Error, port.Error, TypeError) as e:
+      self._Reply(400, {'error': str(e).strip()})
+      return
+    except (policy.Error, naming.Error) as e:
+      self._Reply(500, {'error': 'unable to parse %s: %s' % (policy_file, e)})
+      return
+    self._Reply(200, results[0] if single else {'results': results})
+
+  def _Reply(self, status, body):
+    data = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def address_string(self):
+    # Unix socket clients have no address.
+    return str(self.client_address[0] if self.client_address else 'unix')
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    logging.debug(format, *args)
+
+
+class TCPServer(http.server.ThreadingHTTPServer):
+  """Serves a PolicyStore on a TCP address."""
+
+  def __init__(self, address, store):
+    self.store = store
+    super().__init__(address, Handler)
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """Serves a PolicyStore on a Unix socket."""
+
+  daemon_threads = True
+
+  def __init__(self, socket_path, store):
+    self.store = store
+    super().__init__(socket_path, Handler)
+
+
+def SetupFlags():
+  """Setup flags."""
+  flags.DEFINE_string(
+      'definitions_directory', './def',
+      'The directory where network and service definition files can be found.')
+  flags.DEFINE_string(
+      'base_directory', './policies',
+      'The base directory to look for policies and include files.')
+  flags.DEFINE_string('host', 'localhost', 'The address to listen on.')
+  flags.DEFINE_integer('port', 8642, 'The TCP port to listen on.')
+  flags.DEFINE_string(
+      'unix_socket', None,
+      'Listen on this Unix socket instead of a TCP port.')
+  flags.DEFINE_float(
+      'reload_interval', 1.0,
+      'Seconds during which policies and definitions are not checked for '
+      'changes again.')
+
+
+def main(argv):
+  del argv  # Unused.
+  store = PolicyStore(FLAGS.definitions_directory, FLAGS.base_directory,
+                      FLAGS.reload_interval)
+  if FLAGS.unix_socket:
+    if os.path.exists(FLAGS.unix_socket):
+      os.unlink(FLAGS.unix_socket)
+    server = UnixServer(FLAGS.unix_socket, store)
+    logging.info('listening on %s', FLAGS.unix_socket)
+  else:
+    server = TCPServer((FLAGS.host, FLAGS.port), store)
+    logging.info('listening on %s:%d', FLAGS.host, FLAGS.port)
+  with server:
+    server.serve_forever()
+
+
+def EntryPoint():
+  """Read in flags and call main()."""
+  SetupFlags()
+  app.run(main)
+
+
+if __name__ == '__main__':
+  EntryPoint()
@@ -15,10 +15,19 @@
 """Renders policy source files into actual Access Control Lists."""
 
 import copy
+import functools
+import heapq
+import itertools
 import multiprocessing
+import os
 import pathlib
+import pickle
+import queue
+import shutil
 import sys
-from typing import Iterator, List, Tuple
+import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 from absl import app
 from absl import flags
@@ -53,10 +62,123 @@ from capirca.lib import policy
 from capirca.lib import speedway
 from capirca.lib import srxlo
 from capirca.lib import windows_advfirewall
+from capirca.utils import atomicfile
+from capirca.utils import buildcache
+from capirca.utils import buildtimes
 from capirca.utils import config
+from capirca.utils import manifest
+from capirca.utils import profiling
 
 FLAGS = flags.FLAGS
-WriteList = List[Tuple[pathlib.Path, str]]
+
+
+class RenderedFile(NamedTuple):
+  """An ACL rendered to a temporary file, waiting to be written."""
+  path: str
+  # the manifest.TextDigest of the rendered text.
+  digest: str
+
+  def Discard(self):
+    """Remove the temporary file."""
+    try:
+      os.unlink(self.path)
+    except FileNotFoundError:
+      pass
+
+
+WriteList = List[Tuple[pathlib.Path, Union[str, RenderedFile]]]
+
+
+class RenderResult(NamedTuple):
+  """What rendering a policy produced and depended on."""
+  input_file: pathlib.Path
+  # a list of file tuples, (output_file, acl_text), to write.
+  write_files: WriteList
+  # the rendered files, or None if the policy had shading errors.
+  outputs: Optional[List[pathlib.Path]]
+  # the network and service tokens looked up, by definition type.
+  references: Dict[str, List[str]]
+  # the digests of the rendered files checked against the output manifest.
+  rendered: Dict[str, str]
+
+
+class PlatformTask(NamedTuple):
+  """A platform of a parsed policy to render in a pool process."""
+  input_file: pathlib.Path
+  output_directory: pathlib.Path
+  # a file holding the pickled policy, shared by the platforms of the policy.
+  snapshot: str
+  # the index in RENDERERS of the generator.
+  renderer: int
+
+
+class ParsedPolicy(NamedTuple):
+  """A policy parsed in a pool process, with the platforms it targets."""
+  input_file: pathlib.Path
+  # the platforms to render, or None if the policy had shading errors.
+  tasks: Optional[List[PlatformTask]]
+  # the network and service tokens looked up, by definition type.
+  references: Dict[str, List[str]]
+  # the size of the pickled policy, or None if there are no tasks.
+  snapshot_size: Optional[int]
+  # the seconds parsing and pickling the policy took.
+  seconds: float
+  # what the process profiled since its last result, see profiling.Collect.
+  profile: Optional[dict] = None
+
+
+class PlatformResult(NamedTuple):
+  """What rendering a platform of a policy in a pool process produced."""
+  task: PlatformTask
+  write_files: WriteList
+  # the rendered file, or None if the generator failed.
+  output: Optional[pathlib.Path]
+  # the digests of the rendered files checked against the output manifest.
+  rendered: Dict[str, str]
+  # the ACLGeneratorError message if the generator failed.
+  error: Optional[str]
+  # the seconds loading the policy and rendering the platform took.
+  seconds: float
+  # what the process profiled since its last result, see profiling.Collect.
+  profile: Optional[dict] = None
+
+
+# (platform, generator, output suffix prefix) in the order they are rendered.
+RENDERERS = [
+    ('juniper', juniper.Juniper, ''),
+    ('juniperevo', juniperevo.JuniperEvo, ''),
+    ('msmpc', junipermsmpc.JuniperMSMPC, ''),
+    ('srx', junipersrx.JuniperSRX, ''),
+    ('cisco', cisco.Cisco, ''),
+    ('ciscoasa', ciscoasa.CiscoASA, ''),
+    ('aruba', aruba.Aruba, ''),
+    ('brocade', brocade.Brocade, ''),
+    ('arista', arista.Arista, ''),
+    ('arista_tp', arista_tp.AristaTrafficPolicy, ''),
+    ('ipset', ipset.Ipset, ''),
+    ('iptables', iptables.Iptables, ''),
+    ('nsxv', nsxv.Nsxv, ''),
+    ('openconfig', openconfig.OpenConfig, ''),
+    ('speedway', speedway.Speedway, ''),
+    ('pcap', pcap.PcapFilter, '-accept'),
+    ('pcap', functools.partial(pcap.PcapFilter, invert=True), '-deny'),
+    ('packetfilter', packetfilter.PacketFilter, ''),
+    ('windows_advfirewall', windows_advfirewall.WindowsAdvFirewall, ''),
+    ('srxlo', srxlo.SRXlo, ''),
+    ('cisconx', cisconx.CiscoNX, ''),
+    ('ciscoxr', ciscoxr.CiscoXR, ''),
+    ('nftables', nftables.Nftables, ''),
+    ('gce', gce.GCE, ''),
+    ('gcp_hf', gcp_hf.HierarchicalFirewall, ''),
+    ('paloalto', paloaltofw.PaloAltoFW, ''),
+    ('cloudarmor', cloudarmor.CloudArmor, ''),
+    ('k8s', k8s.K8s, ''),
+]
+
+# Definitions and output manifest of a rendering process, set once by
+# _InitRenderer.
+_DEFINITIONS = None
+_OUTPUT_MANIFEST = None
 
 
 def SetupFlags():
@@ -106,6 +228,32 @@ def SetupFlags():
       'exp_info', None,
       'Print a info message when a term is set to expire in that many weeks.\n(default: \'%s\')'
       % str(config.defaults['exp_info']))
+  flags.DEFINE_string(
+      'build_cache', None,
+      'File recording what each policy was rendered from. Policies whose '
+      'text, includes and referenced definitions are unchanged since the '
+      'recorded build, with the same capirca code, are skipped.')
+  flags.DEFINE_string(
+      'definitions_snapshot', None,
+      'File holding the parsed definitions, loaded instead of parsing the '
+      'definitions directory while its files are unchanged, and saved again '
+      'otherwise.')
+  flags.DEFINE_string(
+      'output_manifest', None,
+      'File recording a digest of each rendered file, so that rendered ACLs '
+      'are compared with it instead of reading the files on disk again.')
+  flags.DEFINE_string(
+      'build_times', None,
+      'File recording the time each policy took to render, so that the '
+      'slowest policies and platforms are started first in the next builds.')
+  flags.DEFINE_string(
+      'profile', None,
+      'JSON file receiving the time spent in each phase of rendering, for '
+      'each policy and in total.')
+  flags.DEFINE_string(
+      'profile_trace', None,
+      'File receiving each phase of rendering as a Chrome trace, for '
+      'chrome://tracing or Perfetto.')
   flags.DEFINE_multi_string(
       'config_file', None,
       'A yaml file with the configuration options for capirca')
@@ -145,7 +293,10 @@ def SkipLines(text, skip_line_func=False):
 def RenderFile(base_directory: str, input_file: pathlib.Path,
                output_directory: pathlib.Path, definitions: naming.Naming,
                exp_info: int, optimize: bool, shade_check: bool,
-               write_files: WriteList):
+               write_files: WriteList,
+               output_manifest: Optional[manifest.Manifest] = None,
+               platform_times: Optional[Dict[str, float]] = None
+              ) -> Optional[List[pathlib.Path]]:
   """Render a single file.
 
   Args:
@@ -158,42 +309,71 @@ def RenderFile(base_directory: str, input_file: pathlib.Path,
     optimize: a boolean indicating if we should turn on optimization or not.
     shade_check: should we raise an error if a term is completely shaded
     write_files: a list of file tuples, (output_file, acl_text), to write
+    output_manifest: optional manifest.Manifest of the rendered files, used to
+      tell if they changed without reading them.
+    platform_times: optional dict filled with the seconds rendering each
+      platform took, by platform name, see _PlatformName.
+
+  Returns:
+    the paths of the rendered files, or None if the policy had shading errors.
   """
-  output_relative = input_file.relative_to(base_directory).parent.parent
-  output_directory = output_directory / output_relative
+  output_directory = _OutputDirectory(base_directory, input_file,
+                                      output_directory)
 
   logging.debug('rendering file: %s into %s', input_file, output_directory)
 
-  pol = None
-  jcl = False
-  evojcl = False
-  acl = False
-  atp = False
-  asacl = False
-  aacl = False
-  bacl = False
-  eacl = False
-  gca = False
-  gcefw = False
-  gcphf = False
-  ips = False
-  ipt = False
-  msmpc = False
-  spd = False
-  nsx = False
-  oc = False
-  pcap_accept = False
-  pcap_deny = False
-  pf = False
-  srx = False
-  jsl = False
-  nft = False
-  win_afw = False
-  nxacl = False
-  xacl = False
-  paloalto = False
-  k8s_pol = False
+  pol = _ParsePolicyFile(base_directory, input_file, definitions, optimize,
+                         shade_check)
+  if pol is None:
+    return None
+
+  renderers = _Renderers(pol)
+  outputs = []
+  # files rendered before a generator fails are not written.
+  rendered = len(write_files)
 
+  try:
+    for index, renderer in enumerate(renderers):
+      start = time.perf_counter()
+      # Generators modify the policy they are handed, so each one needs its
+      # own copy.  Copies are taken lazily, one at a time, and the last
+      # generator consumes the parsed policy itself.
+      if index < len(renderers) - 1:
+        with profiling.Timer('deepcopy'):
+          platform_pol = copy.deepcopy(pol)
+      else:
+        platform_pol = pol
+      outputs.append(_RenderPlatform(
+          platform_pol, RENDERERS[renderer], input_file, output_directory,
+          exp_info, write_files, output_manifest))
+      del platform_pol
+      if platform_times is not None:
+        platform_times[_PlatformName(renderer)] = time.perf_counter() - start
+  except BaseException:
+    DiscardFiles(write_files[rendered:])
+    del write_files[rendered:]
+    raise
+  return outputs
+
+
+def _OutputDirectory(base_directory: str, input_file: pathlib.Path,
+                     output_directory: pathlib.Path) -> pathlib.Path:
+  """Return the directory the files rendered from a policy are placed in."""
+  output_relative = input_file.relative_to(base_directory).parent.parent
+  return output_directory / output_relative
+
+
+def _ParsePolicyFile(base_directory: str, input_file: pathlib.Path,
+                     definitions: naming.Naming, optimize: bool,
+                     shade_check: bool) -> Optional[policy.Policy]:
+  """Parse a policy file, see RenderFile.
+
+  Returns:
+    the parsed policy, or None if the policy had shading errors.
+
+  Raises:
+    ACLParserError: if the policy is not valid.
+  """
   try:
     with open(input_file) as f:
       conf = f.read()
@@ -203,7 +383,7 @@ def RenderFile(base_directory: str, input_file: pathlib.Path,
     raise
 
   try:
-    pol = policy.ParsePolicy(
+    return policy.ParsePolicy(
         conf,
         definitions,
         optimize=optimize,
@@ -211,216 +391,55 @@ def RenderFile(base_directory: str, input_file: pathlib.Path,
         shade_check=shade_check)
   except policy.ShadingError as e:
     logging.warning('shading errors for %s:\n%s', input_file, e)
-    return
+    return None
   except (policy.Error, naming.Error):
     raise ACLParserError('Error parsing policy file %s:\n%s%s' %
                          (input_file, sys.exc_info()[0], sys.exc_info()[1]))
 
+
+def _Renderers(pol: policy.Policy) -> List[int]:
+  """Return the indexes in RENDERERS of the generators a policy targets."""
   platforms = set()
   for header in pol.headers:
     platforms.update(header.platforms)
+  return [i for i, r in enumerate(RENDERERS) if r[0] in platforms]
 
-  if 'juniper' in platforms:
-    jcl = copy.deepcopy(pol)
-  if 'juniperevo' in platforms:
-    evojcl = copy.deepcopy(pol)
-  if 'cisco' in platforms:
-    acl = copy.deepcopy(pol)
-  if 'ciscoasa' in platforms:
-    asacl = copy.deepcopy(pol)
-  if 'brocade' in platforms:
-    bacl = copy.deepcopy(pol)
-  if 'arista' in platforms:
-    eacl = copy.deepcopy(pol)
-  if 'arista_tp' in platforms:
-    atp = copy.deepcopy(pol)
-  if 'aruba' in platforms:
-    aacl = copy.deepcopy(pol)
-  if 'ipset' in platforms:
-    ips = copy.deepcopy(pol)
-  if 'iptables' in platforms:
-    ipt = copy.deepcopy(pol)
-  if 'msmpc' in platforms:
-    msmpc = copy.deepcopy(pol)
-  if 'nsxv' in platforms:
-    nsx = copy.deepcopy(pol)
-  if 'openconfig' in platforms:
-    oc = copy.deepcopy(pol)
-  if 'packetfilter' in platforms:
-    pf = copy.deepcopy(pol)
-  if 'pcap' in platforms:
-    pcap_accept = copy.deepcopy(pol)
-    pcap_deny = copy.deepcopy(pol)
-  if 'speedway' in platforms:
-    spd = copy.deepcopy(pol)
-  if 'srx' in platforms:
-    srx = copy.deepcopy(pol)
-  if 'srxlo' in platforms:
-    jsl = copy.deepcopy(pol)
-  if 'windows_advfirewall' in platforms:
-    win_afw = copy.deepcopy(pol)
-  if 'cisconx' in platforms:
-    nxacl = copy.deepcopy(pol)
-  if 'ciscoxr' in platforms:
-    xacl = copy.deepcopy(pol)
-  if 'nftables' in platforms:
-    nft = copy.deepcopy(pol)
-  if 'gce' in platforms:
-    gcefw = copy.deepcopy(pol)
-  if 'gcp_hf' in platforms:
-    gcphf = copy.deepcopy(pol)
-  if 'paloalto' in platforms:
-    paloalto = copy.deepcopy(pol)
-  if 'cloudarmor' in platforms:
-    gca = copy.deepcopy(pol)
-  if 'k8s' in platforms:
-    k8s_pol = copy.deepcopy(pol)
-
-  acl_obj: aclgenerator.ACLGenerator
 
+def _PlatformName(renderer: int) -> str:
+  """Return a name telling apart the generators in RENDERERS."""
+  platform, _, suffix_prefix = RENDERERS[renderer]
+  return platform + suffix_prefix
+
+
+def _RenderPlatform(pol: policy.Policy, renderer, input_file: pathlib.Path,
+                    output_directory: pathlib.Path, exp_info: int,
+                    write_files: WriteList,
+                    output_manifest: Optional[manifest.Manifest]
+                   ) -> pathlib.Path:
+  """Render a policy for one platform, see RenderFile.
+
+  Args:
+    pol: the parsed policy, modified by the generator.
+    renderer: the (platform, generator, output suffix prefix) from RENDERERS.
+    input_file: the name of the input policy file.
+    output_directory: the directory in which we place the rendered file.
+    exp_info: print a info message when a term is set to expire in that many
+      weeks.
+    write_files: a list of file tuples, (output_file, acl_text), to write
+    output_manifest: optional manifest.Manifest of the rendered files.
+
+  Returns:
+    the path of the rendered file.
+
+  Raises:
+    ACLGeneratorError: if the generator rejects the policy.
+  """
+  _, generator, suffix_prefix = renderer
   try:
-    if jcl:
-      acl_obj = juniper.Juniper(jcl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if evojcl:
-      acl_obj = juniperevo.JuniperEvo(evojcl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if msmpc:
-      acl_obj = junipermsmpc.JuniperMSMPC(msmpc, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if srx:
-      acl_obj = junipersrx.JuniperSRX(srx, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if acl:
-      acl_obj = cisco.Cisco(acl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if asacl:
-      acl_obj = ciscoasa.CiscoASA(asacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if aacl:
-      acl_obj = aruba.Aruba(aacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if bacl:
-      acl_obj = brocade.Brocade(bacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if eacl:
-      acl_obj = arista.Arista(eacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if atp:
-      acl_obj = arista_tp.AristaTrafficPolicy(atp, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if ips:
-      acl_obj = ipset.Ipset(ips, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if ipt:
-      acl_obj = iptables.Iptables(ipt, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if nsx:
-      acl_obj = nsxv.Nsxv(nsx, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if oc:
-      acl_obj = openconfig.OpenConfig(oc, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if spd:
-      acl_obj = speedway.Speedway(spd, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if pcap_accept:
-      acl_obj = pcap.PcapFilter(pcap_accept, exp_info)
-      RenderACL(
-          str(acl_obj), '-accept' + acl_obj.SUFFIX, output_directory,
-          input_file, write_files)
-    if pcap_deny:
-      acl_obj = pcap.PcapFilter(pcap_deny, exp_info, invert=True)
-      RenderACL(
-          str(acl_obj), '-deny' + acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if pf:
-      acl_obj = packetfilter.PacketFilter(pf, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if win_afw:
-      acl_obj = windows_advfirewall.WindowsAdvFirewall(win_afw, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if jsl:
-      acl_obj = srxlo.SRXlo(jsl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if nxacl:
-      acl_obj = cisconx.CiscoNX(nxacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if xacl:
-      acl_obj = ciscoxr.CiscoXR(xacl, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if nft:
-      acl_obj = nftables.Nftables(nft, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if gcefw:
-      acl_obj = gce.GCE(gcefw, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if gcphf:
-      acl_obj = gcp_hf.HierarchicalFirewall(gcphf, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-
-    if paloalto:
-      acl_obj = paloaltofw.PaloAltoFW(paloalto, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-    if gca:
-      acl_obj = cloudarmor.CloudArmor(gca, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
-
-    if k8s_pol:
-      acl_obj = k8s.K8s(k8s_pol, exp_info)
-      RenderACL(
-          str(acl_obj), acl_obj.SUFFIX, output_directory, input_file,
-          write_files)
+    acl_obj: aclgenerator.ACLGenerator = generator(pol, exp_info)
+    return RenderACL(
+        acl_obj, suffix_prefix + acl_obj.SUFFIX, output_directory,
+        input_file, write_files, output_manifest=output_manifest)
 
   # TODO(robankeny) add additional errors.
   except (
@@ -442,64 +461,215 @@ def RenderFile(base_directory: str, input_file: pathlib.Path,
                             (input_file, e))
 
 
-def RenderACL(acl_text: str,
+def _InitRenderer(definitions: naming.Naming,
+                  output_manifest: Optional[manifest.Manifest] = None,
+                  profile: bool = False, trace: bool = False):
+  """Pool initializer storing the definitions for the process's lifetime.
+
+  With the fork start method the definitions are inherited from the parent;
+  otherwise they are serialized once per process rather than once per policy.
+
+  Args:
+    definitions: the definitions from naming.Naming().
+    output_manifest: optional manifest.Manifest of the rendered files.
+    profile: profile the process, see profiling.Enable.
+    trace: also record the runs of the timers for a trace.
+  """
+  global _DEFINITIONS, _OUTPUT_MANIFEST
+  _DEFINITIONS = definitions
+  _OUTPUT_MANIFEST = output_manifest
+  if profile:
+    # a forked process starts over rather than with the parent's profile.
+    profiling.Enable(trace)
+
+
+def _RenderTracked(definitions: naming.Naming, input_file: pathlib.Path,
+                   base_directory: str, output_directory: pathlib.Path,
+                   exp_info: int, optimize: bool, shade_check: bool,
+                   output_manifest: Optional[manifest.Manifest] = None,
+                   times: Optional[buildtimes.BuildTimes] = None
+                  ) -> RenderResult:
+  """Render a single file, recording the definitions it looked up.
+
+  The times it took are reported by times, but not kept for the next builds,
+  which only schedule the platforms rendered in a pool.
+  """
+  write_files: WriteList = []
+  platform_times = {}
+  start = time.perf_counter()
+  definitions.StartReferenceTracking()
+  try:
+    with profiling.File(input_file):
+      outputs = RenderFile(base_directory, input_file, output_directory,
+                           definitions, exp_info, optimize, shade_check,
+                           write_files, output_manifest, platform_times)
+  finally:
+    references = definitions.StopReferenceTracking()
+    rendered = output_manifest.TakeRendered() if output_manifest else {}
+  if times:
+    parse = time.perf_counter() - start - sum(platform_times.values())
+    times.Record(input_file, _FileSize(input_file), None, parse,
+                 platform_times)
+  return RenderResult(input_file, write_files, outputs, references, rendered)
+
+
+def _ParseFileInPool(input_file: pathlib.Path, base_directory: str,
+                     output_directory: pathlib.Path, optimize: bool,
+                     shade_check: bool, snapshot_directory: str
+                    ) -> ParsedPolicy:
+  """Parse a policy in a pool process set up by _InitRenderer.
+
+  The parsed policy is pickled once to a file in snapshot_directory, from
+  which every platform task loads its own copy.
+  """
+  start = time.perf_counter()
+  _DEFINITIONS.StartReferenceTracking()
+  try:
+    with profiling.File(input_file):
+      pol = _ParsePolicyFile(base_directory, input_file, _DEFINITIONS,
+                             optimize, shade_check)
+  finally:
+    references = _DEFINITIONS.StopReferenceTracking()
+  if pol is None:
+    return ParsedPolicy(input_file, None, references, None,
+                        time.perf_counter() - start, profiling.Collect())
+  renderers = _Renderers(pol)
+  if not renderers:
+    return ParsedPolicy(input_file, [], references, None,
+                        time.perf_counter() - start, profiling.Collect())
+  fd, snapshot = tempfile.mkstemp(dir=snapshot_directory, suffix='.pickle')
+  with profiling.File(input_file), profiling.Timer('snapshot.save'):
+    with open(fd, 'wb') as f:
+      pickle.dump(pol, f, pickle.HIGHEST_PROTOCOL)
+      snapshot_size = f.tell()
+  output_directory = _OutputDirectory(base_directory, input_file,
+                                      output_directory)
+  tasks = [PlatformTask(input_file, output_directory, snapshot, renderer)
+           for renderer in renderers]
+  return ParsedPolicy(input_file, tasks, references, snapshot_size,
+                      time.perf_counter() - start, profiling.Collect())
+
+
+def _RenderPlatformInPool(task: PlatformTask, exp_info: int) -> PlatformResult:
+  """Render a platform of a policy in a pool process set up by _InitRenderer."""
+  start = time.perf_counter()
+  write_files: WriteList = []
+  try:
+    with profiling.File(task.input_file):
+      with profiling.Timer('snapshot.load'), open(task.snapshot, 'rb') as f:
+        pol = pickle.load(f)
+      output = _RenderPlatform(pol, RENDERERS[task.renderer], task.input_file,
+                               task.output_directory, exp_info, write_files,
+                               _OUTPUT_MANIFEST)
+  except ACLGeneratorError as e:
+    DiscardFiles(write_files)
+    return PlatformResult(task, [], None, {}, str(e),
+                          time.perf_counter() - start, profiling.Collect())
+  except BaseException:
+    DiscardFiles(write_files)
+    raise
+  finally:
+    rendered = _OUTPUT_MANIFEST.TakeRendered() if _OUTPUT_MANIFEST else {}
+  return PlatformResult(task, write_files, output, rendered, None,
+                        time.perf_counter() - start, profiling.Collect())
+
+
+def RenderACL(acl: Union[str, aclgenerator.ACLGenerator],
               acl_suffix: str,
               output_directory: pathlib.Path,
               input_file: pathlib.Path,
-              write_files: List[Tuple[pathlib.Path, str]],
-              binary: bool = False):
+              write_files: WriteList,
+              binary: bool = False,
+              output_manifest: Optional[manifest.Manifest] = None
+             ) -> pathlib.Path:
   """Write the ACL string out to file if appropriate.
 
+  A generator is streamed through its Render method to a temporary file, so
+  large ACLs are never held in memory as a whole. With an output manifest,
+  the digest of the new text is compared with the recorded digest of the
+  output file, which is only read when it changed since it was recorded.
+
   Args:
-    acl_text: Rendered output of an ACL Generator.
+    acl: An ACL Generator, or its rendered output.
     acl_suffix: File suffix to append to output filename.
     output_directory: The directory to write the output file.
     input_file: The name of the policy file that was used to render ACL.
     write_files: A list of file tuples, (output_file, acl_text), to write.
     binary: Boolean if the rendered ACL is in binary format.
+    output_manifest: optional manifest.Manifest of the rendered files.
+
+  Returns:
+    The path of the output file.
   """
-  input_filename = input_file.with_suffix(acl_suffix).name
+  # not with_suffix, which rejects the '-accept.pcap' suffixes of pcap.
+  input_filename = input_file.stem + acl_suffix
   output_file = output_directory / input_filename
 
-  if FilesUpdated(output_file, acl_text, binary):
+  if isinstance(acl, aclgenerator.ACLGenerator):
+    acl = _RenderToFile(acl, output_file)
+  with profiling.Timer('diff'):
+    if output_manifest is not None and not binary:
+      if isinstance(acl, RenderedFile):
+        digest = acl.digest
+      else:
+        digest = manifest.TextDigest(acl)
+      updated = output_manifest.Changed(output_file, digest)
+    else:
+      updated = FilesUpdated(output_file, acl, binary)
+  if updated:
     logging.info('file changed: %s', output_file)
-    write_files.append((output_file, acl_text))
+    profiling.Count('files.changed')
+    write_files.append((output_file, acl))
   else:
     logging.debug('file not changed: %s', output_file)
+    profiling.Count('files.unchanged')
+    if isinstance(acl, RenderedFile):
+      acl.Discard()
+  return output_file
 
 
-def FilesUpdated(file_name: pathlib.Path, new_text: str, binary: bool) -> bool:
+def _RenderToFile(acl_obj: aclgenerator.ACLGenerator,
+                  output_file: pathlib.Path) -> RenderedFile:
+  """Render an ACL Generator to a new temporary file next to output_file."""
+  fd, path = atomicfile.Stage(output_file)
+  try:
+    with open(fd, 'w', newline='\n') as f, profiling.Timer(
+        '%s.Render' % type(acl_obj).__name__):
+      hasher = manifest.TextHasher(f)
+      acl_obj.Render(hasher)
+  except BaseException:
+    os.unlink(path)
+    raise
+  return RenderedFile(path, hasher.hexdigest())
+
+
+def FilesUpdated(file_name: pathlib.Path, new_text: Union[str, RenderedFile],
+                 binary: bool) -> bool:
   """Diff the rendered acl with what's already on disk.
 
+  Text files are compared by their manifest.TextDigest, which leaves out the
+  lines holding repository tags.
+
   Args:
     file_name: Name of file on disk to check against.
-    new_text: Text of newly generated ACL.
+    new_text: Text of newly generated ACL, or the file it was rendered to.
     binary: True if file is a binary format.
 
   Returns:
     Boolean if config does not equal new text.
   """
   if binary:
-    readmode = 'rb'
-  else:
-    readmode = 'r'
-  try:
-    with open(file_name, readmode) as f:
-      conf: str = str(f.read())
-  except IOError:
+    try:
+      with open(file_name, 'rb') as f:
+        return str(f.read()) != new_text
+    except IOError:
+      return True
+  conf_digest = manifest.FileDigest(file_name)
+  if conf_digest is None:
     return True
-  if not binary:
-    p4_id = '$I d:'.replace(' ', '')
-    p4_date = '$Da te:'.replace(' ', '')
-    p4_revision = '$Rev ision:'.replace(' ', '')
-
-    def P4Tags(text: str) -> bool:
-      return not (p4_id in text or p4_date in text or p4_revision in text)
-
-    filtered_conf = filter(P4Tags, conf.split('\n'))
-    filtered_text = filter(P4Tags, new_text.split('\n'))
-    return list(filtered_conf) != list(filtered_text)
-  return conf != new_text
+  if isinstance(new_text, RenderedFile):
+    return conf_digest != new_text.digest
+  return conf_digest != manifest.TextDigest(new_text)
 
 
 def DescendDirectory(input_dirname: str,
@@ -536,43 +706,149 @@ def DescendDirectory(input_dirname: str,
   return policy_files
 
 
-def WriteFiles(write_files: WriteList):
+def _FileSize(input_file: pathlib.Path) -> int:
+  """Return the size of a file, or 0 if it can't be read."""
+  try:
+    return input_file.stat().st_size
+  except OSError:
+    return 0
+
+
+def WriteFiles(write_files: WriteList) -> int:
   """Writes files to disk.
 
   Args:
-    write_files: List of file names and strings.
+    write_files: List of file names and strings or rendered files.
+
+  Returns:
+    The number of files written.
   """
   if write_files:
     logging.info('writing %d files to disk...', len(write_files))
-  else:
-    logging.info('no files changed, not writing to disk')
-  for output_file, file_contents in write_files:
-    _WriteFile(output_file, file_contents)
+  try:
+    with profiling.Timer('write'):
+      for output_file, file_contents in write_files:
+        _WriteFile(output_file, file_contents)
+  finally:
+    DiscardFiles(write_files)
+  return len(write_files)
+
+
+def DiscardFiles(write_files: WriteList):
+  """Remove the temporary files of rendered files that are not written."""
+  for _, file_contents in write_files:
+    if isinstance(file_contents, RenderedFile):
+      file_contents.Discard()
 
 
-def _WriteFile(output_file: pathlib.Path, file_contents: str):
+def _WriteFile(output_file: pathlib.Path,
+               file_contents: Union[str, RenderedFile]):
   """Inner file writing function.
 
+  The new file replaces output_file atomically, so a failed write leaves
+  the previous ACL in place.
+
   Args:
     output_file: Path to write to
-    file_contents: Data to write
+    file_contents: Data to write, or the file it was rendered to
   """
   try:
-    parent_path = pathlib.Path(output_file).parent
-    if not parent_path.is_dir():
-      parent_path.mkdir(parents=True, exist_ok=True)
-    with open(output_file, 'w') as output:
-      logging.info('writing file: %s', output_file)
-      output.write(file_contents)
+    logging.info('writing file: %s', output_file)
+    if isinstance(file_contents, RenderedFile):
+      os.replace(file_contents.path, output_file)
+    else:
+      with atomicfile.Open(output_file) as output:
+        output.write(file_contents)
   except IOError:
     logging.warning('error while writing file: %s', output_file)
     raise
 
 
+class _PolicyInFlight:
+  """The platforms of a policy rendered in a pool, as their results arrive."""
+
+  def __init__(self, parsed: ParsedPolicy):
+    self.parsed = parsed
+    self.results: List[PlatformResult] = []
+
+  def Add(self, result: PlatformResult) -> bool:
+    """Add the result of a platform, returning True once all have arrived."""
+    self.results.append(result)
+    return len(self.results) == len(self.parsed.tasks)
+
+  @property
+  def failed(self) -> bool:
+    return any(result.error for result in self.results)
+
+  def Discard(self):
+    """Remove the temporary files of the rendered platforms."""
+    for result in self.results:
+      DiscardFiles(result.write_files)
+
+  def Result(self) -> RenderResult:
+    """Return what rendering every platform produced, in RENDERERS order."""
+    results = sorted(self.results, key=lambda result: result.task.renderer)
+    write_files = []
+    rendered = {}
+    for result in results:
+      write_files.extend(result.write_files)
+      rendered.update(result.rendered)
+    return RenderResult(self.parsed.input_file, write_files,
+                        [result.output for result in results],
+                        self.parsed.references, rendered)
+
+  def PlatformTimes(self) -> Dict[str, float]:
+    """Return the seconds rendering each platform took, by platform name."""
+    return {
+        _PlatformName(result.task.renderer): result.seconds
+        for result in self.results
+    }
+
+
+class _Scheduler:
+  """Runs jobs in a pool, starting the most expensive ready job first.
+
+  A pool starts its jobs in the order they are submitted, so jobs are only
+  submitted as processes become free, and more jobs can be added while the
+  results of the first ones arrive.
+  """
+
+  def __init__(self, pool, processes: int):
+    self._pool = pool
+    self._processes = processes
+    # (-cost, order, function, args) of the jobs not submitted yet.
+    self._ready = []
+    self._order = itertools.count()
+    self._running = 0
+    self._done = queue.SimpleQueue()
+
+  def Add(self, cost: float, function, *args):
+    """Add a job estimated to take cost seconds."""
+    heapq.heappush(self._ready, (-cost, next(self._order), function, args))
+
+  def Results(self):
+    """Yield the result of each job, or the exception it raised, as it ends."""
+    while self._ready or self._running:
+      while self._ready and self._running < self._processes:
+        _, _, function, args = heapq.heappop(self._ready)
+        self._pool.apply_async(function, args, callback=self._done.put,
+                               error_callback=self._done.put)
+        self._running += 1
+      result = self._done.get()
+      self._running -= 1
+      yield result
+
+
 def Run(base_directory: str, definitions_directory: str, policy_file: str,
         output_directory: str, exp_info: int, max_renderers: int,
         ignore_directories: List[str], optimize: bool, shade_check: bool,
-        context: multiprocessing.context.BaseContext):
+        context: multiprocessing.context.BaseContext,
+        build_cache: Optional[str] = None,
+        definitions_snapshot: Optional[str] = None,
+        output_manifest: Optional[str] = None,
+        build_times: Optional[str] = None,
+        profile: Optional[str] = None,
+        profile_trace: Optional[str] = None):
   """Generate ACLs.
 
   Args:
@@ -583,62 +859,173 @@ def Run(base_directory: str, definitions_directory: str, policy_file: str,
     output_directory: directory in which rendered files are placed.
     exp_info: print a info message when a term is set to expire in that many
       weeks.
-    max_renderers: the number of renderers to run in parallel.
+    max_renderers: the number of renderers to run in parallel, also the most
+      processes parsing large definition files at once.
     ignore_directories: directories to ignore when searching for policy files.
     optimize: a boolean indicating if we should turn on optimization or not.
     shade_check: should we raise an error if a term is completely shaded.
     context: multiprocessing context
+    build_cache: optional path of a buildcache file; policies unchanged since
+      the build it records are not rendered again.
+    definitions_snapshot: optional path of a snapshot of the parsed
+      definitions, see naming.Naming.
+    output_manifest: optional path of a manifest of the rendered files,
+      telling if an output changed without reading it, see manifest.Manifest.
+    build_times: optional path of a file recording the time each policy took
+      to render, to start the slowest ones first in the next builds, see
+      buildtimes.BuildTimes.
+    profile: optional path of a JSON file receiving the timers and counters
+      of each policy and their totals, see profiling.Results.
+    profile_trace: optional path of a file receiving the runs of the timers
+      in the Chrome trace event format.
   """
+  if profile or profile_trace:
+    profiling.Enable(trace=bool(profile_trace))
   definitions = None
   try:
-    definitions = naming.Naming(definitions_directory)
+    with profiling.Timer('definitions'):
+      definitions = naming.Naming(definitions_directory,
+                                  snapshot_file=definitions_snapshot,
+                                  max_parsers=max_renderers)
   except naming.NoDefinitionsError:
     err_msg = 'bad definitions directory: %s' % definitions_directory
     logging.fatal(err_msg)
     return  # static type analyzer can't detect that logging.fatal exits program
 
-  # thead-safe list for storing files to write
-  manager: multiprocessing.managers.SyncManager = context.Manager()
-  write_files: WriteList = manager.list()
-
   with_errors = False
+  files_written = 0
   logging.info('finding policies...')
   if policy_file:
-    # render just one file
-    logging.info('rendering one file')
-    RenderFile(base_directory, pathlib.Path(policy_file),
-               pathlib.Path(output_directory), definitions, exp_info, optimize,
-               shade_check, write_files)
-  elif max_renderers == 1:
-    # If only one process, run it sequentially
-    policies = DescendDirectory(base_directory, ignore_directories)
-    for pol in policies:
-      RenderFile(base_directory, pol, pathlib.Path(output_directory),
-                 definitions, exp_info, optimize, shade_check, write_files)
+    policies = [pathlib.Path(policy_file)]
   else:
-    # render all files in parallel
     policies = DescendDirectory(base_directory, ignore_directories)
-    pool = context.Pool(processes=max_renderers)
-    results: List[multiprocessing.pool.AsyncResult] = []
-    for pol in policies:
-      results.append(
-          pool.apply_async(
-              RenderFile,
-              args=(base_directory, pol, output_directory, definitions,
-                    exp_info, optimize, shade_check, write_files)))
-    pool.close()
-    pool.join()
 
-    for result in results:
-      try:
-        result.get()
-      except (ACLParserError, ACLGeneratorError) as e:
-        with_errors = True
-        logging.warning('\n\nerror encountered in rendering process:\n%s\n\n',
-                        e)
-
-  # actually write files to disk
-  WriteFiles(write_files)
+  cache = None
+  if build_cache:
+    cache = buildcache.BuildCache(
+        build_cache, definitions, base_directory,
+        buildcache.Options(output_directory, exp_info, optimize, shade_check))
+    stale = [pol for pol in policies if not cache.IsFresh(pol)]
+    logging.info('%d of %d policies unchanged since the cached build',
+                 len(policies) - len(stale), len(policies))
+    policies = stale
+
+  file_manifest = None
+  if output_manifest:
+    file_manifest = manifest.Manifest(output_manifest)
+  times = buildtimes.BuildTimes(build_times)
+
+  def Finish(result: RenderResult) -> int:
+    if cache and result.outputs is not None:
+      cache.Update(result.input_file, result.outputs, result.references)
+    with profiling.File(result.input_file):
+      files = WriteFiles(result.write_files)
+    if file_manifest:
+      file_manifest.Update(result.rendered)
+    return files
+
+  if policy_file or max_renderers == 1:
+    # render just one file, or if only one process, run it sequentially
+    if policy_file:
+      logging.info('rendering one file')
+    for pol in policies:
+      files_written += Finish(_RenderTracked(
+          definitions, pol, base_directory, pathlib.Path(output_directory),
+          exp_info, optimize, shade_check, file_manifest, times))
+  else:
+    # render all files in parallel, in two steps: every policy is parsed
+    # once, then each of its platforms is rendered as a task of its own, so
+    # the platforms of a large policy are rendered at the same time.
+    # only the policy path or the task is sent, the definitions and the
+    # output manifest are handed to every process once when it starts.
+    pool = context.Pool(
+        processes=max_renderers, initializer=_InitRenderer,
+        initargs=(definitions, file_manifest, profiling.Enabled(),
+                  profiling.Tracing()))
+    snapshot_directory = tempfile.mkdtemp(prefix='aclgen-')
+    in_flight: Dict[pathlib.Path, _PolicyInFlight] = {}
+    try:
+      parse = functools.partial(
+          _ParseFileInPool, base_directory=base_directory,
+          output_directory=pathlib.Path(output_directory), optimize=optimize,
+          shade_check=shade_check, snapshot_directory=snapshot_directory)
+      render = functools.partial(_RenderPlatformInPool, exp_info=exp_info)
+      # the jobs estimated to take longest are started first, so that the
+      # build does not wait for a large policy that happened to come last.
+      # a policy is parsed first of all when it, or one of its platforms,
+      # is slow.
+      scheduler = _Scheduler(pool, max_renderers)
+      sizes = {}
+      for pol in policies:
+        sizes[pol] = _FileSize(pol)
+        scheduler.Add(times.PolicyCost(pol, sizes[pol]), parse, pol)
+      for result in scheduler.Results():
+        if isinstance(result, ACLParserError):
+          with_errors = True
+          logging.warning(
+              '\n\nerror encountered in rendering process:\n%s\n\n', result)
+          continue
+        if isinstance(result, BaseException):
+          raise result
+        profiling.Merge(result.profile)
+        if isinstance(result, ParsedPolicy):
+          parsed = result
+          if not parsed.tasks:
+            # shading errors, or no platform to render.
+            times.Record(parsed.input_file, sizes[parsed.input_file], None,
+                         parsed.seconds, {})
+            outputs = None if parsed.tasks is None else []
+            files_written += Finish(RenderResult(
+                parsed.input_file, [], outputs, parsed.references, {}))
+            continue
+          in_flight[parsed.input_file] = _PolicyInFlight(parsed)
+          for task in parsed.tasks:
+            scheduler.Add(
+                times.PlatformCost(parsed.input_file,
+                                   _PlatformName(task.renderer),
+                                   parsed.snapshot_size), render, task)
+          continue
+        # rendered files are written as soon as every platform of their
+        # policy is done, so only the output of the policies in flight is
+        # held.
+        if result.error:
+          with_errors = True
+          logging.warning(
+              '\n\nerror encountered in rendering process:\n%s\n\n',
+              result.error)
+        rendering = in_flight[result.task.input_file]
+        if not rendering.Add(result):
+          continue
+        del in_flight[result.task.input_file]
+        os.unlink(result.task.snapshot)
+        parsed = rendering.parsed
+        times.Record(parsed.input_file, sizes[parsed.input_file],
+                     parsed.snapshot_size, parsed.seconds,
+                     rendering.PlatformTimes())
+        if rendering.failed:
+          rendering.Discard()
+        else:
+          files_written += Finish(rendering.Result())
+      pool.close()
+      pool.join()
+    finally:
+      pool.terminate()
+      for rendering in in_flight.values():
+        rendering.Discard()
+      shutil.rmtree(snapshot_directory, ignore_errors=True)
+
+  if cache:
+    cache.Save()
+  if file_manifest:
+    file_manifest.Save()
+  times.Save()
+  times.Report()
+  if profiling.Enabled():
+    profiling.Save(profile, profile_trace)
+    profiling.Disable()
+
+  if not files_written:
+    logging.info('no files changed, not writing to disk')
 
   if with_errors:
     logging.warning('done, with errors.')
@@ -668,7 +1055,10 @@ def main(argv):
   Run(configs['base_directory'], configs['definitions_directory'],
       configs['policy_file'], configs['output_directory'], configs['exp_info'],
       configs['max_renderers'], configs['ignore_directories'],
-      configs['optimize'], configs['shade_check'], context)
+      configs['optimize'], configs['shade_check'], context,
+      configs['build_cache'], configs['definitions_snapshot'],
+      configs['output_manifest'], configs['build_times'], configs['profile'],
+      configs['profile_trace'])
 
 
 def EntryPoint():
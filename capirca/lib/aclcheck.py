@@ -15,7 +15,12 @@
 
 """Check where hosts, ports and protocols are matched in a capirca policy."""
 
+import bisect
+import collections
+import functools
+import ipaddress
 import logging
+
 from capirca.lib import nacaddr
 from capirca.lib import policy
 from capirca.lib import port
@@ -37,7 +42,90 @@ class NoTargetError(Error):
   """Specified target platform not available in specified policy."""
 
 
-class AclCheck:
+class CheckResult:
+  """The terms of a policy that match a flow.
+
+  Attributes:
+    matches: A list of term-related matches.
+    exact_matches: A list of exact matches.
+  """
+
+  def __init__(self, matches=None, exact_matches=None):
+    self.matches = matches or []
+    self.exact_matches = exact_matches or []
+
+  def Matches(self):
+    """Return list of matched terms."""
+    return self.matches
+
+  def ExactMatches(self):
+    """Return matched terms, but not terms with possibles or action next."""
+    return self.exact_matches
+
+  def ActionMatch(self, action='any'):
+    """Return list of matched terms with specified actions."""
+    match_list = []
+    for match in self.matches:
+      if match.action:
+        if not match.possibles:
+          if action == 'any' or action in match.action:
+            match_list.append(match)
+    return match_list
+
+  def DescribeMatches(self):
+    """Provide sentence descriptions of matches.
+
+    Returns:
+      ret_str: text sentences describing matches
+    """
+    ret_str = []
+    for match in self.matches:
+      text = str(match)
+      ret_str.append(text)
+    return '\n'.join(ret_str)
+
+  def __str__(self):
+    text = []
+    last_filter = ''
+    for match in self.matches:
+      if match.filter != last_filter:
+        last_filter = match.filter
+        text.append('  filter: ' + match.filter)
+      if match.possibles:
+        text.append(' ' * 10 + 'term: ' + str(match.term) + ' (possible match)')
+      else:
+        text.append(' ' * 10 + 'term: ' + str(match.term))
+      if match.possibles:
+        text.append(' ' * 16 + match.action + ' if ' + str(match.possibles))
+      else:
+        text.append(' ' * 16 + match.action)
+    return '\n'.join(text)
+
+  @staticmethod
+  def _PossibleMatch(term):
+    """Ignore some options and keywords that are edge cases.
+
+    Args:
+      term: term object to examine for edge-cases
+
+    Returns:
+      ret_str: a list of reasons this term may possible match
+    """
+    ret_str = []
+    if 'first-fragment' in term.option:
+      ret_str.append('first-frag')
+    if term.fragment_offset:
+      ret_str.append('frag-offset')
+    if term.packet_length:
+      ret_str.append('packet-length')
+    if 'established' in term.option:
+      ret_str.append('est')
+    if 'tcp-established' in term.option and 'tcp' in term.protocol:
+      ret_str.append('tcp-est')
+    return ret_str
+
+
+class AclCheck(CheckResult):
   """Check where hosts, ports and protocols match in a NAC policy.
 
   Attributes:
@@ -107,8 +195,7 @@ class AclCheck:
     if not isinstance(self.pol_obj, (policy.Policy)):
       raise BadPolicyError('Policy object is not valid.')
 
-    self.matches = []
-    self.exact_matches = []
+    super().__init__()
     for header, terms in self.pol_obj.filters:
       filtername = header.target[0].options[0]
       for term in terms:
@@ -162,75 +249,6 @@ class AclCheck:
                                           term.action, term.qos))
           break
 
-  def Matches(self):
-    """Return list of matched terms."""
-    return self.matches
-
-  def ExactMatches(self):
-    """Return matched terms, but not terms with possibles or action next."""
-    return self.exact_matches
-
-  def ActionMatch(self, action='any'):
-    """Return list of matched terms with specified actions."""
-    match_list = []
-    for match in self.matches:
-      if match.action:
-        if not match.possibles:
-          if action == 'any' or action in match.action:
-            match_list.append(match)
-    return match_list
-
-  def DescribeMatches(self):
-    """Provide sentence descriptions of matches.
-
-    Returns:
-      ret_str: text sentences describing matches
-    """
-    ret_str = []
-    for match in self.matches:
-      text = str(match)
-      ret_str.append(text)
-    return '\n'.join(ret_str)
-
-  def __str__(self):
-    text = []
-    last_filter = ''
-    for match in self.matches:
-      if match.filter != last_filter:
-        last_filter = match.filter
-        text.append('  filter: ' + match.filter)
-      if match.possibles:
-        text.append(' ' * 10 + 'term: ' + str(match.term) + ' (possible match)')
-      else:
-        text.append(' ' * 10 + 'term: ' + str(match.term))
-      if match.possibles:
-        text.append(' ' * 16 + match.action + ' if ' + str(match.possibles))
-      else:
-        text.append(' ' * 16 + match.action)
-    return '\n'.join(text)
-
-  def _PossibleMatch(self, term):
-    """Ignore some options and keywords that are edge cases.
-
-    Args:
-      term: term object to examine for edge-cases
-
-    Returns:
-      ret_str: a list of reasons this term may possible match
-    """
-    ret_str = []
-    if 'first-fragment' in term.option:
-      ret_str.append('first-frag')
-    if term.fragment_offset:
-      ret_str.append('frag-offset')
-    if term.packet_length:
-      ret_str.append('packet-length')
-    if 'established' in term.option:
-      ret_str.append('est')
-    if 'tcp-established' in term.option and 'tcp' in term.protocol:
-      ret_str.append('tcp-est')
-    return ret_str
-
   def _AddrInside(self, addr, addresses):
     """Check if address is matched in another address or group of addresses.
 
@@ -287,6 +305,253 @@ class Match:
     return text
 
 
+def _Bits(indexes):
+  """Returns an integer with the bits of indexes set."""
+  bits = 0
+  for index in indexes:
+    bits |= 1 << index
+  return bits
+
+
+class _AddressIndex:
+  """The terms of a filter matching an address, see AclCheck._AddrInside.
+
+  Networks are kept by prefix length, so the networks containing an address
+  are found with one lookup per prefix length in use.
+  """
+
+  def __init__(self, term_addresses, all_terms):
+    """Build the index.
+
+    Args:
+      term_addresses: list of the address list of every term.
+      all_terms: bits of all terms.
+    """
+    self.all_terms = all_terms
+    # terms without addresses match every address.
+    self.wildcard = _Bits(i for i, addrs in enumerate(term_addresses)
+                          if not addrs)
+    # {version: {prefixlen: {network >> host bits: terms}}}
+    self.networks = {4: {}, 6: {}}
+    for index, addrs in enumerate(term_addresses):
+      for addr in addrs:
+        host_bits = addr.max_prefixlen - addr.prefixlen
+        networks = self.networks[addr.version].setdefault(addr.prefixlen, {})
+        key = int(addr.network_address) >> host_bits
+        networks[key] = networks.get(key, 0) | 1 << index
+    self.prefixlens = {
+        version: sorted((prefixlen, max_prefixlen - prefixlen, networks)
+                        for prefixlen, networks in by_prefixlen.items())
+        for version, by_prefixlen, max_prefixlen
+        in ((4, self.networks[4], 32), (6, self.networks[6], 128))}
+
+  def Match(self, addr):
+    """Returns the terms matching addr, a _FlowAddress or 'any'."""
+    if addr == 'any':
+      return self.all_terms
+    version, network, prefixlen = addr
+    bits = self.wildcard
+    for term_prefixlen, host_bits, networks in self.prefixlens[version]:
+      if term_prefixlen > prefixlen:
+        break
+      bits |= networks.get(network >> host_bits, 0)
+    return bits
+
+
+class _PortIndex:
+  """The terms of a filter matching a port, see AclCheck._PortInside.
+
+  The port ranges of all terms split 0-65535 into intervals matched by the
+  same terms, found by bisecting the interval starts.
+  """
+
+  def __init__(self, term_ports, all_terms):
+    """Build the index.
+
+    Args:
+      term_ports: list of the (first, last) port ranges of every term.
+      all_terms: bits of all terms.
+    """
+    self.all_terms = all_terms
+    # the terms whose ranges start and end before each port.
+    changes = collections.defaultdict(lambda: ([], []))
+    for index, ports in enumerate(term_ports):
+      # terms without ports match every port.
+      for first, last in ports or [(0, 65535)]:
+        changes[first][0].append(index)
+        changes[last + 1][1].append(index)
+    self.starts = sorted(changes)
+    self.terms = []
+    # ranges of a term may overlap when the policy is not optimized.
+    ranges = collections.Counter()
+    bits = 0
+    for start in self.starts:
+      added, removed = changes[start]
+      for index in added:
+        ranges[index] += 1
+        bits |= 1 << index
+      for index in removed:
+        ranges[index] -= 1
+        if not ranges[index]:
+          bits &= ~(1 << index)
+      self.terms.append(bits)
+
+  def Match(self, port_value):
+    """Returns the terms matching port_value, an int or 'any'."""
+    if port_value == 'any':
+      return self.all_terms
+    index = bisect.bisect_right(self.starts, port_value) - 1
+    if index < 0:
+      return 0
+    return self.terms[index]
+
+
+class _CompiledFilter:
+  """The terms of one filter of a policy, indexed by what they match."""
+
+  def __init__(self, filtername, terms):
+    # terms without an action (verbatim) never match.
+    terms = [term for term in terms if term.action]
+    self.matches = []
+    exact = []
+    for index, term in enumerate(terms):
+      possibles = CheckResult._PossibleMatch(term)  # pylint: disable=protected-access
+      self.matches.append(Match(filtername, term.name, possibles, term.action,
+                                term.qos))
+      if not possibles and 'next' not in term.action:
+        exact.append(index)
+    self.exact = _Bits(exact)
+    all_terms = (1 << len(terms)) - 1
+    self.source_address = _AddressIndex(
+        [term.source_address for term in terms], all_terms)
+    self.destination_address = _AddressIndex(
+        [term.destination_address for term in terms], all_terms)
+    self.source_port = _PortIndex(
+        [term.source_port for term in terms], all_terms)
+    self.destination_port = _PortIndex(
+        [term.destination_port for term in terms], all_terms)
+    self.all_terms = all_terms
+    self.any_protocol = _Bits(
+        i for i, term in enumerate(terms) if not term.protocol)
+    self.protocol = collections.defaultdict(int)
+    self.protocol_except = collections.defaultdict(int)
+    for index, term in enumerate(terms):
+      for proto in term.protocol:
+        self.protocol[proto] |= 1 << index
+      for proto in term.protocol_except:
+        self.protocol_except[proto] |= 1 << index
+
+  def Check(self, src, dst, sport, dport, proto, result):
+    """Add the terms matching a flow to result, see AclCheck."""
+    bits = (self.source_address.Match(src) &
+            self.destination_address.Match(dst) &
+            self.source_port.Match(sport) &
+            self.destination_port.Match(dport))
+    if proto == 'any':
+      bits &= self.all_terms
+    else:
+      bits &= self.any_protocol | self.protocol.get(proto, 0)
+    bits &= ~self.protocol_except.get(proto, 0)
+    while bits:
+      bit = bits & -bits
+      bits ^= bit
+      match = self.matches[bit.bit_length() - 1]
+      result.matches.append(match)
+      if bit & self.exact:
+        result.exact_matches.append(match)
+        break
+
+
+@functools.lru_cache(maxsize=65536)
+def _FlowAddress(addr):
+  """Returns (version, network, prefixlen) of an address of a flow.
+
+  Args:
+    addr: a string for an IP address or network.
+
+  Returns:
+    tuple of the IP version, network address as integer and prefix length.
+
+  Raises:
+    ValueError: the address is not valid.
+  """
+  network = ipaddress.ip_network(addr)
+  return (network.version, int(network.network_address), network.prefixlen)
+
+
+class FlowChecker:
+  """Check many flows against a policy, with the results of AclCheck.
+
+  The terms of every filter are indexed once by source and destination
+  address, port and protocol, so a flow is checked without going through the
+  terms that cannot match it.
+
+  Example:
+    checker = FlowChecker(pol)
+    for result in checker.CheckFlows(flows):
+      print(result.ExactMatches())
+  """
+
+  def __init__(self, pol):
+    """Index the filters of a policy.
+
+    Args:
+      pol: policy.Policy object.
+
+    Raises:
+      BadPolicyError: pol is not a policy.Policy.
+    """
+    if not isinstance(pol, (policy.Policy)):
+      raise BadPolicyError('Policy object is not valid.')
+    self.pol_obj = pol
+    self._filters = [
+        _CompiledFilter(header.target[0].options[0], terms)
+        for header, terms in pol.filters]
+
+  def Check(self, src='any', dst='any', sport='any', dport='any',
+            proto='any'):
+    """Check one flow, see AclCheck for the arguments.
+
+    Returns:
+      CheckResult of the flow.
+
+    Raises:
+      port.BadPortValue: An invalid port is used
+      port.BadPortRange: A port is outside of the acceptable range 0-65535
+      AddressError: Incorrect ip address or format
+    """
+    if sport != 'any':
+      sport = port.Port(sport)
+    if dport != 'any':
+      dport = port.Port(dport)
+    if src != 'any':
+      try:
+        src = _FlowAddress(src)
+      except ValueError:
+        raise AddressError('bad source address: %s\n' % src)
+    if dst != 'any':
+      try:
+        dst = _FlowAddress(dst)
+      except ValueError:
+        raise AddressError('bad destination address: %s\n' % dst)
+    result = CheckResult()
+    for compiled in self._filters:
+      compiled.Check(src, dst, sport, dport, proto, result)
+    return result
+
+  def CheckFlows(self, flows):
+    """Check flows as they come.
+
+    Args:
+      flows: iterable of (src, dst, sport, dport, proto) tuples.
+
+    Yields:
+      CheckResult of every flow, in order.
+    """
+    for flow in flows:
+      yield self.Check(*flow)
+
+
 def main():
   pass
 
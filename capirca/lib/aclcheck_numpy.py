@@ -0,0 +1,332 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Check NumPy arrays of flows against a capirca policy.
+
+For every flow, this finds the term of each filter that aclcheck.AclCheck
+reports in ExactMatches(): the first term matching the flow that has neither
+possibles nor a 'next' action. Every column of flows is looked up, vectorized,
+in the intervals of values matched by the same terms, and the bitsets of terms
+found for each column are ANDed. Large flow logs, like a day of NetFlow, can be
+replayed against a policy in chunks of millions of rows.
+
+NumPy is an optional dependency of capirca: pip install capirca[numpy]
+"""
+
+import collections
+
+import numpy as np
+
+from capirca.lib import aclcheck
+from capirca.lib import aclgenerator
+from capirca.lib import policy
+
+# the term_index and action of flows without an exact match.
+NO_MATCH = -1
+# the names of the action codes of FilterMatches.action.
+ACTIONS = tuple(sorted(policy.ACTIONS))
+
+# IPv6 addresses are given as rows of (high, low) 64 bits integers.
+_IPV6 = np.dtype([('high', np.uint64), ('low', np.uint64)])
+_LOW_64 = (1 << 64) - 1
+_MAX_IPV4 = (1 << 32) - 1
+_MAX_IPV6 = (1 << 128) - 1
+# flows are checked in chunks of rows, to bound the memory of the bitsets.
+_CHUNK_ROWS = 1 << 16
+
+
+class FilterMatches:
+  """The exact match of every flow in one filter.
+
+  Attributes:
+    filter: name of the filter.
+    terms: names of the terms of the filter.
+    term_index: int32 array, the index in terms of the exact match of every
+      flow, or NO_MATCH.
+    action: int8 array, the index in ACTIONS of the action of the exact match
+      of every flow, or NO_MATCH.
+  """
+
+  def __init__(self, filtername, terms, term_index, action):
+    self.filter = filtername
+    self.terms = terms
+    self.term_index = term_index
+    self.action = action
+
+  def Actions(self):
+    """Returns the action names of every flow, '' without an exact match."""
+    return np.array(ACTIONS + ('',))[self.action]
+
+
+def _Value(value, dtype):
+  """Returns an integer as a value of dtype, (high, low) for IPv6."""
+  if dtype == _IPV6:
+    return (value >> 64, value & _LOW_64)
+  return value
+
+
+class _Dimension:
+  """The terms matching each value of one column of flows.
+
+  The ranges of all terms split the values into intervals matched by the same
+  terms. Each interval has a bitset of those terms, as 64 bits words.
+  """
+
+  def __init__(self, term_ranges, max_value, dtype, words):
+    """Build the intervals.
+
+    Args:
+      term_ranges: list of the (first, last) ranges of every term, None for a
+        term matching any value.
+      max_value: largest value of the column.
+      dtype: NumPy type of the values.
+      words: number of 64 bits words of the bitsets.
+    """
+    # the terms whose ranges start and end before each value.
+    changes = collections.defaultdict(lambda: ([], []))
+    changes[0] = ([], [])
+    for index, ranges in enumerate(term_ranges):
+      for first, last in [(0, max_value)] if ranges is None else ranges:
+        changes[first][0].append(index)
+        changes[last + 1][1].append(index)
+    starts = sorted(start for start in changes if start <= max_value)
+    # ranges of a term may overlap when the policy is not optimized.
+    ranges = collections.Counter()
+    bits = 0
+    table = []
+    for start in starts:
+      added, removed = changes[start]
+      for index in added:
+        ranges[index] += 1
+        bits |= 1 << index
+      for index in removed:
+        ranges[index] -= 1
+        if not ranges[index]:
+          bits &= ~(1 << index)
+      table.append([bits >> (64 * word) & _LOW_64 for word in range(words)])
+    self.starts = np.array([_Value(start, dtype) for start in starts], dtype)
+    self.table = np.array(table, np.uint64).reshape(len(starts), words)
+
+  def Match(self, values):
+    """Returns the bitsets of the terms matching values."""
+    return self.table[np.searchsorted(self.starts, values, side='right') - 1]
+
+
+def _Addresses(addresses, version):
+  if not addresses:
+    return None
+  return [(int(addr.network_address), int(addr.broadcast_address))
+          for addr in addresses if addr.version == version]
+
+
+def _ProtocolNumbers(protocols):
+  """Returns the protocol numbers of the protocol names of a term."""
+  numbers = set()
+  for proto in protocols:
+    if str(proto).isdigit():
+      numbers.add(int(proto))
+    elif proto in aclgenerator.Term.PROTO_MAP:
+      numbers.add(aclgenerator.Term.PROTO_MAP[proto])
+  return numbers
+
+
+def _Protocols(term):
+  """Returns the protocol number ranges a term matches, None for any."""
+  if not term.protocol and not term.protocol_except:
+    return None
+  numbers = set(range(256))
+  if term.protocol:
+    numbers = _ProtocolNumbers(term.protocol)
+  numbers -= _ProtocolNumbers(term.protocol_except)
+  return [(number, number) for number in numbers]
+
+
+class _CompiledFilter:
+  """The exact match terms of a filter, indexed by column."""
+
+  def __init__(self, filtername, terms):
+    self.filter = filtername
+    self.names = [term.name for term in terms]
+    # only exact matches decide what happens to a flow.
+    exact = [(index, term) for index, term in enumerate(terms)
+             if term.action and 'next' not in term.action and
+             not aclcheck.CheckResult._PossibleMatch(term)]  # pylint: disable=protected-access
+    self.term_index = np.array([index for index, _ in exact], np.int32)
+    self.action = np.array([ACTIONS.index(term.action[0]) for _, term in exact],
+                           np.int8)
+    words = max(1, (len(exact) + 63) // 64)
+    exact = [term for _, term in exact]
+    self.columns = {
+        ('source_address', 4): _Dimension(
+            [_Addresses(t.source_address, 4) for t in exact],
+            _MAX_IPV4, np.uint32, words),
+        ('source_address', 6): _Dimension(
+            [_Addresses(t.source_address, 6) for t in exact],
+            _MAX_IPV6, _IPV6, words),
+        ('destination_address', 4): _Dimension(
+            [_Addresses(t.destination_address, 4) for t in exact],
+            _MAX_IPV4, np.uint32, words),
+        ('destination_address', 6): _Dimension(
+            [_Addresses(t.destination_address, 6) for t in exact],
+            _MAX_IPV6, _IPV6, words),
+        'source_port': _Dimension(
+            [t.source_port or None for t in exact], 65535, np.int32, words),
+        'destination_port': _Dimension(
+            [t.destination_port or None for t in exact], 65535, np.int32,
+            words),
+        'protocol': _Dimension(
+            [_Protocols(t) for t in exact], 255, np.int32, words),
+    }
+    # the bitset of all terms, for flows without any column.
+    self.all_terms = _Dimension([None] * len(exact), 0, np.int32, words).table
+
+  def Check(self, columns, version, rows):
+    """Returns the FilterMatches of the columns of flows."""
+    term_index = np.full(rows, NO_MATCH, np.int32)
+    action = np.full(rows, NO_MATCH, np.int8)
+    for first in range(0, rows, _CHUNK_ROWS):
+      chunk = slice(first, first + _CHUNK_ROWS)
+      bits = None
+      for name, values in columns.items():
+        if values is None:
+          continue
+        key = (name, version) if name.endswith('address') else name
+        matched = self.columns[key].Match(values[chunk])
+        bits = matched if bits is None else bits & matched
+      if bits is None:
+        bits = np.repeat(self.all_terms, len(term_index[chunk]), axis=0)
+      # the lowest bit set of the first word that is not 0.
+      word = np.argmax(bits != 0, axis=1)
+      lowest = bits[np.arange(len(word)), word]
+      lowest &= ~lowest + np.uint64(1)
+      found = lowest != 0
+      position = word * 64 + np.log2(lowest, where=found,
+                                     out=np.zeros(len(word))).astype(np.int64)
+      term_index[chunk][found] = self.term_index[position[found]]
+      action[chunk][found] = self.action[position[found]]
+    return FilterMatches(self.filter, self.names, term_index, action)
+
+
+def _AddressColumn(values, name):
+  """Returns the IP version and column of an array of addresses.
+
+  Args:
+    values: array of IPv4 addresses as integers, or of IPv6 addresses as rows
+      of (high, low) 64 bits integers.
+    name: name of the argument, for errors.
+
+  Returns:
+    tuple of the IP version and the column.
+
+  Raises:
+    ValueError: values is not an array of addresses, or holds integers out of
+      the range of addresses.
+  """
+  values = np.asarray(values)
+  if values.ndim == 1:
+    _CheckRange(values, 32, name)
+    return 4, values.astype(np.uint32, copy=False)
+  if values.ndim == 2 and values.shape[1] == 2:
+    _CheckRange(values, 64, name)
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    return 6, values.view(_IPV6).reshape(len(values))
+  raise ValueError('%s must be an array of IPv4 integers or of (high, low) '
+                   'IPv6 integers, not of shape %s' % (name, values.shape))
+
+
+def _CheckRange(values, bits, name):
+  """Raises ValueError unless values are integers of at most bits bits.
+
+  Casting to unsigned integers would silently wrap the other values into
+  wrong addresses.
+  """
+  if not values.size:
+    return
+  if values.dtype.kind not in 'iu':
+    raise ValueError('%s must hold integers, not %s' % (name, values.dtype))
+  if int(values.min()) < 0 or int(values.max()) >= 1 << bits:
+    raise ValueError('%s holds integers out of the range [0, 2**%d)' %
+                     (name, bits))
+
+
+class FlowArrayChecker:
+  """Find the exact match of arrays of flows in every filter of a policy.
+
+  The results match aclcheck.AclCheck(...).ExactMatches() of each flow. As
+  in AclCheck, address excludes are ignored and a column that is not given
+  matches any term, like 'any'.
+
+  Example:
+    checker = FlowArrayChecker(pol)
+    for matches in checker.Check(src, dst, sport, dport, proto):
+      print(matches.filter, np.bincount(matches.term_index + 1))
+  """
+
+  def __init__(self, pol):
+    """Compile the filters of a policy.
+
+    Args:
+      pol: policy.Policy object.
+
+    Raises:
+      aclcheck.BadPolicyError: pol is not a policy.Policy.
+    """
+    if not isinstance(pol, policy.Policy):
+      raise aclcheck.BadPolicyError('Policy object is not valid.')
+    self._filters = [_CompiledFilter(header.target[0].options[0], terms)
+                     for header, terms in pol.filters]
+
+  def Check(self, src=None, dst=None, sport=None, dport=None, proto=None):
+    """Find the exact match of every flow.
+
+    Args:
+      src: array of source addresses, of IPv4 integers (e.g. uint32) or of
+        (high, low) IPv6 integers (uint64 array of shape (n, 2)).
+      dst: array of destination addresses, of the same IP version as src.
+      sport: array of source ports (e.g. uint16).
+      dport: array of destination ports (e.g. uint16).
+      proto: array of IP protocol numbers (e.g. uint8).
+
+    Returns:
+      list of FilterMatches, one for each filter of the policy.
+
+    Raises:
+      ValueError: the arrays are not of the same length, or addresses are not
+        of the same IP version.
+    """
+    columns = {'source_port': sport, 'destination_port': dport,
+               'protocol': proto}
+    for name in columns:
+      if columns[name] is not None:
+        columns[name] = np.asarray(columns[name])
+    versions = set()
+    for name, values in (('source_address', src),
+                         ('destination_address', dst)):
+      columns[name] = None
+      if values is not None:
+        version, columns[name] = _AddressColumn(values, name)
+        versions.add(version)
+    if len(versions) > 1:
+      raise ValueError('source and destination addresses must be of the same '
+                       'IP version')
+    version = versions.pop() if versions else 4
+    lengths = set(len(values) for values in columns.values()
+                  if values is not None)
+    if len(lengths) > 1:
+      raise ValueError('flow arrays must have the same length, not %s' %
+                       sorted(lengths))
+    rows = lengths.pop() if lengths else 0
+    return [compiled.Check(columns, version, rows)
+            for compiled in self._filters]
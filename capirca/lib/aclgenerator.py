@@ -21,8 +21,12 @@ import re
 import string
 
 from capirca.lib import policy
+from capirca.utils import profiling
 import six
 
+# Characters buffered by WriteLines before they are handed to the writer.
+WRITE_CHUNK_SIZE = 1 << 16
+
 
 # generic error class
 class Error(Exception):
@@ -319,7 +323,8 @@ class ACLGenerator:
       raise UnsupportedFilterError('\n %s' % '\n'.join(all_err))
     if all_warn:
       logging.debug('\n %s', '\n'.join(all_warn))
-    self._TranslatePolicy(pol, exp_info)
+    with profiling.Timer('%s._TranslatePolicy' % type(self).__name__):
+      self._TranslatePolicy(pol, exp_info)
 
   def _TranslatePolicy(self, pol, exp_info):
     # pylint: disable=unused-argument
@@ -398,6 +403,17 @@ class ACLGenerator:
     # all good.
     return supported_tokens, supported_sub_tokens
 
+  def Render(self, writer):
+    """Write the rendered filter to writer.
+
+    Generators with large outputs override this to write their filter in
+    chunks as it is rendered; by default the whole of str() is written at once.
+
+    Args:
+      writer: a text file object, or anything else with a write(str) method.
+    """
+    writer.write(str(self))
+
   # TODO(robankeny) Fix this function, it no longer does what it says.
   def FixHighPorts(self, term, af='inet', all_protocols_stateful=False):
     """Evaluate protocol and ports of term, return sane version of term.
@@ -547,6 +563,29 @@ def AddRepositoryTags(prefix='', rid=True, date=True, revision=True,
   return tags
 
 
+def WriteLines(writer, lines, joiner='\n'):
+  """Write joiner.join(lines) to writer in chunks.
+
+  Args:
+    writer: an object with a write(str) method.
+    lines: an iterable of text strings, consumed as they are written.
+    joiner: text written between consecutive lines.
+  """
+  chunk = []
+  size = 0
+  for index, line in enumerate(lines):
+    if index and joiner:
+      chunk.append(joiner)
+    chunk.append(line)
+    size += len(line)
+    if size >= WRITE_CHUNK_SIZE:
+      writer.write(''.join(chunk))
+      chunk = []
+      size = 0
+  if chunk:
+    writer.write(''.join(chunk))
+
+
 def WrapWords(textlist, size, joiner='\n'):
   r"""Insert breaks into the listed strings at specified width.
 
@@ -16,6 +16,7 @@
 """Cisco generator."""
 
 import datetime
+import io
 import ipaddress
 from typing import cast, Union
 
@@ -1082,17 +1083,30 @@ class Cisco(aclgenerator.ACLGenerator):
     return target
 
   def __str__(self):
-    target_header = []
-    target = []
+    output = io.StringIO()
+    self.Render(output)
+    return output.getvalue()
+
+  def Render(self, writer):
+    aclgenerator.WriteLines(writer, self._RenderLines())
+
+  def _RenderLines(self):
+    """Yield the text joined by newlines to form the configuration."""
+    # the object groups of every policy come first, latest policy first.
+    for (_, filter_name, filter_list, _, obj_target
+        ) in reversed(self.cisco_policies):
+      if 'object-group' in filter_list:
+        obj_target.AddName(filter_name)
+      if obj_target.valid:
+        yield str(obj_target)
+
     # add the p4 tags
-    target.extend(aclgenerator.AddRepositoryTags('! '))
+    yield from aclgenerator.AddRepositoryTags('! ')
 
     for (header, filter_name, filter_list, terms, obj_target
         ) in self.cisco_policies:
       for filter_type in filter_list:
-        target.extend(self._AppendTargetByFilterType(filter_name, filter_type))
-        if filter_type == 'object-group':
-          obj_target.AddName(filter_name)
+        target = self._AppendTargetByFilterType(filter_name, filter_type)
 
         # Add the Perforce Id/Date tags, these must come after
         # remove/re-create of the filter, otherwise config mode doesn't
@@ -1110,16 +1124,12 @@ class Cisco(aclgenerator.ACLGenerator):
                 target.append('access-list %s remark %s' % (filter_name, line))
               else:
                 target.append(' remark %s' % line)
+        yield from target
 
         # now add the terms
         for term in terms:
           term_str = str(term)
           if term_str:
-            target.append(term_str)
+            yield term_str
 
-      if obj_target.valid:
-        target = [str(obj_target)] + target
-      # ensure that the header is always first
-      target = target_header + target
-      target += ['', 'exit', '']
-    return '\n'.join(target)
+      yield from ('', 'exit', '')
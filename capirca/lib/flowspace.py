@@ -0,0 +1,499 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Flows matched by policy terms, as unions of boxes.
+
+Every term is modeled as a union of boxes in the five dimensions of a flow:
+protocol, source and destination address, source and destination port. Each
+side of a box is a sorted tuple of disjoint (first, last) integer intervals,
+built from the addresses without their excludes, ports and protocols of the
+term. IPv6 addresses are offset by 2**128, so that both versions share each
+address dimension.
+
+Subtracting boxes splits what is left into disjoint boxes. The terms of a
+FilterSpace overlapping some boxes are looked up in an index of the aligned,
+prefix-like blocks of the intervals of every term, in the dimension where the
+boxes are the most selective.
+
+Criteria that are not modeled, like options, ICMP types or tags, make a term
+match fewer flows than its boxes; such terms are not exact.
+"""
+
+import bisect
+import collections
+import ipaddress
+
+from capirca.lib import aclgenerator
+
+# protocol, source and destination address, source and destination port.
+DIMENSIONS = 5
+PROTOCOL, SOURCE, DESTINATION, SOURCE_PORT, DESTINATION_PORT = range(
+    DIMENSIONS)
+_PROTOCOLS = ((0, 255),)
+_PORTS = ((0, 65535),)
+_OFFSET = {4: 0, 6: 1 << 128}
+_ADDRESSES = {4: ((0, (1 << 32) - 1),),
+              6: ((1 << 128, (1 << 129) - 1),)}
+# term attributes restricting the flows matched in ways that are not modeled.
+_UNMODELED = (
+    'destination_interface', 'destination_prefix', 'destination_prefix_except',
+    'destination_tag', 'dscp_except', 'dscp_match', 'ether_type',
+    'flexible_match_range', 'forwarding_class', 'forwarding_class_except',
+    'fragment_offset', 'hop_limit', 'icmp_code', 'icmp_type', 'option',
+    'packet_length', 'pan_application', 'platform', 'platform_exclude',
+    'precedence', 'restrict_address_family', 'source_interface',
+    'source_prefix', 'source_prefix_except', 'source_tag',
+    'target_resources', 'target_service_accounts', 'traffic_type', 'ttl',
+    'vpn')
+
+
+class Error(Exception):
+  """Base error class."""
+
+
+class TooManyPiecesError(Error):
+  """Boxes were split in more pieces than allowed."""
+
+
+def _Merge(intervals):
+  """Returns the sorted, disjoint union of (first, last) intervals."""
+  merged = []
+  for first, last in sorted(intervals):
+    if merged and first <= merged[-1][1] + 1:
+      if last > merged[-1][1]:
+        merged[-1] = (merged[-1][0], last)
+    else:
+      merged.append((first, last))
+  return tuple(merged)
+
+
+def _Intersect(a, b):
+  """Returns the intersection of two sorted, disjoint interval tuples."""
+  i = j = 0
+  result = []
+  while i < len(a) and j < len(b):
+    first = max(a[i][0], b[j][0])
+    last = min(a[i][1], b[j][1])
+    if first <= last:
+      result.append((first, last))
+    if a[i][1] < b[j][1]:
+      i += 1
+    else:
+      j += 1
+  return tuple(result)
+
+
+def _Difference(a, b):
+  """Returns the intervals of a that are not in b."""
+  result = []
+  j = 0
+  for first, last in a:
+    while j < len(b) and b[j][1] < first:
+      j += 1
+    k = j
+    while k < len(b) and b[k][0] <= last:
+      if b[k][0] > first:
+        result.append((first, b[k][0] - 1))
+      first = max(first, b[k][1] + 1)
+      if first > last:
+        break
+      k += 1
+    if first <= last:
+      result.append((first, last))
+  return tuple(result)
+
+
+def Intersection(a, b):
+  """Returns the intersection of two boxes, None if they are disjoint."""
+  result = []
+  for x, y in zip(a, b):
+    sides = _Intersect(x, y)
+    if not sides:
+      return None
+    result.append(sides)
+  return tuple(result)
+
+
+def _BoxDifference(a, b):
+  """Returns the disjoint boxes of a that are not in b, None if disjoint."""
+  common = Intersection(a, b)
+  if common is None:
+    return None
+  pieces = []
+  for dimension in range(len(a)):
+    rest = _Difference(a[dimension], b[dimension])
+    if rest:
+      pieces.append(common[:dimension] + (rest,) + a[dimension + 1:])
+  return pieces
+
+
+def Overlap(boxes, others):
+  """Returns whether two lists of boxes overlap."""
+  return any(Intersection(a, b) for a in boxes for b in others)
+
+
+def Subtract(boxes, others, max_pieces):
+  """Subtract others from boxes.
+
+  Args:
+    boxes: list of boxes.
+    others: list of boxes to remove from them.
+    max_pieces: most boxes left before giving up.
+
+  Returns:
+    tuple of the boxes left, or None when giving up, and whether others
+    overlapped boxes.
+  """
+  overlapped = False
+  for other in others:
+    left = []
+    for box in boxes:
+      pieces = _BoxDifference(box, other)
+      if pieces is None:
+        left.append(box)
+      else:
+        overlapped = True
+        left.extend(pieces)
+    if len(left) > max_pieces:
+      return None, overlapped
+    boxes = left
+    if not boxes:
+      break
+  return boxes, overlapped
+
+
+def Union(boxes, max_pieces):
+  """Returns disjoint boxes matching the flows of boxes.
+
+  Raises:
+    TooManyPiecesError: more than max_pieces boxes are needed.
+  """
+  disjoint = []
+  for box in boxes:
+    pieces, _ = Subtract([box], disjoint, max_pieces)
+    if pieces is None:
+      raise TooManyPiecesError('more than %d pieces' % max_pieces)
+    disjoint.extend(pieces)
+    if len(disjoint) > max_pieces:
+      raise TooManyPiecesError('more than %d pieces' % max_pieces)
+  return disjoint
+
+
+def Compact(boxes):
+  """Returns fewer boxes with the same flows, merging boxes whose sides only
+  differ in one dimension."""
+  for _ in range(2):
+    for dimension in range(DIMENSIONS):
+      merged = collections.OrderedDict()
+      for box in boxes:
+        key = box[:dimension] + box[dimension + 1:]
+        merged.setdefault(key, []).extend(box[dimension])
+      boxes = [key[:dimension] + (_Merge(sides),) + key[dimension:]
+               for key, sides in merged.items()]
+  return boxes
+
+
+def IsAny(dimension, intervals):
+  """Returns whether the intervals of a dimension match anything."""
+  if dimension == PROTOCOL:
+    return intervals == _PROTOCOLS
+  if dimension in (SOURCE, DESTINATION):
+    return intervals == _ADDRESSES[4] + _ADDRESSES[6]
+  return intervals == _PORTS
+
+
+def IsFamilies(intervals):
+  """Returns whether the intervals of an address dimension are whole families.
+  """
+  return all(interval in (_ADDRESSES[4][0], _ADDRESSES[6][0])
+             for interval in intervals)
+
+
+def Networks(intervals):
+  """Returns the ipaddress networks of the intervals of an address dimension.
+  """
+  networks = []
+  for first, last in intervals:
+    if first >= _OFFSET[6]:
+      networks.extend(ipaddress.summarize_address_range(
+          ipaddress.IPv6Address(first - _OFFSET[6]),
+          ipaddress.IPv6Address(last - _OFFSET[6])))
+    else:
+      networks.extend(ipaddress.summarize_address_range(
+          ipaddress.IPv4Address(first), ipaddress.IPv4Address(last)))
+  return networks
+
+
+def _Dimension(boxes, dimension):
+  """Returns the intervals of all the boxes in a dimension."""
+  return _Merge(interval for box in boxes for interval in box[dimension])
+
+
+def _Blocks(first, last):
+  """Yields the (size, start) aligned blocks of 2**size integers of a range."""
+  while first <= last:
+    size = (first & -first).bit_length() - 1 if first else last.bit_length()
+    while first + (1 << size) - 1 > last:
+      size -= 1
+    yield size, first
+    first += 1 << size
+
+
+class _BlockIndex:
+  """The terms overlapping intervals of one dimension.
+
+  The intervals of every term are split in aligned blocks, like network
+  prefixes. Two blocks overlap when one contains the other: the blocks
+  containing a block are looked up by size, the blocks it contains are
+  contiguous once sorted by start.
+  """
+
+  def __init__(self):
+    self.blocks = collections.defaultdict(list)
+    self.sizes = []
+    self.starts = []
+    self.counts = []
+
+  def Add(self, index, intervals):
+    """Index the intervals of the term at index."""
+    blocks = set()
+    for first, last in intervals:
+      blocks.update(_Blocks(first, last))
+    for block in blocks:
+      self.blocks[block].append(index)
+
+  def Freeze(self):
+    """Sort the blocks once every term is added."""
+    self.sizes = sorted(set(size for size, _ in self.blocks))
+    self.starts = sorted((start, size) for size, start in self.blocks)
+    total = 0
+    self.counts = [0]
+    for start, size in self.starts:
+      total += len(self.blocks[(size, start)])
+      self.counts.append(total)
+
+  def _Contained(self, size, start):
+    """Returns the slice of self.starts in the block of size at start."""
+    low = bisect.bisect_left(self.starts, (start, -1))
+    high = bisect.bisect_left(self.starts, (start + (1 << size), -1))
+    return low, high
+
+  def _Containing(self, size, start):
+    for larger in self.sizes[bisect.bisect_left(self.sizes, size):]:
+      block = (larger, start >> larger << larger)
+      if block in self.blocks:
+        yield block
+
+  def Count(self, intervals):
+    """Returns how many terms the intervals overlap, or more."""
+    count = 0
+    for first, last in intervals:
+      for size, start in _Blocks(first, last):
+        low, high = self._Contained(size, start)
+        count += self.counts[high] - self.counts[low]
+        count += sum(len(self.blocks[block])
+                     for block in self._Containing(size, start))
+    return count
+
+  def Lookup(self, intervals):
+    """Returns the indexes of the terms the intervals may overlap."""
+    indexes = set()
+    for first, last in intervals:
+      for size, start in _Blocks(first, last):
+        low, high = self._Contained(size, start)
+        for start_, size_ in self.starts[low:high]:
+          indexes.update(self.blocks[(size_, start_)])
+        for block in self._Containing(size, start):
+          indexes.update(self.blocks[block])
+    return indexes
+
+
+def _Ranges(addresses, version):
+  """Returns the merged intervals of the addresses of a version."""
+  offset = _OFFSET[version]
+  ranges = []
+  for addr in addresses:
+    if addr.version == version:
+      first = int(addr.network_address) + offset
+      ranges.append((first,
+                     first + (1 << addr.max_prefixlen - addr.prefixlen) - 1))
+  return _Merge(ranges)
+
+
+def _AddressRanges(addresses, excludes, version):
+  """Returns the intervals of addresses of a version, None for any."""
+  if not addresses and not excludes:
+    return None
+  ranges = _Ranges(addresses, version) if addresses else _ADDRESSES[version]
+  if excludes:
+    ranges = _Difference(ranges, _Ranges(excludes, version))
+  return ranges
+
+
+def _ProtocolNumbers(protocols):
+  """Returns the protocol numbers of names, None if one is unknown."""
+  numbers = []
+  for proto in protocols:
+    if str(proto).isdigit():
+      numbers.append(int(proto))
+    elif aclgenerator.Term.PROTO_MAP.get(proto, -1) >= 0:
+      numbers.append(aclgenerator.Term.PROTO_MAP[proto])
+    else:
+      return None
+  return _Merge((number, number) for number in numbers)
+
+
+class TermSpace:
+  """The boxes of a term and what it decides for the flows it matches.
+
+  Attributes:
+    name: name of the term.
+    terminating: whether flows matching the term stop at it.
+    decision: hashable action and forwarding of the term.
+    exact: whether the boxes are exactly the flows matched by the term.
+    boxes: list of the boxes of the flows matched by the term.
+  """
+
+  def __init__(self, term):
+    self.name = term.name
+    self.terminating = 'next' not in term.action
+    self.decision = (tuple(sorted(term.action)), term.routing_instance,
+                     str(term.next_ip), term.encapsulate)
+    self.unmodeled = tuple((name, str(getattr(term, name)))
+                           for name in _UNMODELED if getattr(term, name))
+    self.exact = not self.unmodeled
+    self.boxes = self._Boxes(term)
+
+  def _Boxes(self, term):
+    """Returns the boxes of the flows matched by term."""
+    protocols = _PROTOCOLS
+    if term.protocol:
+      protocols = _ProtocolNumbers(term.protocol)
+    if term.protocol_except:
+      excluded = _ProtocolNumbers(term.protocol_except)
+      protocols = None if excluded is None else _Difference(protocols,
+                                                            excluded)
+    if protocols is None:
+      self.exact = False
+      protocols = _PROTOCOLS
+    source_ports = _Merge(term.source_port) or _PORTS
+    destination_ports = _Merge(term.destination_port) or _PORTS
+    ports = [(source_ports, destination_ports)]
+    if term.port:
+      # port:: matches either the source or the destination port.
+      either = _Merge(term.port)
+      ports = [(_Intersect(source_ports, either), destination_ports),
+               (source_ports, _Intersect(destination_ports, either))]
+
+    boxes = []
+    for version in (4, 6):
+      sources = _AddressRanges(term.source_address,
+                               term.source_address_exclude, version)
+      destinations = _AddressRanges(term.destination_address,
+                                    term.destination_address_exclude, version)
+      if sources is None:
+        sources = _ADDRESSES[version]
+      if destinations is None:
+        destinations = _ADDRESSES[version]
+      addresses = [(sources, destinations)]
+      either = _AddressRanges(term.address, term.address_exclude, version)
+      if either is not None:
+        addresses = [(_Intersect(sources, either), destinations),
+                     (sources, _Intersect(destinations, either))]
+      for source, destination in addresses:
+        for source_port, destination_port in ports:
+          box = (protocols, source, destination, source_port,
+                 destination_port)
+          if all(box):
+            boxes.append(box)
+    return boxes
+
+
+class FilterSpace:
+  """The TermSpace of the terms of a filter, indexed to find overlaps."""
+
+  def __init__(self, terms):
+    """Model and index terms.
+
+    Args:
+      terms: list of policy.Term objects, in the order of the filter. Terms
+        without an action (verbatim) never match and inactive ones are not
+        rendered: both are left out, with the terms matching nothing.
+    """
+    self.terms = [TermSpace(term) for term in terms
+                  if term.action and not term.inactive]
+    self.terms = [term for term in self.terms if term.boxes]
+    self.indexes = [_BlockIndex() for _ in range(DIMENSIONS)]
+    for index, term in enumerate(self.terms):
+      for dimension, block_index in enumerate(self.indexes):
+        block_index.Add(index, _Dimension(term.boxes, dimension))
+    for block_index in self.indexes:
+      block_index.Freeze()
+
+  def Overlapping(self, boxes):
+    """Returns the sorted indexes in self.terms of the terms overlapping boxes.
+    """
+    queries = [_Dimension(boxes, dimension) for dimension in range(DIMENSIONS)]
+    dimension = min(range(DIMENSIONS),
+                    key=lambda d: self.indexes[d].Count(queries[d]))
+    candidates = self.indexes[dimension].Lookup(queries[dimension])
+    return sorted(i for i in candidates
+                  if Overlap(boxes, self.terms[i].boxes))
+
+  def FirstMatches(self, boxes, max_pieces):
+    """Split boxes by the terminating term their flows match first.
+
+    Args:
+      boxes: list of disjoint boxes.
+      max_pieces: most boxes left unmatched.
+
+    Returns:
+      list of (TermSpace, boxes) tuples, in the order of the terms, and a
+      last (None, boxes) tuple of the boxes matching no term, if any.
+
+    Raises:
+      TooManyPiecesError: more than max_pieces boxes are left unmatched.
+    """
+    matches = []
+    for index in self.Overlapping(boxes):
+      term = self.terms[index]
+      if not term.terminating:
+        continue
+      matched = []
+      for other in term.boxes:
+        left = []
+        for box in boxes:
+          common = Intersection(box, other)
+          if common is None:
+            left.append(box)
+          else:
+            matched.append(common)
+            left.extend(_BoxDifference(box, other))
+        boxes = left
+      if len(boxes) > max_pieces:
+        raise TooManyPiecesError('more than %d pieces' % max_pieces)
+      if matched:
+        matches.append((term, matched))
+      if not boxes:
+        break
+    if boxes:
+      matches.append((None, boxes))
+    return matches
+
+
+def FilterName(header):
+  """Returns the name of the filter of a policy.Header."""
+  target = header.target[0]
+  return target.options[0] if target.options else target.platform
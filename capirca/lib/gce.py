@@ -22,6 +22,7 @@ https://cloud.google.com/compute/docs/reference/latest/firewalls
 
 import copy
 import datetime
+import io
 import ipaddress
 import json
 import logging
@@ -29,6 +30,7 @@ import re
 
 from typing import Dict, Any
 
+from capirca.lib import aclgenerator
 from capirca.lib import gcp
 from capirca.lib import nacaddr
 import six
@@ -543,12 +545,18 @@ class GCE(gcp.GCP):
                  total_attribute_count)
 
   def __str__(self):
-    out = '%s\n\n' % (json.dumps(self.gce_policies, indent=2,
-                                 separators=(six.ensure_str(','),
-                                             six.ensure_str(': ')),
-                                 sort_keys=True))
-
-    return out
+    output = io.StringIO()
+    self.Render(output)
+    return output.getvalue()
+
+  def Render(self, writer):
+    encoder = json.JSONEncoder(indent=2,
+                               separators=(six.ensure_str(','),
+                                           six.ensure_str(': ')),
+                               sort_keys=True)
+    aclgenerator.WriteLines(writer, encoder.iterencode(self.gce_policies),
+                            joiner='')
+    writer.write('\n\n')
 
 
 def GetAttributeCount(dict_term: Dict[str, Any]) -> int:
@@ -20,8 +20,10 @@ performace of iptables firewall.
 
 """
 
+import io
 import string
 
+from capirca.lib import aclgenerator
 from capirca.lib import iptables
 from capirca.lib import nacaddr
 
@@ -180,19 +182,20 @@ class Ipset(iptables.Iptables):
                    'exists']
 
   # TODO(vklimovs): some not trivial processing is happening inside this
-  # __str__, replace with explicit method
-  def __str__(self):
-    # Actual rendering happens in __str__, so it has to be called
-    # before we do set specific part.
-    iptables_output = super().__str__()
+  # Render, replace with explicit method
+  def Render(self, writer):
+    # Actual rendering happens while the terms are rendered, so the iptables
+    # part has to be rendered before we do set specific part.
+    iptables_output = io.StringIO()
+    super().Render(iptables_output)
     output = []
     output.append(self._MARKER_BEGIN)
     for (_, _, _, _, terms) in self.iptables_policies:
       for term in terms:
         output.extend(self._GenerateSetConfig(term))
     output.append(self._MARKER_END)
-    output.append(iptables_output)
-    return '\n'.join(output)
+    output.append(iptables_output.getvalue())
+    aclgenerator.WriteLines(writer, output)
 
   def _GenerateSetConfig(self, term):
     """Generates set configuration for supplied term.
@@ -16,6 +16,7 @@
 """Iptables generator."""
 
 import datetime
+import io
 import re
 from string import Template  # pylint: disable=g-importing-member
 
@@ -801,51 +802,57 @@ class Iptables(aclgenerator.ACLGenerator):
     self.iptables_policies[0] = tuple(pol)
 
   def __str__(self):
-    target = []
+    output = io.StringIO()
+    self.Render(output)
+    return output.getvalue()
+
+  def Render(self, writer):
+    aclgenerator.WriteLines(writer, self._RenderLines())
+
+  def _RenderLines(self):
+    """Yield the text joined by newlines to form the filter."""
     pretty_platform = '%s%s' % (self._PLATFORM[0].upper(), self._PLATFORM[1:])
 
     if self._RENDER_PREFIX:
-      target.append(self._RENDER_PREFIX)
+      yield self._RENDER_PREFIX
 
     for (header, filter_name, filter_type, default_action, terms
         ) in self.iptables_policies:
       # Add comments for this filter
-      target.append('# %s %s Policy' % (pretty_platform,
-                                        header.FilterName(self._PLATFORM)))
+      yield '# %s %s Policy' % (pretty_platform,
+                                header.FilterName(self._PLATFORM))
 
       # reformat long text comments, if needed
       comments = aclgenerator.WrapWords(header.comment, 70)
       if comments and comments[0]:
         for line in comments:
-          target.append('# %s' % line)
-        target.append('#')
+          yield '# %s' % line
+        yield '#'
       # add the p4 tags
-      target.extend(aclgenerator.AddRepositoryTags('# '))
-      target.append('# ' + filter_type)
+      yield from aclgenerator.AddRepositoryTags('# ')
+      yield '# ' + filter_type
 
       if filter_name in self._GOOD_FILTERS:
         if default_action:
-          target.append(self._DEFAULTACTION_FORMAT % (filter_name,
-                                                      default_action))
+          yield self._DEFAULTACTION_FORMAT % (filter_name, default_action)
         elif self._PLATFORM == 'speedway':
           # always specify the default filter states for speedway,
           # if default action policy not specified for iptables, do nothing.
-          target.append(
-              self._DEFAULTACTION_FORMAT % (filter_name, self._DEFAULT_ACTION))
+          yield self._DEFAULTACTION_FORMAT % (filter_name,
+                                              self._DEFAULT_ACTION)
       else:
         # Custom chains have no concept of default policy.
-        target.append(self._DEFAULTACTION_FORMAT_CUSTOM_CHAIN % filter_name)
+        yield self._DEFAULTACTION_FORMAT_CUSTOM_CHAIN % filter_name
       # add the terms
       for term in terms:
         term_str = str(term)
         if term_str:
-          target.append(term_str)
+          yield term_str
 
     if self._RENDER_SUFFIX:
-      target.append(self._RENDER_SUFFIX)
+      yield self._RENDER_SUFFIX
 
-    target.append('')
-    return '\n'.join(target)
+    yield ''
 
 
 class Error(Exception):
@@ -16,6 +16,7 @@
 """Juniper JCL generator."""
 
 import datetime
+import io
 from absl import logging
 from capirca.lib import aclgenerator
 from capirca.lib import nacaddr
@@ -68,25 +69,57 @@ class Config:
   """Config allows a configuration to be assembled easily.
 
   Configurations are automatically indented following Juniper's style.
-  A textual representation of the config can be extracted with str().
+  A textual representation of the config can be extracted with str(), or the
+  config can be streamed to a writer, see Flush.
 
   Attributes:
     indent: The number of leading spaces on the current line.
     tabstop: The number of spaces to indent for a new level.
-    lines: the text lines of the configuration.
+    lines: the text lines of the configuration not yet written.
+    writer: an object with a write(str) method the lines are written to, or
+      None to keep every line.
   """
 
-  def __init__(self, indent=0, tabstop=4):
+  def __init__(self, indent=0, tabstop=4, writer=None):
     self.indent = indent
     self._initial_indent = indent
     self.tabstop = tabstop
     self.lines = []
+    self.writer = writer
+    self._size = 0
 
   def __str__(self):
+    self._CheckIndent()
+    return '\n'.join(self.lines)
+
+  def _CheckIndent(self):
     if self.indent != self._initial_indent:
       raise JuniperIndentationError(
           'Expected indent %d but got %d' % (self._initial_indent, self.indent))
-    return '\n'.join(self.lines)
+
+  def _AddLine(self, line):
+    self.lines.append(line)
+    if self.writer is not None:
+      self._size += len(line)
+      if self._size >= aclgenerator.WRITE_CHUNK_SIZE:
+        self._Write()
+
+  def _Write(self):
+    self.writer.write(''.join(line + '\n' for line in self.lines))
+    self.lines = []
+    self._size = 0
+
+  def Flush(self):
+    """Write the remaining lines of a complete configuration to the writer.
+
+    Lines are written as they are appended once enough of them are buffered,
+    each followed by a newline.
+
+    Raises:
+      JuniperIndentationError: If a block or comment was left open.
+    """
+    self._CheckIndent()
+    self._Write()
 
   def Append(self, line, verbatim=False):
     """Append one line to the configuration.
@@ -99,7 +132,7 @@ class Config:
         than the initial indent.  e.g. too many close braces.
     """
     if verbatim:
-      self.lines.append(line)
+      self._AddLine(line)
       return
 
     if line.endswith('}'):
@@ -107,7 +140,7 @@ class Config:
       if self.indent < self._initial_indent:
         raise JuniperIndentationError('Too many close braces.')
     spaces = ' ' * self.indent
-    self.lines.append(spaces + line.strip())
+    self._AddLine(spaces + line.strip())
     if not line.find('/*') >= 0 and line.find('*/') >= 0:
       self.indent -= 1
       if self.indent < self._initial_indent:
@@ -1037,7 +1070,16 @@ class Juniper(aclgenerator.ACLGenerator):
                                       interface_specific, filter_enhanced_mode, new_terms))
 
   def __str__(self):
-    config = Config()
+    output = io.StringIO()
+    self.Render(output)
+    return output.getvalue()
+
+  def Render(self, writer):
+    if not self.juniper_policies:
+      # an empty configuration is a single newline.
+      writer.write('\n')
+      return
+    config = Config(writer=writer)
 
     for (header, filter_name, filter_type, interface_specific, filter_enhanced_mode, terms
         ) in self.juniper_policies:
@@ -1074,4 +1116,4 @@ class Juniper(aclgenerator.ACLGenerator):
       config.Append('}')  # family inet { ... }
       config.Append('}')  # firewall { ... }
 
-    return str(config) + '\n'
+    config.Flush()
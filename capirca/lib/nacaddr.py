@@ -15,6 +15,7 @@
 
 """A subclass of the ipaddress library that includes comments for ipaddress."""
 
+import bisect
 import collections
 import ipaddress
 import itertools
@@ -92,6 +93,14 @@ class IPv4(ipaddress.IPv4Network):
       return False
     return self._is_subnet_of(other, self)
 
+  def __copy__(self):
+    # The address and netmask objects are immutable, so sharing them is much
+    # cheaper than going through __reduce__, which builds the network again
+    # from its address and prefix length.
+    result = self.__class__.__new__(self.__class__)
+    result.__dict__.update(self.__dict__)
+    return result
+
   def __deepcopy__(self, memo):
     result = self.__class__(self)
     result.text = self.text
@@ -99,6 +108,13 @@ class IPv4(ipaddress.IPv4Network):
     result.parent_token = self.parent_token
     return result
 
+  def __reduce__(self):
+    # ipaddress pickles the network as a string only, dropping the comment
+    # and tokens.
+    return (self.__class__, ((self.network_address._ip, self.prefixlen),),  # pylint: disable=protected-access
+            {'text': self.text, 'token': self.token,
+             'parent_token': self.parent_token})
+
   def AddComment(self, comment=''):
     """Append comment to self.text, comma separated.
 
@@ -171,6 +187,14 @@ class IPv6(ipaddress.IPv6Network):
       return False
     return self._is_subnet_of(other, self)
 
+  def __copy__(self):
+    # The address and netmask objects are immutable, so sharing them is much
+    # cheaper than going through __reduce__, which builds the network again
+    # from its address and prefix length.
+    result = self.__class__.__new__(self.__class__)
+    result.__dict__.update(self.__dict__)
+    return result
+
   def __deepcopy__(self, memo):
     result = self.__class__(self)
     result.text = self.text
@@ -178,6 +202,13 @@ class IPv6(ipaddress.IPv6Network):
     result.parent_token = self.parent_token
     return result
 
+  def __reduce__(self):
+    # ipaddress pickles the network as a string only, dropping the comment
+    # and tokens.
+    return (self.__class__, ((self.network_address._ip, self.prefixlen),),  # pylint: disable=protected-access
+            {'text': self.text, 'token': self.token,
+             'parent_token': self.parent_token})
+
   def supernet(self, prefixlen_diff=1):
     """Override ipaddress.IPv6Network supernet so we can maintain comments.
 
@@ -224,8 +255,75 @@ class IPv6(ipaddress.IPv6Network):
 IPType = Union[IPv4, IPv6]
 
 
+# Below this many subnet_of comparisons, scanning the lists beats building an
+# AddressSet. A single subnet is always checked by scanning.
+ADDRESS_SET_MIN_COMPARISONS = 64
+
+
+class AddressSet:
+  """A set of networks answering containment queries in logarithmic time.
+
+  A network is in the set if it is a subnet of one of the networks the set was
+  built from, like _InNetList. Adjacent networks are not merged, so
+  AddressSet([IP('10.0.0.0/25'), IP('10.0.0.128/25')]) does not contain
+  IP('10.0.0.0/24').
+
+  Two networks are either disjoint or one contains the other, so the set only
+  keeps the outermost networks, as sorted and disjoint integer intervals.
+  """
+
+  def __init__(self, addresses):
+    """Build the set.
+
+    Args:
+      addresses: iterable of IPv4 or IPv6 objects.
+    """
+    intervals = {4: [], 6: []}
+    for addr in addresses:
+      intervals[addr.version].append(
+          (int(addr.network_address), int(addr.broadcast_address)))
+    self._firsts = {}
+    self._lasts = {}
+    for version, version_intervals in intervals.items():
+      firsts = []
+      lasts = []
+      # outer networks sort before the networks they contain.
+      for first, last in sorted(version_intervals,
+                                key=lambda x: (x[0], -x[1])):
+        if lasts and last <= lasts[-1]:
+          continue
+        firsts.append(first)
+        lasts.append(last)
+      self._firsts[version] = firsts
+      self._lasts[version] = lasts
+
+  def __len__(self):
+    """Returns the number of outermost networks."""
+    return len(self._firsts[4]) + len(self._firsts[6])
+
+  def __contains__(self, addr):
+    """Returns True if addr is a subnet of one of the networks of the set."""
+    firsts = self._firsts[addr.version]
+    index = bisect.bisect_right(firsts, int(addr.network_address)) - 1
+    return (index >= 0 and
+            int(addr.broadcast_address) <= self._lasts[addr.version][index])
+
+  def Overlaps(self, addr):
+    """Returns True if addr shares any address with the set."""
+    firsts = self._firsts[addr.version]
+    index = bisect.bisect_right(firsts, int(addr.broadcast_address)) - 1
+    return (index >= 0 and
+            int(addr.network_address) <= self._lasts[addr.version][index])
+
+  def IsSuperSetOf(self, addresses):
+    """Returns True if every one of addresses is in the set."""
+    return all(addr in self for addr in addresses)
+
+
 def _InNetList(adders, ip):
   """Returns True if ip is contained in adders."""
+  if isinstance(adders, AddressSet):
+    return ip in adders
   for addr in adders:
     if ip.subnet_of(addr):
       return True
@@ -234,6 +332,9 @@ def _InNetList(adders, ip):
 
 def IsSuperNet(supernets, subnets):
   """Returns True if subnets are fully consumed by supernets."""
+  if (not isinstance(supernets, AddressSet) and len(subnets) > 1 and
+      len(supernets) * len(subnets) >= ADDRESS_SET_MIN_COMPARISONS):
+    supernets = AddressSet(supernets)
   for net in subnets:
     if not _InNetList(supernets, net):
       return False
@@ -254,102 +355,168 @@ def CollapseAddrListPreserveTokens(addresses):
                                lambda x: x.parent_token):
     ret_array.append(CollapseAddrList(list(grp[1])))
   dedup_array = []
+  # the AddressSet of each list in dedup_array, built once.
+  dedup_sets = []
   i = 0
   while len(ret_array) > i:
     ip = ret_array.pop(0)
+    ip_set = AddressSet(ip)
     k = 0
     to_add = True
     while k < len(dedup_array):
-      if IsSuperNet(dedup_array[k], ip):
+      if IsSuperNet(dedup_sets[k], ip):
         to_add = False
         break
-      elif IsSuperNet(ip, dedup_array[k]):
+      elif IsSuperNet(ip_set, dedup_array[k]):
         del dedup_array[k]
+        del dedup_sets[k]
       k += 1
     if to_add:
       dedup_array.append(ip)
+      dedup_sets.append(ip_set)
   return [i for sublist in dedup_array for i in sublist]
 
 
-def _SafeToMerge(address, merge_target, check_addresses):
-  """Determine if it's safe to merge address into merge target.
+_MAX_PREFIXLEN = {4: ipaddress.IPV4LENGTH, 6: ipaddress.IPV6LENGTH}
 
-  Checks given address against merge target and a list of check_addresses
-  if it's OK to roll address into merge target such that it not less specific
-  than any of the check_addresses. See description of why ir is important
-  within public function CollapseAddrList.
 
-  Args:
-    address: Address that is being merged.
-    merge_target: Merge candidate address.
-    check_addresses: A dict networks_address->addrs to compare specificity with.
+class _Network:
+  """An IPv4 or IPv6 network held as integers while collapsing.
 
-  Returns:
-    True if safe to merge, False otherwise.
+  Networks from the caller keep the nacaddr object in addr, and comments are
+  added to that object exactly as the object based merge did. Supernets
+  created while merging only become nacaddr objects in Address(), once they
+  are known to be part of the result.
   """
-  for check_address in check_addresses.get(address.network_address, []):
-    if merge_target.netmask <= check_address.netmask < address.netmask:
-      return False
-  return True
 
+  __slots__ = ('version', 'first', 'last', 'prefixlen', 'addr', '_text',
+               '_token')
+
+  def __init__(self, version, first, prefixlen, addr=None, text='', token=''):
+    self.version = version
+    self.first = first
+    self.last = first + (1 << (_MAX_PREFIXLEN[version] - prefixlen)) - 1
+    self.prefixlen = prefixlen
+    self.addr = addr
+    self._text = text
+    self._token = token
+
+  @classmethod
+  def FromAddress(cls, addr):
+    return cls(addr.version, addr.network_address._ip, addr.prefixlen, addr)  # pylint: disable=protected-access
+
+  @property
+  def text(self):
+    if self.addr is not None:
+      return self.addr.text
+    return self._text
+
+  @property
+  def token(self):
+    if self.addr is not None:
+      return self.addr.token
+    return self._token
+
+  def SortKey(self):
+    """Returns the key ipaddress.get_mixed_type_key gives the network."""
+    return self.version, self.first, self.prefixlen
+
+  def AddComment(self, comment):
+    """Same as IPv4.AddComment."""
+    if self.addr is not None:
+      self.addr.AddComment(comment)
+    elif self._text:
+      if comment and comment not in self._text:
+        self._text += ', ' + comment
+    else:
+      self._text = comment
+
+  def Supernet(self):
+    """Returns the enclosing network one bit shorter, like IPv4.Supernet."""
+    size = 1 << (_MAX_PREFIXLEN[self.version] - self.prefixlen + 1)
+    return _Network(self.version, self.first & -size, self.prefixlen - 1,
+                    text=self.text, token=self.token)
+
+  def Exclude(self, other):
+    """Returns the networks left of self once the subnet other is removed.
+
+    The networks are sorted, and are the same ones iputils.exclude_address
+    yields: the sibling of each network on the way from self down to other.
+    """
+    result = []
+    max_prefixlen = _MAX_PREFIXLEN[self.version]
+    for prefixlen in range(self.prefixlen + 1, other.prefixlen + 1):
+      size = 1 << (max_prefixlen - prefixlen)
+      first = other.first & -size
+      result.append(_Network(self.version, first ^ size, prefixlen))
+    result.sort(key=_Network.SortKey)
+    return result
+
+  def Address(self):
+    """Returns the network as a nacaddr object."""
+    if self.addr is not None:
+      return self.addr
+    if self.version == 4:
+      return IPv4((self.first, self.prefixlen), self._text, self._token)
+    return IPv6((self.first, self.prefixlen), self._text, self._token)
 
-def _CollapseAddrListInternal(addresses, complements_by_network):
+
+def _Networks(addresses):
+  """Returns the _Network of each address, in CollapseAddrList order."""
+  networks = [_Network.FromAddress(addr) for addr in addresses]
+  networks.sort(key=_Network.SortKey)
+  return networks
+
+
+def _CollapseNetworks(networks, complements=None):
   """Collapses consecutive netblocks until reaching a fixed point.
 
    Example:
 
-   ip1 = ipaddress.IPv4Network('1.1.0.0/24')
-   ip2 = ipaddress.IPv4Network('1.1.1.0/24')
-   ip3 = ipaddress.IPv4Network('1.1.2.0/24')
-   ip4 = ipaddress.IPv4Network('1.1.3.0/24')
-   ip5 = ipaddress.IPv4Network('1.1.4.0/24')
-   ip6 = ipaddress.IPv4Network('1.1.0.1/22')
-
-   _CollapseAddrListInternal([ip1, ip2, ip3, ip4, ip5, ip6]) ->
-   [IPv4Network('1.1.0.0/22'), IPv4Network('1.1.4.0/24')]
+   1.1.0.0/24, 1.1.1.0/24, 1.1.2.0/24, 1.1.3.0/24, 1.1.4.0/24, 1.1.0.1/22 ->
+   1.1.0.0/22, 1.1.4.0/24
 
    Note, this shouldn't be called directly, but is called via
-   CollapseAddrList([])
+   CollapseAddrList([]) and AddressListExclude([], []).
 
   Args:
-    addresses: List of IPv4 or IPv6 objects
-    complements_by_network: Dict of IPv4 or IPv6 objects indexed by
-      network_address, that if present will be considered to avoid harmful
-      optimizations.
+    networks: sorted list of _Network objects.
+    complements: dict of (version, network address integer) to the prefix
+      lengths of complement addresses there, that if present will be considered
+      to avoid harmful optimizations.
 
   Returns:
-    List of IPv4 or IPv6 objects (depending on what we were passed)
+    List of _Network objects.
   """
+  complements = complements or {}
   ret_array = []
-  for addr in addresses:
-    addr_is_fresh = True
-    while addr_is_fresh:
-      addr_is_fresh = False
+  for net in networks:
+    while True:
       if not ret_array:
-        ret_array.append(addr)
+        ret_array.append(net)
+        break
+      prev = ret_array[-1]
+      if prev.version != net.version:
+        ret_array.append(net)
+        break
+      # Merging net into prev must not make it less specific than one of the
+      # complement addresses at the same network address.
+      if any(prev.prefixlen <= prefixlen < net.prefixlen for prefixlen
+             in complements.get((net.version, net.first), ())):
+        ret_array.append(net)
+        break
+      if prev.first <= net.first and net.last <= prev.last:
+        # Preserve net's comment, then subsume it.
+        prev.AddComment(net.text)
+        break
+      if (prev.prefixlen == net.prefixlen and prev.last + 1 == net.first and
+          not prev.first & (prev.last - prev.first + 1)):
+        # Preserve net's comment, then merge with it.
+        prev.AddComment(net.text)
+        net = ret_array.pop().Supernet()
         continue
-
-      prev_addr = ret_array[-1]
-      if not _SafeToMerge(addr, prev_addr, complements_by_network):
-        ret_array.append(addr)
-      elif prev_addr.supernet_of(addr):
-        # Preserve addr's comment, then subsume it.
-        prev_addr.AddComment(addr.text)
-      elif (prev_addr.version == addr.version and
-            prev_addr.prefixlen == addr.prefixlen and
-            # It's faster to compare integers than IP objects
-            prev_addr.broadcast_address._ip + 1 == addr.network_address._ip and  # pylint disable=protected-access
-            # Generating Supernet is relatively intensive compared to doing bit
-            # operations
-            (prev_addr.netmask._ip << 1) & prev_addr.network_address._ip ==      # pylint disable=protected-access
-            prev_addr.network_address._ip):                                      # pylint disable=protected-access
-        # Preserve addr's comment, then merge with it.
-        prev_addr.AddComment(addr.text)
-        addr = ret_array.pop().Supernet()
-        addr_is_fresh = True
-      else:
-        ret_array.append(addr)
-
+      ret_array.append(net)
+      break
   return ret_array
 
 
@@ -379,13 +546,15 @@ def CollapseAddrList(addresses, complement_addresses=None):
   Returns:
     list of ipaddress.IPNetwork objects
   """
-  complements_dict = collections.defaultdict(list)
-  address_set = set([a.network_address for a in addresses])
-  for ca in complement_addresses or []:
-    if ca.network_address in address_set:
-      complements_dict[ca.network_address].append(ca)
-  return _CollapseAddrListInternal(
-      sorted(addresses, key=ipaddress.get_mixed_type_key), complements_dict)
+  networks = _Networks(addresses)
+  complements = collections.defaultdict(list)
+  if complement_addresses:
+    address_set = set(net.SortKey()[:2] for net in networks)
+    for ca in complement_addresses:
+      key = (ca.version, ca.network_address._ip)  # pylint: disable=protected-access
+      if key in address_set:
+        complements[key].append(ca.prefixlen)
+  return [net.Address() for net in _CollapseNetworks(networks, complements)]
 
 
 def SortAddrList(addresses):
@@ -428,11 +597,9 @@ def AddressListExclude(superset, excludes, collapse_addrs=True):
     a List of nacaddr IPv4 or IPv6 addresses
   """
   if collapse_addrs:
-    superset = CollapseAddrList(superset)[::-1]
-    excludes = CollapseAddrList(excludes)[::-1]
-  else:
-    superset = sorted(superset, reverse=True)
-    excludes = sorted(excludes, reverse=True)
+    return _ExcludeNetworks(superset, excludes)
+  superset = sorted(superset, reverse=True)
+  excludes = sorted(excludes, reverse=True)
 
   ret_array = []
   while superset and excludes:
@@ -444,10 +611,38 @@ def AddressListExclude(superset, excludes, collapse_addrs=True):
       ret_array.append(superset.pop())
     else:
       excludes.pop()
-  if collapse_addrs:
-    return CollapseAddrList(ret_array + superset)
-  else:
-    return sorted(set(ret_array + superset))
+  return sorted(set(ret_array + superset))
+
+
+def _ExcludeNetworks(superset, excludes):
+  """AddressListExclude for collapse_addrs, working on integer networks.
+
+  Args:
+    superset: a List of nacaddr IPv4 or IPv6 addresses
+    excludes: a List nacaddr IPv4 or IPv6 addresses
+
+  Returns:
+    a List of nacaddr IPv4 or IPv6 addresses
+  """
+  superset = _CollapseNetworks(_Networks(superset))[::-1]
+  excludes = _CollapseNetworks(_Networks(excludes))[::-1]
+  ret_array = []
+  while superset and excludes:
+    net = superset[-1]
+    exclude = excludes[-1]
+    if (net.version == exclude.version and net.first <= exclude.last and
+        exclude.first <= net.last):
+      superset.pop()
+      # networks either contain each other or are disjoint.
+      if net.prefixlen < exclude.prefixlen:
+        superset.extend(reversed(net.Exclude(exclude)))
+    elif net.SortKey() < exclude.SortKey():
+      ret_array.append(superset.pop())
+    else:
+      excludes.pop()
+  networks = ret_array + superset
+  networks.sort(key=_Network.SortKey)
+  return [net.Address() for net in _CollapseNetworks(networks)]
 
 
 ExcludeAddrs = AddressListExclude
@@ -44,14 +44,26 @@ DNS = 53/tcp
 
 """
 
+import array
+import collections
+import concurrent.futures
+import copy
 import glob
+import hashlib
+import ipaddress
+import marshal
+import mmap
+import numbers
 import os
 import re
+import socket
+import sys
 
 from absl import logging
 
 from capirca.lib import nacaddr
 from capirca.lib import port as portlib
+from capirca.utils import atomicfile
 
 
 class Error(Exception):
@@ -94,20 +106,444 @@ class NamingSyntaxError(Error):
   """A general syntax error for the definition."""
 
 
+class ReferenceCycleError(Error):
+  """Raised if a token includes itself through its nested tokens."""
+
+
+# matches the names of tokens, e.g. nested in the items of another token.
+_TOKEN_RE = re.compile(r'(^[-_A-Z0-9]+$)', re.IGNORECASE)
+# the prefix lengths _ParseIp parses without ipaddress: ASCII digits only.
+_PREFIXLEN_RE = re.compile(r'[0-9]+\Z')
+
+
+class _Item:
+  """An item of a token, split from its comment once.
+
+  The network fields are parsed on first access, so service items and
+  lookups that only need the value never parse them.
+
+  Attributes:
+    value: the item without its comment, e.g. '10.0.0.0/8' or 'INTERNAL'.
+    comment: the interned text following '#' in the item, or ''.
+    version: IP version of a network item, 0 if the item is a nested token
+      or not a network.
+    network: first address of a network item as an integer.
+    prefixlen: prefix length of a network item.
+  """
+
+  __slots__ = ('value', 'comment', 'version', 'network', 'prefixlen')
+
+  def __init__(self, raw_item):
+    value, _, comment = raw_item.partition('#')
+    self.value = value.strip()
+    # definitions often repeat comments, e.g. on every line of a token.
+    self.comment = sys.intern(comment)
+
+  def __getattr__(self, name):
+    if name not in ('version', 'network', 'prefixlen'):
+      raise AttributeError(name)
+    self.version, self.network, self.prefixlen = 0, None, None
+    if not _TOKEN_RE.match(self.value):
+      try:
+        self.version, self.network, self.prefixlen = _ParseIp(self.value)
+      except ValueError:
+        # a token which doesn't follow the recommended naming.
+        pass
+    return getattr(self, name)
+
+  def Raw(self):
+    """Return the item as parsed from the definitions."""
+    if self.comment:
+      # the format of the items of _DefinitionParser.
+      return self.value + ' #' + self.comment
+    return self.value
+
+
 class _ItemUnit:
   """This class is a container for an index key and a list of associated values.
 
   An ItemUnit will contain the name of either a service or network group,
   and a list of the associated values separated by spaces.
 
+  The items are kept as strings until ParsedItems is first called, then only
+  as _Item objects, so each item is split once and the strings are freed.
+
   Attributes:
     name: A string representing a unique token value.
-    items: a list of strings containing values for the token.
+    items: a list of strings containing values for the token, a new list once
+      the items are parsed: add items with AddItems.
   """
 
+  __slots__ = ('name', '_items', '_parsed')
+
   def __init__(self, symbol):
     self.name = symbol
-    self.items = []
+    self._items = []
+    self._parsed = None
+
+  @property
+  def items(self):
+    if self._parsed is None:
+      return self._items
+    return [item.Raw() for item in self._parsed]
+
+  @items.setter
+  def items(self, items):
+    self._items = items
+    self._parsed = None
+
+  def AddItems(self, items):
+    """Append item strings to the items of the token."""
+    if self._parsed is None:
+      self._items.extend(items)
+    else:
+      self._parsed.extend(_Item(raw_item) for raw_item in items)
+
+  def ParsedItems(self):
+    """Return the list of _Item of the token, parsing the items once."""
+    if self._parsed is None:
+      self._parsed = [_Item(raw_item) for raw_item in self._items]
+      self._items = None
+    return self._parsed
+
+
+# definition files smaller than this are parsed in the calling process even
+# when parallel parsers are allowed, a worker costs more than they take.
+PARALLEL_PARSE_BYTES = 1 << 20
+
+
+def _CollisionError(token):
+  return NamespaceCollisionError('%s %s' % (
+      '\nMultiple definitions found for service: ', token))
+
+
+class _DefinitionParser:
+  """Parse definition lines independently of any Naming object.
+
+  Nothing is shared with other parsers: many files can be parsed by separate
+  processes and their Result merged by Naming._MergeDefinitions in order.
+
+  Attributes:
+    definition_type: either 'networks' or 'services'.
+    port_re: Regular Expression matching valid port entries.
+    token_re: Regular Expression matching recommended token names.
+  """
+
+  def __init__(self, definition_type, port_re, token_re):
+    self.definition_type = definition_type
+    self.port_re = port_re
+    self.token_re = token_re
+    # values of the lines before the first token, which continue the last
+    # token parsed before them.
+    self._leading_items = []
+    self._leading_references = {}
+    self._definitions = {}
+    self._references = {}
+    self._items = self._leading_items
+    self._item_references = self._leading_references
+
+  def ParseLine(self, line):
+    """Parse a single line of a definition file.
+
+    Args:
+      line: A single line from a definition file.
+
+    Raises:
+      NamespaceCollisionError: when a token is defined twice.
+      NamingSyntaxError: Syntax error parsing config.
+    """
+    line = line.strip()
+    if not line or line[0] == '#':  # Skip comments and blanks.
+      return
+    comment = ''
+    if '#' in line:  # if there is a comment, save it
+      (line, comment) = line.split('#', 1)
+    line_parts = line.split('=')   # Split on var = val lines.
+    # the value field still has the comment at this point
+    # If there was '=', then do var and value
+    if len(line_parts) > 1:
+      current_symbol = line_parts[0].strip()  # varname left of '='
+      if not self.token_re.match(current_symbol):
+        logging.info('\nService name does not match recommended criteria: %s\nOnly A-Z, a-z, 0-9, -, and _ allowed' % current_symbol)
+      if self.definition_type == 'services':
+        for port in line_parts[1].strip().split():
+          if not self.port_re.match(port):
+            raise NamingSyntaxError('%s: %s' % (
+                'The following line has a syntax error', line))
+      if current_symbol in self._definitions:
+        raise _CollisionError(current_symbol)
+      self._items = self._definitions[current_symbol] = []
+      self._item_references = self._references
+      if not current_symbol:
+        # values of an empty token are dropped.
+        self._items = []
+        self._item_references = {}
+      values = line_parts[1]
+    # No '=', so this is a value only line
+    else:
+      values = line_parts[0]  # values for previous var are continued this line
+    items = self._items
+    for value_piece in values.split():
+      if comment:
+        items.append(value_piece + ' # ' + comment)
+      else:
+        items.append(value_piece)
+        # token?
+        if value_piece[0].isalpha() and ':' not in value_piece:
+          self._item_references[value_piece] = None
+
+  def Result(self):
+    """Return the parsed definitions.
+
+    Returns:
+      A (leading items, leading references, definitions, references) tuple:
+      the items of the value lines before the first token and the tokens they
+      refer to, the list of (token, items) defined, and the tokens referred to
+      by them, in order of first reference.
+    """
+    return (self._leading_items, list(self._leading_references),
+            list(self._definitions.items()), list(self._references))
+
+
+def _ParseDefinitionFile(file_name, definition_type, port_re, token_re):
+  """Parse a definition file, line by line, with a _DefinitionParser.
+
+  Args:
+    file_name: path of the definition file.
+    definition_type: either 'networks' or 'services'.
+    port_re: see _DefinitionParser.
+    token_re: see _DefinitionParser.
+
+  Returns:
+    The _DefinitionParser.Result of the file.
+  """
+  parser = _DefinitionParser(definition_type, port_re, token_re)
+  with open(file_name, 'r') as file_handle:
+    for line in file_handle:
+      parser.ParseLine(line)
+  return parser.Result()
+
+
+# Bump when the layout of definition snapshots changes.
+SNAPSHOT_VERSION = 1
+
+_SNAPSHOT_MAGIC = 'capirca-naming-snapshot'
+
+
+def _SourceDigests(naming_dir):
+  """Return the sorted (file name, sha256) of the definition files of a dir."""
+  digests = []
+  for def_file in sorted(glob.glob(os.path.join(naming_dir, '*.net')) +
+                         glob.glob(os.path.join(naming_dir, '*.svc'))):
+    with open(def_file, 'rb') as f:
+      digests.append((os.path.basename(def_file),
+                      hashlib.sha256(f.read()).hexdigest()))
+  return tuple(digests)
+
+
+def _PackPrefixes(prefixes, tokens):
+  """Pack the prefixes table of a _ParentIndex into bytes.
+
+  Args:
+    prefixes: the prefixes of a _ParentIndex of networks.
+    tokens: list of the network tokens, in definition order.
+
+  Returns:
+    A list of (version, prefixlen, networks, token numbers) tuples. networks
+    are the big-endian network addresses, token numbers an array of the
+    position in tokens of the token holding each network.
+  """
+  numbers_by_token = {token: number for number, token in enumerate(tokens)}
+  packed = []
+  for (version, prefixlen), by_network in prefixes.items():
+    width = 4 if version == 4 else 16
+    networks = bytearray()
+    token_numbers = array.array('I')
+    for network, holders in by_network.items():
+      for token in holders:
+        networks += network.to_bytes(width, 'big')
+        token_numbers.append(numbers_by_token[token])
+    packed.append((version, prefixlen, bytes(networks),
+                   token_numbers.tobytes()))
+  return packed
+
+
+def _UnpackPrefixes(packed, tokens):
+  """Return the prefixes table packed by _PackPrefixes."""
+  prefixes = {}
+  for version, prefixlen, networks, token_numbers in packed:
+    width = 4 if version == 4 else 16
+    numbers_array = array.array('I')
+    numbers_array.frombytes(token_numbers)
+    by_network = {}
+    for position, number in enumerate(numbers_array):
+      start = position * width
+      network = int.from_bytes(networks[start:start + width], 'big')
+      by_network.setdefault(network, []).append(tokens[number])
+    prefixes[(version, prefixlen)] = by_network
+  return prefixes
+
+
+def _ParseIp(address):
+  """Return the version, first address and prefixlen of an IP string.
+
+  Args:
+    address: an IP string ('10.1.1.1' or '10.1.0.0/16').
+
+  Returns:
+    A (version, first address as an integer, prefixlen) tuple.
+
+  Raises:
+    ValueError: if address is not an IP.
+  """
+  # faster than ipaddress for the common case of plain addresses and
+  # prefixes of a length.
+  ip, slash, length = address.partition('/')
+  if not slash or _PREFIXLEN_RE.match(length):
+    if ':' in ip:
+      family, version, width = socket.AF_INET6, 6, 128
+    else:
+      family, version, width = socket.AF_INET, 4, 32
+    prefixlen = int(length) if slash else width
+    try:
+      first = int.from_bytes(socket.inet_pton(family, ip), 'big')
+    except OSError:
+      first = None
+    if first is not None and prefixlen <= width:
+      host_bits = width - prefixlen
+      return version, first >> host_bits << host_bits, prefixlen
+  net = ipaddress.ip_network(address, strict=False)
+  return net.version, int(net.network_address), net.prefixlen
+
+
+def _NetworkPrefixes(query_group):
+  """Return the tokens holding each network of a definition group.
+
+  Args:
+    query_group: the networks of a Naming object.
+
+  Returns:
+    A dict mapping (version, prefixlen) to a dict of integer network address
+    to the tokens containing that network.
+  """
+  prefixes = collections.defaultdict(lambda: collections.defaultdict(list))
+  for token, unit in query_group.items():
+    for item in unit.ParsedItems():
+      if item.value[:1].isdigit() and item.version:
+        prefixes[(item.version, item.prefixlen)][item.network].append(token)
+  return prefixes
+
+
+class _ParentIndex:
+  """Reverse lookup tables for the parent queries of one definition group.
+
+  Attributes:
+    parents: dict mapping a comment-stripped item to the tokens containing it,
+      in definition order.
+    raw_items: set of the items without a comment.
+    prefixes: dict mapping (version, prefixlen) to a dict of integer network
+      address to the tokens containing that network.
+  """
+
+  def __init__(self, query_group, prefixes=None):
+    """Build the tables.
+
+    Args:
+      query_group: either the services or the networks of a Naming object.
+      prefixes: prefixes table of query_group parsed before, e.g. loaded from
+        a snapshot, to use instead of parsing the items again.
+    """
+    self.parents = collections.defaultdict(list)
+    self.raw_items = set()
+    # sorted networks of each IP version, see Networks.
+    self._networks = {}
+    # (first address, prefixlen) -> (token, parents) of each IP version, see
+    # NetworkParents.
+    self._network_parents = {4: {}, 6: {}}
+    if prefixes is None:
+      prefixes = _NetworkPrefixes(query_group)
+    self.prefixes = prefixes
+    for token, unit in query_group.items():
+      for item in unit.ParsedItems():
+        if not item.comment:
+          self.raw_items.add(item.value)
+        parents = self.parents[item.value]
+        if not parents or parents[-1] != token:
+          parents.append(token)
+
+  def IpParents(self, query):
+    """Return the tokens holding a network which is a supernet of query."""
+    base_parents = []
+    query_address = int(query.network_address)
+    host_bits = query.max_prefixlen
+    for prefixlen in range(query.prefixlen + 1):
+      by_network = self.prefixes.get((query.version, prefixlen))
+      if not by_network:
+        continue
+      mask = ((1 << prefixlen) - 1) << (host_bits - prefixlen)
+      base_parents.extend(by_network.get(query_address & mask, ()))
+    return base_parents
+
+  def Networks(self, version):
+    """Return the networks of an IP version, sorted outer networks first.
+
+    Args:
+      version: 4 or 6.
+
+    Returns:
+      A list of (first address, last address, prefixlen, tokens) tuples in
+      ascending order of first address, networks before their subnets.
+    """
+    networks = self._networks.get(version)
+    if networks is None:
+      host_bits = 32 if version == 4 else 128
+      networks = []
+      for (net_version, prefixlen), by_network in self.prefixes.items():
+        if net_version != version:
+          continue
+        size = 1 << (host_bits - prefixlen)
+        for first, tokens in by_network.items():
+          networks.append((first, first + size - 1, prefixlen, tokens))
+      networks.sort(key=lambda network: (network[0], -network[1]))
+      self._networks[version] = networks
+    return networks
+
+  def NetworkParents(self, version, network):
+    """Return the token holding a network and all the tokens containing it.
+
+    Args:
+      version: the IP version of the network, 4 or 6.
+      network: a (first address, last address, prefixlen, tokens) tuple of
+        Networks(version).
+
+    Returns:
+      A tuple of the first token holding the network, or None, and the sorted
+      tuple of the tokens containing it.
+    """
+    network_parents = self._network_parents[version]
+    key = (network[0], network[2])
+    result = network_parents.get(key)
+    if result is None:
+      token = next((t for t in network[3] if t[:1].isalpha()), None)
+      result = (token, tuple(self.Ancestors(network[3])))
+      network_parents[key] = result
+    return result
+
+  def Ancestors(self, tokens):
+    """Return the sorted tokens and the tokens nesting them, recursively.
+
+    Tokens whose names do not start with a letter are neither reported nor
+    followed.
+    """
+    pending = list(tokens)
+    ancestors = set()
+    while pending:
+      token = pending.pop()
+      if token in ancestors or not token[:1].isalpha():
+        continue
+      ancestors.add(token)
+      pending.extend(self.parents.get(token, ()))
+    return sorted(ancestors)
 
 
 class Naming:
@@ -122,26 +558,125 @@ class Naming:
      port_re: Regular Expression matching valid port entries.
   """
 
-  def __init__(self, naming_dir=None, naming_file=None, naming_type=None):
-    """Set the default values for a new Naming object."""
+  def __init__(self, naming_dir=None, naming_file=None, naming_type=None,
+               snapshot_file=None, max_parsers=1):
+    """Set the default values for a new Naming object.
+
+    Args:
+      naming_dir: directory of the .net and .svc definition files.
+      naming_file: a single file of naming_dir to parse.
+      naming_type: 'networks' or 'services', the type of naming_file.
+      snapshot_file: optional path of a snapshot of the definitions of
+        naming_dir. It is loaded instead of parsing the definition files when
+        they are unchanged since it was saved, and saved again otherwise.
+      max_parsers: most processes parsing the definition files of naming_dir
+        at once, one file each. Files smaller than PARALLEL_PARSE_BYTES are
+        always parsed by this process.
+    """
     self.current_symbol = None
     self.services = {}
     self.networks = {}
     self.unseen_services = {}
     self.unseen_networks = {}
+    # reverse lookup indexes for the parent queries, keyed by definition type.
+    self._parent_indexes = {}
+    # flattened network tokens, see _ExpandNet.
+    self._net_cache = {}
+    # tokens looked up while tracking, see StartReferenceTracking.
+    self._references = None
+    # packed network prefixes of a loaded snapshot, see _GetParentIndex.
+    self._snapshot_prefixes = None
     self.port_re = re.compile(r'(^\d+-\d+|^\d+)\/\w+$|^[\w\d-]+$',
                               re.IGNORECASE | re.DOTALL)
-    self.token_re = re.compile(r'(^[-_A-Z0-9]+$)', re.IGNORECASE)
+    self.token_re = _TOKEN_RE
     if naming_file and naming_type:
       filename = os.path.sep.join([naming_dir, naming_file])
       with open(filename, 'r') as file_handle:
         self._ParseFile(file_handle, naming_type)
     elif naming_dir:
-      self._Parse(naming_dir, 'services')
-      self._CheckUnseen('services')
+      sources = None
+      if snapshot_file:
+        sources = _SourceDigests(naming_dir)
+        if sources and self._LoadSnapshot(snapshot_file, sources):
+          return
+      executor = None
+      if max_parsers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_parsers)
+      try:
+        self._Parse(naming_dir, 'services', executor)
+        self._CheckUnseen('services')
+
+        self._Parse(naming_dir, 'networks', executor)
+        self._CheckUnseen('networks')
+      finally:
+        if executor:
+          executor.shutdown()
+      if snapshot_file:
+        self.SaveSnapshot(snapshot_file, sources)
+
+  def _SnapshotHeader(self, sources):
+    # marshal data is only guaranteed to load in the Python that wrote it.
+    return (_SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version,
+            tuple(sys.version_info[:2]), sys.byteorder, sources)
+
+  def SaveSnapshot(self, snapshot_file, sources):
+    """Save the definitions, to be loaded instead of parsing them again.
+
+    The snapshot holds the items of every token, comments included, and the
+    parsed network prefixes packed as integers, in the marshal format.
+    Failing to write it is not an error, the definitions are parsed again
+    next time.
+
+    Args:
+      snapshot_file: path of the snapshot, replaced atomically.
+      sources: the definition files the snapshot is valid for, as returned by
+        _SourceDigests.
+    """
+    data = (self._SnapshotHeader(sources),
+            [(token, unit.items) for token, unit in self.services.items()],
+            [(token, unit.items) for token, unit in self.networks.items()],
+            _PackPrefixes(self._NetworkPrefixes(), list(self.networks)))
+    try:
+      with atomicfile.Open(snapshot_file, 'wb') as f:
+        marshal.dump(data, f)
+    except (IOError, ValueError) as e:
+      logging.warning('could not save definitions snapshot %s: %s',
+                      snapshot_file, e)
+
+  def _LoadSnapshot(self, snapshot_file, sources):
+    """Load the definitions from a snapshot saved for the same files.
 
-      self._Parse(naming_dir, 'networks')
-      self._CheckUnseen('networks')
+    Args:
+      snapshot_file: path of the snapshot.
+      sources: the current definition files, as returned by _SourceDigests.
+
+    Returns:
+      True if the snapshot was loaded, False if it is missing or stale.
+    """
+    try:
+      with open(snapshot_file, 'rb') as f:
+        # read the snapshot through the page cache, without copying the file.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+          snapshot = marshal.loads(data)
+    except FileNotFoundError:
+      return False
+    except (IOError, ValueError, EOFError, TypeError) as e:
+      logging.warning('ignoring unreadable definitions snapshot %s: %s',
+                      snapshot_file, e)
+      return False
+    if (not isinstance(snapshot, tuple) or len(snapshot) != 4 or
+        snapshot[0] != self._SnapshotHeader(sources)):
+      logging.info('definitions snapshot %s is out of date', snapshot_file)
+      return False
+    _, services, networks, prefixes = snapshot
+    for group, tokens in ((self.services, services),
+                          (self.networks, networks)):
+      for token, items in tokens:
+        unit = _ItemUnit(token)
+        unit.items = items
+        group[token] = unit
+    self._snapshot_prefixes = prefixes
+    return True
 
   def _CheckUnseen(self, def_type):
     if def_type == 'services':
@@ -164,51 +699,116 @@ class Naming:
     Returns:
       A sorted list of unique parent tokens.
     """
-    base_parents = []
-    recursive_parents = []
     # convert string to nacaddr, if arg is ipaddr then convert str() to nacaddr
     if (not isinstance(query, nacaddr.IPv4) and
-       not isinstance(query, nacaddr.IPv6)):
+        not isinstance(query, nacaddr.IPv6)):
       if query[:1].isdigit():
         query = nacaddr.IP(query)
+    index = self._GetParentIndex('networks')
     # Get parent token for an IP
     if isinstance(query, nacaddr.IPv4) or isinstance(query, nacaddr.IPv6):
-      for token in self.networks:
-        for item in self.networks[token].items:
-          item = item.split('#')[0].strip()
-          if not item[:1].isdigit():
-            continue
-          try:
-            supernet = nacaddr.IP(item, strict=False)
-            if supernet.supernet_of(query):
-              base_parents.append(token)
-          except ValueError:
-            # item was not an IP
-            pass
+      pending = index.IpParents(query)
     # Get parent token for another token
+    elif query[:1].isalpha():
+      pending = list(index.parents.get(query, ()))
     else:
-      for token in self.networks:
-        for item in self.networks[token].items:
-          item = item.split('#')[0].strip()
-          if item[:1].isalpha() and item == query:
-            base_parents.append(token)
-    # look for nested tokens
-    for bp in base_parents:
-      done = False
-      for token in self.networks:
-        if bp in [item.split('#')[0].strip() for item in
-                  self.networks[token].items]:
-          # ignore IPs, only look at token values
-          if bp[:1].isalpha():
-            if bp not in recursive_parents:
-              recursive_parents.append(bp)
-              recursive_parents.extend(self.GetIpParents(bp))
-            done = True
-      # if no nested tokens, just append value
-      if not done:
-        if bp[:1].isalpha() and bp not in recursive_parents:
-          recursive_parents.append(bp)
-    return sorted(list(set(recursive_parents)))
+      pending = []
+    # walk up through the tokens nesting each parent.
+    return index.Ancestors(pending)
+
+  def GetIpParentsBatch(self, addresses, version=4):
+    """Return the most specific token and the parent tokens of many IPs.
+
+    Gives the same parents as GetIpParents for each address, much faster for
+    many addresses: they are sorted and swept once along the sorted networks
+    of all tokens, and addresses within the same networks share the result.
+
+    Args:
+      addresses: iterable of IP strings ('10.1.1.1' or '10.1.0.0/16'),
+        ipaddress or nacaddr objects, or integers such as the elements of a
+        numpy array.
+      version: IP version of the integer addresses.
+
+    Returns:
+      A list with a (token, parents) tuple for each address, in order. token
+      is the first token holding the longest network that contains the
+      address, or None; parents is a tuple of all the tokens containing the
+      address, sorted, as returned by GetIpParents.
+
+    Raises:
+      ValueError: if an address is not valid.
+    """
+    index = self._GetParentIndex('networks')
+    queries = {4: [], 6: []}
+    count = 0
+    for position, address in enumerate(addresses):
+      count += 1
+      if isinstance(address, str):
+        address_version, first, prefixlen = _ParseIp(address)
+      elif isinstance(address, numbers.Integral):
+        address_version = version
+        first = int(address)
+        prefixlen = 32 if version == 4 else 128
+      elif isinstance(address, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        address_version = address.version
+        first = int(address)
+        prefixlen = address.max_prefixlen
+      else:
+        address_version = address.version
+        first = int(address.network_address)
+        prefixlen = address.prefixlen
+      queries[address_version].append((first, prefixlen, position))
+    results = [None] * count
+    for query_version, version_queries in queries.items():
+      if version_queries:
+        self._SweepIpParents(index, query_version, version_queries, results)
+    return results
+
+  def _SweepIpParents(self, index, version, queries, results):
+    """Find the parents of the addresses of one version for GetIpParentsBatch.
+
+    Args:
+      index: the _ParentIndex of the networks.
+      version: 4 or 6.
+      queries: list of (first address, prefixlen, position) tuples.
+      results: list to store the (token, parents) of each position in.
+    """
+    networks = index.Networks(version)
+    # networks containing the current address, outermost first.
+    stack = []
+    next_network = 0
+    merged = {}
+    for first, prefixlen, position in sorted(queries):
+      while (next_network < len(networks) and
+             networks[next_network][0] <= first):
+        network = networks[next_network]
+        while stack and stack[-1][1] < network[0]:
+          stack.pop()
+        stack.append(network)
+        next_network += 1
+      while stack and stack[-1][1] < first:
+        stack.pop()
+      # networks are nested or disjoint, the stack only holds supernets of
+      # first. Those with a longer prefix are subnets of a queried network.
+      containing = stack
+      if stack and stack[-1][2] > prefixlen:
+        containing = [network for network in stack if network[2] <= prefixlen]
+      if not containing:
+        results[position] = (None, ())
+      elif len(containing) == 1:
+        results[position] = index.NetworkParents(version, containing[0])
+      else:
+        key = tuple((network[0], network[2]) for network in containing)
+        result = merged.get(key)
+        if result is None:
+          network_parents = [index.NetworkParents(version, network)
+                             for network in containing]
+          token = next((token for token, _ in reversed(network_parents)
+                        if token), None)
+          result = (token, tuple(sorted(set().union(
+              *(parents for _, parents in network_parents)))))
+          merged[key] = result
+        results[position] = result
 
   def GetServiceParents(self, query):
     """Given a query token, return list of services definitions with that token.
@@ -240,25 +840,73 @@ class Naming:
     Returns:
       Returns a list of definitions containing the token in desired group.
     """
-    base_parents = []
-    recursive_parents = []
-    # collect list of tokens containing query
-    for token in query_group:
-      if query in [item.split('#')[0].strip() for item in
-                   query_group[token].items]:
-        base_parents.append(token)
+    if query_group is self.services:
+      index = self._GetParentIndex('services')
+    else:
+      index = self._GetParentIndex('networks')
+    base_parents = index.parents.get(query)
     if not base_parents:
       return []
+    recursive_parents = []
     # iterate through tokens containing query, doing recursion if necessary
     for bp in base_parents:
-      for token in query_group:
-        if bp in query_group[token].items and bp not in recursive_parents:
-          recursive_parents.append(bp)
-          recursive_parents.extend(self._GetParents(bp, query_group))
+      if bp in index.raw_items and bp not in recursive_parents:
+        recursive_parents.append(bp)
+        recursive_parents.extend(self._GetParents(bp, query_group))
       if bp not in recursive_parents:
         recursive_parents.append(bp)
     return recursive_parents
 
+  def _NetworkPrefixes(self):
+    """Return the prefixes table of the networks, see _NetworkPrefixes."""
+    index = self._parent_indexes.get('networks')
+    if index is not None:
+      return index.prefixes
+    if self._snapshot_prefixes is not None:
+      return _UnpackPrefixes(self._snapshot_prefixes, list(self.networks))
+    return _NetworkPrefixes(self.networks)
+
+  def _GetParentIndex(self, def_type):
+    """Return the reverse lookup index of a definition type, building it.
+
+    Args:
+      def_type: either 'services' or 'networks'.
+
+    Returns:
+      A _ParentIndex over the current definitions of def_type.
+    """
+    index = self._parent_indexes.get(def_type)
+    if index is None:
+      # services are never looked up by IP.
+      prefixes = {}
+      if def_type == 'networks':
+        prefixes = self._NetworkPrefixes()
+      index = _ParentIndex(getattr(self, def_type), prefixes)
+      self._parent_indexes[def_type] = index
+    return index
+
+  def GetNetPrefixes(self):
+    """Return the networks held by the network tokens, by prefix length.
+
+    Returns:
+      A dict mapping (version, prefixlen) to a dict of integer network address
+      to the list of tokens directly holding that network.
+    """
+    prefixes = self._GetParentIndex('networks').prefixes
+    return {key: {network: list(tokens)
+                  for network, tokens in by_network.items()}
+            for key, by_network in prefixes.items()}
+
+  def GetNetItemParents(self):
+    """Return the tokens directly holding each item of the network tokens.
+
+    Returns:
+      A dict mapping every comment-stripped item, a network or the name of a
+      nested token, to the list of tokens holding it, in definition order.
+    """
+    return {item: list(tokens) for item, tokens in
+            self._GetParentIndex('networks').parents.items()}
+
   def GetNetChildren(self, query):
     """Given a query token, return list of network definitions tokens within provided token.
 
@@ -285,31 +933,13 @@ class Naming:
 
     children = []
     if query in query_group:
-      for item in query_group[query].items:
-        child = item.split('#')[0].strip()
-
+      for item in query_group[query].ParsedItems():
         # Determine if item a token, then it's a child
-        if not self._IsIpFormat(child):
-          children.append(child)
+        if not item.version:
+          children.append(item.value)
 
     return children
 
-  def _IsIpFormat(self, item):
-    """Helper function for _GetChildren to detect if string is IP format.
-
-    Args:
-      item: string either a IP or token.
-    Returns:
-      True if string is a IP
-      False if string is not a IP
-    """
-    try:
-      item = item.strip()
-      nacaddr.IP(item, strict=False)
-      return True
-    except ValueError:
-      return False
-
   def GetServiceNames(self):
     """Returns the list of all known service names."""
     return list(self.services.keys())
@@ -332,14 +962,15 @@ class Naming:
     service_name = ''
     data = query.split('#')     # Get the token keyword and remove any comment
     service_name = data[0].split()[0]  # strip and cast from list to string
+    if self._references is not None:
+      self._references['services'].add(service_name)
     if service_name not in self.services:
       raise UndefinedServiceError('\nNo such service: %s' % query)
 
     already_done.add(service_name)
 
-    for next_item in self.services[service_name].items:
-      # Remove any trailing comment.
-      service = next_item.split('#')[0].strip()
+    for next_item in self.services[service_name].ParsedItems():
+      service = next_item.value
       # Recognized token, not a value.
       if '/' not in service:
         # Make sure we are not descending into recursion hell.
@@ -377,8 +1008,8 @@ class Naming:
     # otherwise, add nested group to a list to recurisvely check later.
     # if there's no match, do nothing.
     for service_token in self.services:
-      for port_child in self.services[service_token].items:
-        ppp = portlib.PPP(port_child)
+      for port_child in self.services[service_token].ParsedItems():
+        ppp = portlib.PPP(port_child.value)
         # check for exact match
         if ppp.is_single_port and ppp == given_ppp:
           matches.add(service_token)
@@ -465,41 +1096,80 @@ class Naming:
 
     Raises:
       UndefinedAddressError: for an undefined token value
+      ReferenceCycleError: if the token includes itself.
     """
-    returnlist = []
-    data = []
-    token = ''
     data = query.split('#')     # Get the token keyword and remove any comment
     token = data[0].split()[0]  # Remove whitespace and cast from list to string
-    if token not in self.networks:
-      raise UndefinedAddressError('%s %s' % ('\nUNDEFINED:', str(token)))
+    if self._references is not None:
+      self._references['networks'].add(token)
+    returnlist = []
+    # the cached objects are shared, so hand out copies that callers own.
+    for addr in self._ExpandNet(token, []):
+      addr = copy.copy(addr)
+      addr.parent_token = token
+      returnlist.append(addr)
+    return returnlist
 
-    for i in self.networks[token].items:
-      comment = ''
-      if i.find('#') > -1:
-        (net, comment) = i.split('#', 1)
-      else:
-        net = i
+  def StartReferenceTracking(self):
+    """Record the tokens looked up through GetNet and GetService."""
+    self._references = {'networks': set(), 'services': set()}
 
-      net = net.strip()
-      if self.token_re.match(net):
-        returnlist.extend(self.GetNet(net))
-      else:
-        try:
-          # TODO(robankeny): Fix using error to continue processing.
-          addr = nacaddr.IP(net, strict=False)
-          addr.text = comment.lstrip()
-          addr.token = token
-          returnlist.append(addr)
-        except ValueError:
-          # if net was something like 'FOO', or the name of another token which
-          # needs to be dereferenced, nacaddr.IP() will return a ValueError
-          returnlist.extend(self.GetNet(net))
-    for i in returnlist:
-      i.parent_token = token
-    return returnlist
+  def StopReferenceTracking(self):
+    """Stop recording looked up tokens.
+
+    Returns:
+      A dict of the sorted network and service tokens looked up since
+      StartReferenceTracking, keyed by definition type.
+    """
+    references = self._references or {'networks': set(), 'services': set()}
+    self._references = None
+    return {k: sorted(v) for k, v in references.items()}
+
+  def _ExpandNet(self, token, path):
+    """Return the flattened, parsed addresses of a network token.
 
-  def _Parse(self, defdirectory, def_type):
+    Expansions are cached per token and the address objects are shared by
+    every token nesting them, so they must not be handed out or modified.
+
+    Args:
+      token: Network definition token.
+      path: list of the tokens currently being expanded.
+
+    Returns:
+      List of nacaddr.IPv4 or nacaddr.IPv6 objects with token and text set.
+
+    Raises:
+      UndefinedAddressError: for an undefined token value
+      ReferenceCycleError: if the token includes itself.
+    """
+    expansion = self._net_cache.get(token)
+    if expansion is not None:
+      return expansion
+    if token not in self.networks:
+      raise UndefinedAddressError('%s %s' % ('\nUNDEFINED:', str(token)))
+    if token in path:
+      raise ReferenceCycleError('%s %s' % (
+          '\nNetwork token includes itself:', ' -> '.join(path + [token])))
+
+    path.append(token)
+    expansion = []
+    for item in self.networks[token].ParsedItems():
+      if not item.version:
+        # the name of another token which needs to be dereferenced.
+        expansion.extend(self._ExpandNet(item.value, path))
+        continue
+      text = sys.intern(item.comment.lstrip())
+      if item.version == 4:
+        addr = nacaddr.IPv4((item.network, item.prefixlen), text)
+      else:
+        addr = nacaddr.IPv6((item.network, item.prefixlen), text)
+      addr.token = token
+      expansion.append(addr)
+    path.pop()
+    self._net_cache[token] = expansion
+    return expansion
+
+  def _Parse(self, defdirectory, def_type, executor=None):
     """Parse files of a particular type for tokens and values.
 
     Given a directory name and the type (services|networks) to
@@ -509,6 +1179,8 @@ class Naming:
     Args:
       defdirectory: Path to directory containing definition files.
       def_type: Type of definitions to parse
+      executor: optional concurrent.futures.Executor parsing the files of at
+        least PARALLEL_PARSE_BYTES, merged in the order of the files.
 
     Raises:
       NoDefinitionsError: if no definitions are found.
@@ -525,16 +1197,53 @@ class Naming:
       raise NoDefinitionsError('No definition files for %s in %s found.' %
                                (def_type, defdirectory))
 
-    for current_file in file_names:
-      try:
-        with open(current_file, 'r') as file_handle:
-          self._ParseFile(file_handle, def_type)
-      except IOError as error_info:
-        raise NoDefinitionsError('%s' % error_info)
+    futures = []
+    try:
+      for current_file in file_names:
+        args = (current_file, def_type, self.port_re, self.token_re)
+        if executor and os.path.getsize(current_file) >= PARALLEL_PARSE_BYTES:
+          futures.append(executor.submit(_ParseDefinitionFile, *args))
+        else:
+          futures.append(args)
+      for future in futures:
+        if isinstance(future, tuple):
+          parsed = _ParseDefinitionFile(*future)
+        else:
+          parsed = future.result()
+        self._MergeDefinitions(parsed, def_type)
+    except IOError as error_info:
+      raise NoDefinitionsError('%s' % error_info)
+    finally:
+      # once a file failed, the files not parsed yet are not needed.
+      for future in futures:
+        if not isinstance(future, tuple):
+          future.cancel()
+
+  def _MergeDefinitions(self, parsed, def_type):
+    """Add the definitions of a file parsed by _ParseDefinitionFile.
+
+    Args:
+      parsed: the result of _ParseDefinitionFile.
+      def_type: Either 'networks' or 'services'.
+
+    Raises:
+      NamespaceCollisionError: when a token of the file is already defined.
+    """
+    leading_items, leading_references, definitions, references = parsed
+    self._InvalidateCaches(def_type)
+    if self.current_symbol:
+      self.unit.AddItems(leading_items)
+      self._AddReferences(leading_references, def_type)
+    for token, items in definitions:
+      self._DefineToken(token, def_type)
+      self.unit.items = items
+    self._AddReferences(references, def_type)
 
   def _ParseFile(self, file_handle, def_type):
+    parser = _DefinitionParser(def_type, self.port_re, self.token_re)
     for line in file_handle:
-      self._ParseLine(line, def_type)
+      parser.ParseLine(line)
+    self._MergeDefinitions(parser.Result(), def_type)
 
   def ParseServiceList(self, data):
     """Take an array of service data and import into class.
@@ -545,8 +1254,7 @@ class Naming:
     Args:
       data: array of text lines containing service definitions.
     """
-    for line in data:
-      self._ParseLine(line, 'services')
+    self._ParseFile(data, 'services')
 
   def ParseNetworkList(self, data):
     """Take an array of network data and import into class.
@@ -558,8 +1266,7 @@ class Naming:
       data: array of text lines containing net definitions.
 
     """
-    for line in data:
-      self._ParseLine(line, 'networks')
+    self._ParseFile(data, 'networks')
 
   def _ParseLine(self, line, definition_type):
     """Parse a single line of a service definition file.
@@ -581,72 +1288,48 @@ class Naming:
     if definition_type not in ['services', 'networks']:
       raise UnexpectedDefinitionTypeError('%s %s' % (
           'Received an unexpected definition type:', definition_type))
-    line = line.strip()
-    if not line or line.startswith('#'):  # Skip comments and blanks.
-      return
-    comment = ''
-    if line.find('#') > -1:  # if there is a comment, save it
-      (line, comment) = line.split('#', 1)
-    line_parts = line.split('=')   # Split on var = val lines.
-    # the value field still has the comment at this point
-    # If there was '=', then do var and value
-    if len(line_parts) > 1:
-      current_symbol = line_parts[0].strip()  # varname left of '='
-      if not self.token_re.match(current_symbol):
-        logging.info('\nService name does not match recommended criteria: %s\nOnly A-Z, a-z, 0-9, -, and _ allowed' % current_symbol)
-      self.current_symbol = current_symbol
-      if definition_type == 'services':
-        for port in line_parts[1].strip().split():
-          if not self.port_re.match(port):
-            raise NamingSyntaxError('%s: %s' % (
-                'The following line has a syntax error', line))
-        if self.current_symbol in self.services:
-          raise NamespaceCollisionError('%s %s' % (
-              '\nMultiple definitions found for service: ',
-              self.current_symbol))
-      elif definition_type == 'networks':
-        if self.current_symbol in self.networks:
-          raise NamespaceCollisionError('%s %s' % (
-              '\nMultiple definitions found for service: ',
-              self.current_symbol))
-
-      self.unit = _ItemUnit(self.current_symbol)
-      if definition_type == 'services':
-        self.services[self.current_symbol] = self.unit
-        # unseen_services is a list of service TOKENS found in the values
-        # of newly defined services, but not previously defined themselves.
-        # When we define a new service, we should remove it (if it exists)
-        # from the list of unseen_services.
-        if self.current_symbol in self.unseen_services:
-          self.unseen_services.pop(self.current_symbol)
-      elif definition_type == 'networks':
-        self.networks[self.current_symbol] = self.unit
-        if self.current_symbol in self.unseen_networks:
-          self.unseen_networks.pop(self.current_symbol)
-      else:
-        raise ParseError('Unknown definitions type.')
-      values = line_parts[1]
-    # No '=', so this is a value only line
+    parser = _DefinitionParser(definition_type, self.port_re, self.token_re)
+    parser.ParseLine(line)
+    self._MergeDefinitions(parser.Result(), definition_type)
+
+  def _InvalidateCaches(self, definition_type):
+    # new definitions invalidate the lookup caches.
+    self._parent_indexes.pop(definition_type, None)
+    if definition_type == 'networks':
+      self._net_cache.clear()
+      self._snapshot_prefixes = None
+
+  def _DefineToken(self, token, definition_type):
+    """Start the definition of a token, making it the current symbol.
+
+    Args:
+      token: the token defined.
+      definition_type: Either 'networks' or 'services'
+
+    Raises:
+      NamespaceCollisionError: when the token is already defined.
+    """
+    if definition_type == 'services':
+      group, unseen = self.services, self.unseen_services
     else:
-      values = line_parts[0]  # values for previous var are continued this line
-    for value_piece in values.split():
-      if not value_piece:
-        continue
-      if not self.current_symbol:
-        break
-      if comment:
-        self.unit.items.append(value_piece + ' # ' + comment)
-      else:
-        self.unit.items.append(value_piece)
-        # token?
-        if value_piece[0].isalpha() and ':' not in value_piece:
-          if definition_type == 'services':
-            # already in top definitions list?
-            if value_piece not in self.services:
-              # already have it as an unused value?
-              if value_piece not in self.unseen_services:
-                self.unseen_services[value_piece] = True
-          if definition_type == 'networks':
-            if value_piece not in self.networks:
-              if value_piece not in self.unseen_networks:
-                self.unseen_networks[value_piece] = True
+      group, unseen = self.networks, self.unseen_networks
+    if token in group:
+      raise _CollisionError(token)
+    self.current_symbol = token
+    self.unit = _ItemUnit(token)
+    group[token] = self.unit
+    # unseen_services and unseen_networks hold the tokens found in the values
+    # of definitions, but not defined themselves yet. When we define a new
+    # token, we remove it (if it exists) from them.
+    unseen.pop(token, None)
+
+  def _AddReferences(self, references, definition_type):
+    """Record the tokens referred to by definitions that are still undefined.
+    """
+    if definition_type == 'services':
+      group, unseen = self.services, self.unseen_services
+    else:
+      group, unseen = self.networks, self.unseen_networks
+    for token in references:
+      if token not in group:
+        unseen.setdefault(token, True)
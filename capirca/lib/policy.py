@@ -16,13 +16,17 @@
 """Parses the generic policy files and return a policy object for acl rendering.
 """
 
+import collections
+import copy
 import datetime
 import os
 import sys
+import threading
 
 from absl import logging
 from capirca.lib import nacaddr
 from capirca.lib import naming
+from capirca.utils import profiling
 from ply import lex
 from ply import yacc
 
@@ -127,6 +131,38 @@ class MixedPortandNonPortProtos(Error):
   """Error when protocols that use ports are mixed with protocols that do not"""
 
 
+class _ParseSettings:
+  """Definitions and options of one parse, see PolicyParser.Parse."""
+
+  def __init__(self, definitions, optimize, shade_check, parser=None):
+    self.definitions = definitions
+    self.optimize = optimize
+    self.shade_check = shade_check
+    self.parser = parser
+
+
+# The _ParseSettings of the parse running in each thread. The grammar rules and
+# Term are module level, so this is how they find the settings of their parse.
+_PARSING = threading.local()
+
+
+def _CurrentSettings():
+  """Returns the settings of the parse running in this thread.
+
+  Outside of a parse, e.g. for terms built directly, the module level
+  DEFINITIONS, _OPTIMIZE and _SHADE_CHECK are used.
+  """
+  settings = getattr(_PARSING, 'settings', None)
+  if settings is None:
+    return _ParseSettings(DEFINITIONS, _OPTIMIZE, _SHADE_CHECK)
+  return settings
+
+
+def _Definitions():
+  """Returns the naming definitions of the parse running in this thread."""
+  return _CurrentSettings().definitions
+
+
 def TranslatePorts(ports, protocols, term_name):
   """Return all ports of all protocols requested.
 
@@ -144,7 +180,7 @@ def TranslatePorts(ports, protocols, term_name):
   ret_array = []
   for proto in protocols:
     for port in ports:
-      service_by_proto = DEFINITIONS.GetServiceByProto(port, proto)
+      service_by_proto = _Definitions().GetServiceByProto(port, proto)
       if not service_by_proto:
         logging.warning('Term %s has service %s which is not defined with '
                         'protocol %s, but will be permitted. Unless intended'
@@ -159,6 +195,114 @@ def TranslatePorts(ports, protocols, term_name):
   return ret_array
 
 
+class _ShadingIndex:
+  """Index of the terminating terms of a filter to look up possible shaders.
+
+  A prior term only shades a term if its protocols, source and destination
+  addresses and destination ports all contain those of the term, see
+  Term.__contains__. Prior terms are indexed on each of these so that a term
+  is only compared with the prior terms matching all of them.
+
+  In every dimension, prior terms are either matching anything or keyed by
+  each of their values, and a later term looks them up from the first of its
+  own values.
+  """
+
+  def __init__(self):
+    self.protocol_any = set()
+    self.protocols = collections.defaultdict(set)
+    self.address_any = {'source': set(), 'destination': set()}
+    self.addresses = {'source': collections.defaultdict(set),
+                      'destination': collections.defaultdict(set)}
+    # (version, prefixlen) of the indexed addresses, to bound the lookups.
+    self.prefixlens = {'source': set(), 'destination': set()}
+    self.port_any = set()
+    self.single_ports = collections.defaultdict(set)
+    self.port_ranges = collections.defaultdict(set)
+
+  @staticmethod
+  def _Addresses(term, direction):
+    if direction == 'source':
+      return term.flattened_saddr
+    return term.flattened_daddr
+
+  def Add(self, index, term):
+    """Index a flattened prior term."""
+    # the protocols of a prior term must all be protocols of the term.
+    if term.protocol:
+      self.protocols[term.protocol[0]].add(index)
+    else:
+      self.protocol_any.add(index)
+
+    for direction in ('source', 'destination'):
+      addresses = self._Addresses(term, direction)
+      if not addresses:
+        self.address_any[direction].add(index)
+      for addr in addresses or []:
+        self.prefixlens[direction].add((addr.version, addr.prefixlen))
+        self.addresses[direction][(addr.version, addr.prefixlen,
+                                   int(addr.network_address))].add(index)
+
+    if not term.destination_port:
+      self.port_any.add(index)
+    for low, high in term.destination_port:
+      low, high = int(low), int(high)
+      if low == high:
+        self.single_ports[low].add(index)
+      else:
+        self.port_ranges[(low, high)].add(index)
+
+  def _ProtocolMatches(self, term):
+    return [self.protocol_any] + [
+        self.protocols[proto] for proto in term.protocol
+        if proto in self.protocols]
+
+  def _AddressMatches(self, term, direction):
+    addresses = self._Addresses(term, direction)
+    matches = [self.address_any[direction]]
+    if addresses:
+      addr = addresses[0]
+      network = int(addr.network_address)
+      for version, prefixlen in self.prefixlens[direction]:
+        if version != addr.version or prefixlen > addr.prefixlen:
+          continue
+        shift = addr.max_prefixlen - prefixlen
+        key = (version, prefixlen, network >> shift << shift)
+        if key in self.addresses[direction]:
+          matches.append(self.addresses[direction][key])
+    return matches
+
+  def _PortMatches(self, term):
+    matches = [self.port_any]
+    if term.destination_port:
+      low, high = (int(x) for x in term.destination_port[0])
+      if low == high and low in self.single_ports:
+        matches.append(self.single_ports[low])
+      for (range_low, range_high), indexes in self.port_ranges.items():
+        if range_low <= low and high <= range_high:
+          matches.append(indexes)
+    return matches
+
+  def Candidates(self, term):
+    """Return the sorted indexes of the prior terms which may shade term."""
+    # every dimension is a list of sets of indexes, a candidate must be in
+    # one set of each of them.
+    dimensions = [
+        self._ProtocolMatches(term),
+        self._AddressMatches(term, 'source'),
+        self._AddressMatches(term, 'destination'),
+        self._PortMatches(term),
+    ]
+    dimensions.sort(key=lambda d: sum(len(indexes) for indexes in d))
+    smallest, others = dimensions[0], dimensions[1:]
+    candidates = set()
+    for indexes in smallest:
+      for index in indexes:
+        if all(any(index in i for i in d) for d in others):
+          candidates.add(index)
+    return sorted(candidates)
+
+
 # classes for storing the object types in the policy files.
 class Policy:
   """The policy object contains everything found in a given policy file."""
@@ -184,8 +328,9 @@ class Policy:
   def AddFilter(self, header, terms):
     """Add another header & filter."""
     self.filters.append((header, terms))
+    profiling.Count('terms', len(terms) if terms else 0)
     self._TranslateTerms(terms)
-    if _SHADE_CHECK:
+    if _CurrentSettings().shade_check:
       self._DetectShading(terms)
 
   def _TranslateTerms(self, terms):
@@ -219,7 +364,8 @@ class Policy:
                   term.name))
 
       # If argument is true, we optimize, otherwise just sort addresses
-      term.AddressCleanup(_OPTIMIZE, self._NeedsAddressBook())
+      term.AddressCleanup(_CurrentSettings().optimize,
+                          self._NeedsAddressBook())
       term.SanityCheck()
       term.translated = True
 
@@ -245,6 +391,7 @@ class Policy:
     """
     return [x[0] for x in self.filters]
 
+  @profiling.Timed('shading')
   def _DetectShading(self, terms):
     """Finds terms which are shaded (impossible to reach).
 
@@ -252,25 +399,68 @@ class Policy:
     contains every component of the current term then the current term would
     never be hit and is thus shaded. This can be a mistake.
 
+    Prior terms are looked up in a _ShadingIndex, so each term is only
+    compared with the prior terms that could contain it.
+
     Args:
       terms: list of Term objects.
 
     Raises:
       ShadingError: When a term is impossible to reach.
     """
+    self._FlattenForShading(terms)
     shading_errors = []
+    shaders = _ShadingIndex()
     for index, term in enumerate(terms):
-      for prior_index in range(index):
-        # Check each term that came before for shading. Terms with next as an
-        # action do not terminate evaluation, so cannot shade.
-        if (term in terms[prior_index]
-            and 'next' not in terms[prior_index].action):
+      if not term.flattened:
+        continue
+      # Check each term that came before for shading.
+      for prior_index in shaders.Candidates(term):
+        if term in terms[prior_index]:
           shading_errors.append(
               '  %s is shaded by %s.' % (
                   term.name, terms[prior_index].name))
+      # Terms with next as an action do not terminate evaluation, so cannot
+      # shade.
+      if 'next' not in term.action:
+        shaders.Add(index, term)
     if shading_errors:
       raise ShadingError('\n'.join(shading_errors))
 
+  def _FlattenForShading(self, terms):
+    """Flatten the addresses of the terms Term.__contains__ would flatten.
+
+    Term.__contains__ flattens both terms once their protocols match, which
+    removes the excludes from the addresses of the terms having some. The
+    same terms are flattened before indexing them; terms left unflattened
+    contain no other term and are contained in none.
+
+    Args:
+      terms: list of Term objects.
+    """
+    # whether protocols match only depends on these, so every group of terms
+    # sharing them is checked once through its first and last term.
+    groups = {}
+    for index, term in enumerate(terms):
+      if term.verbatim:
+        key = id(term)
+      else:
+        key = (tuple(sorted(set(term.protocol))),
+               tuple(sorted(set(term.protocol_except))))
+      first, _ = groups.get(key, (index, index))
+      groups[key] = (first, index)
+
+    for index, term in enumerate(terms):
+      if not (term.source_address_exclude or term.destination_address_exclude
+              or term.address_exclude):
+        term.FlattenAll()
+        continue
+      for first, last in groups.values():
+        if ((first < index and terms[first]._ContainsProtocols(term)) or
+            (last > index and term._ContainsProtocols(terms[last]))):
+          term.FlattenAll()
+          break
+
   def __eq__(self, obj):
     """Compares for equality against another Policy object.
 
@@ -481,8 +671,8 @@ class Term:
     # further up so this has to be at the end.
     self.AddObject(obj)
 
-  def __contains__(self, other):
-    """Determine if other term is contained in this term."""
+  def _ContainsProtocols(self, other):
+    """Determine if the verbatim and protocols of other are contained."""
     if self.verbatim or other.verbatim:
       # short circuit these
       if sorted(list(self.verbatim)) != sorted(other.verbatim):
@@ -512,6 +702,12 @@ class Term:
             return False
       else:
         return False
+    return True
+
+  def __contains__(self, other):
+    """Determine if other term is contained in this term."""
+    if not self._ContainsProtocols(other):
+      return False
 
     # combine addresses with exclusions for proper contains comparisons.
     if not self.flattened:
@@ -1036,6 +1232,7 @@ class Term:
 
     return [x for x in getattr(self, addr_type) if x.version == af]
 
+  @profiling.Timed('Term.AddObject')
   def AddObject(self, obj):
     """Add an object of unknown type to this term.
 
@@ -1056,23 +1253,23 @@ class Term:
         # expanded address fields consolidate naked address fields with
         # saddr/daddr.
         if x.var_type is VarType.SADDRESS:
-          saddr = DEFINITIONS.GetNetAddr(x.value)
+          saddr = _Definitions().GetNetAddr(x.value)
           self.source_address.extend(saddr)
         elif x.var_type is VarType.DADDRESS:
-          daddr = DEFINITIONS.GetNetAddr(x.value)
+          daddr = _Definitions().GetNetAddr(x.value)
           self.destination_address.extend(daddr)
         elif x.var_type is VarType.ADDRESS:
-          addr = DEFINITIONS.GetNetAddr(x.value)
+          addr = _Definitions().GetNetAddr(x.value)
           self.address.extend(addr)
         # do we have address excludes?
         elif x.var_type is VarType.SADDREXCLUDE:
-          saddr_exclude = DEFINITIONS.GetNetAddr(x.value)
+          saddr_exclude = _Definitions().GetNetAddr(x.value)
           self.source_address_exclude.extend(saddr_exclude)
         elif x.var_type is VarType.DADDREXCLUDE:
-          daddr_exclude = DEFINITIONS.GetNetAddr(x.value)
+          daddr_exclude = _Definitions().GetNetAddr(x.value)
           self.destination_address_exclude.extend(daddr_exclude)
         elif x.var_type is VarType.ADDREXCLUDE:
-          addr_exclude = DEFINITIONS.GetNetAddr(x.value)
+          addr_exclude = _Definitions().GetNetAddr(x.value)
           self.address_exclude.extend(addr_exclude)
         # do we have a list of ports?
         elif x.var_type is VarType.PORT:
@@ -1111,7 +1308,7 @@ class Term:
         elif x.var_type is VarType.PAN_APPLICATION:
           self.pan_application.append(x.value)
         elif x.var_type is VarType.NEXT_IP:
-          self.next_ip = DEFINITIONS.GetNetAddr(x.value)
+          self.next_ip = _Definitions().GetNetAddr(x.value)
         elif x.var_type is VarType.PLATFORM:
           self.platform.append(x.value)
         elif x.var_type is VarType.PLATFORMEXCLUDE:
@@ -1157,7 +1354,7 @@ class Term:
       elif obj.var_type is VarType.PAN_APPLICATION:
         self.pan_application.append(obj.value)
       elif obj.var_type is VarType.NEXT_IP:
-        self.next_ip = DEFINITIONS.GetNetAddr(obj.value)
+        self.next_ip = _Definitions().GetNetAddr(obj.value)
       elif obj.var_type is VarType.VERBATIM:
         self.verbatim.append(obj.value)
       elif obj.var_type is VarType.ACTION:
@@ -1316,6 +1513,7 @@ class Term:
         raise InvalidTermTTLValue('Term %s contains invalid TTL: %s'
                                   % (self.name, self.ttl))
 
+  @profiling.Timed('Term.AddressCleanup')
   def AddressCleanup(self, optimize=True, addressbook=False):
     """Do Address and Port collapsing.
 
@@ -1451,16 +1649,8 @@ class Term:
     if not subset:
       return False
 
-    for sub_addr in subset:
-      sub_contained = False
-      for sup_addr in superset:
-        # ipaddr ensures that version numbers match for inclusion.
-        if sub_addr.subnet_of(sup_addr):
-          sub_contained = True
-          break
-      if not sub_contained:
-        return False
-    return True
+    # nacaddr ensures that version numbers match for inclusion.
+    return nacaddr.IsSuperNet(superset, subset)
 
 
 class VarType:
@@ -2493,8 +2683,7 @@ def p_strings_or_ints(p):
 
 def p_error(p):
   """."""
-  global parser
-  next_token = parser.token()
+  next_token = _CurrentSettings().parser.token()
   if next_token is None:
     use_token = 'EOF'
   else:
@@ -2506,8 +2695,6 @@ def p_error(p):
   else:
     raise ParseError(' ERROR you likely have unablanaced "{"\'s')
 
-parser = yacc.yacc(write_tables=False, debug=0, errorlog=yacc.NullLogger())
-
 # pylint: enable=unused-argument,invalid-name,g-short-docstring-punctuation
 # pylint: enable=g-docstring-quotes,g-short-docstring-space
 # pylint: enable=g-space-before-docstring-summary,g-doc-args
@@ -2539,6 +2726,7 @@ def _ReadFile(filename):
     raise FileNotFoundError('Unable to open policy file %s' % filename)
 
 
+@profiling.Timed('_Preprocess')
 def _Preprocess(data, max_depth=5, base_dir=''):
   """Search input for include statements and import specified include file.
 
@@ -2596,6 +2784,71 @@ def ParseFile(filename, definitions=None, optimize=True, base_dir='',
   return p
 
 
+class PolicyParser:
+  """Parses policies with a lexer and parser built only once.
+
+  Building the PLY lexer and parser tables goes through every rule of this
+  module, so they are built when the PolicyParser is created and every parse
+  works on its own copy of them. A PolicyParser can parse policies from several
+  threads at once, and each parse uses the definitions and options it was
+  given.
+  """
+
+  def __init__(self, lextab=None, tabmodule=None):
+    """Build the lexer and parser tables.
+
+    Args:
+      lextab: optional name of a module with lexer tables written by PLY. It is
+        written, when possible, if it is missing or out of date.
+      tabmodule: optional name of a module with parser tables written by PLY.
+        It is written, when possible, if it is missing or out of date.
+    """
+    module = sys.modules[__name__]
+    self._lexer = lex.lex(module=module, optimize=bool(lextab),
+                          lextab=lextab, errorlog=lex.NullLogger())
+    self._parser = yacc.yacc(module=module, write_tables=bool(tabmodule),
+                             tabmodule=tabmodule or 'parsetab', debug=0,
+                             errorlog=yacc.NullLogger())
+
+  def Parse(self, data, definitions=None, optimize=True, base_dir='',
+            shade_check=False, filename=''):
+    """Parse the policy in 'data', optionally provide a naming object.
+
+    Args:
+      data: a string blob of policy data to parse.
+      definitions: optional naming library definitions object.
+      optimize: bool - whether to summarize networks and services.
+      base_dir: base path string to look for acls or include files.
+      shade_check: bool - whether to raise an exception when a term is shaded.
+      filename: string - filename used by the policy.
+
+    Returns:
+      policy object or False (if parse error).
+    """
+    previous = getattr(_PARSING, 'settings', None)
+    try:
+      if not definitions:
+        definitions = naming.Naming(DEFAULT_DEFINITIONS)
+      # the parser keeps the state of a parse on itself, the tables it shares.
+      parser = copy.copy(self._parser)
+      _PARSING.settings = _ParseSettings(definitions, optimize, shade_check,
+                                         parser)
+      preprocessed_data = '\n'.join(_Preprocess(data, base_dir=base_dir))
+      with profiling.Timer('parse'):
+        policy = parser.parse(preprocessed_data, lexer=self._lexer.clone())
+      policy.filename = filename
+      return policy
+
+    except IndexError:
+      return False
+
+    finally:
+      _PARSING.settings = previous
+
+
+_PARSER = PolicyParser()
+
+
 def ParsePolicy(data, definitions=None, optimize=True, base_dir='',
                 shade_check=False, filename=''):
   """Parse the policy in 'data', optionally provide a naming object.
@@ -2613,24 +2866,15 @@ def ParsePolicy(data, definitions=None, optimize=True, base_dir='',
   Returns:
     policy object or False (if parse error).
   """
-  try:
-    if definitions:
-      globals()['DEFINITIONS'] = definitions
-    else:
-      globals()['DEFINITIONS'] = naming.Naming(DEFAULT_DEFINITIONS)
-    globals()['_OPTIMIZE'] = optimize
-    globals()['_SHADE_CHECK'] = shade_check
-
-    lexer = lex.lex()
-
-    preprocessed_data = '\n'.join(_Preprocess(data, base_dir=base_dir))
-    global parser
-    policy = parser.parse(preprocessed_data, lexer=lexer)
-    policy.filename = filename
-    return policy
-
-  except IndexError:
-    return False
+  # Terms built outside of a parse keep using the last definitions and
+  # options given here.
+  if not definitions:
+    definitions = naming.Naming(DEFAULT_DEFINITIONS)
+  globals()['DEFINITIONS'] = definitions
+  globals()['_OPTIMIZE'] = optimize
+  globals()['_SHADE_CHECK'] = shade_check
+  return _PARSER.Parse(data, definitions, optimize, base_dir=base_dir,
+                       shade_check=shade_check, filename=filename)
 
 
 # if you call this from the command line, you can specify a pol file for it to
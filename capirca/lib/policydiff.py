@@ -0,0 +1,227 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Find the flows a new revision of a policy permits or denies.
+
+The flows accepted by the old and new revision of a filter are compared as
+unions of boxes of flowspace.py, without enumerating flows. Terms found
+unchanged, with the same flows, decision and order in both revisions, are
+matched first: a flow matching none of the other, changed, terms meets the
+same terms in the same order in both revisions and gets the same decision.
+Only the boxes of changed terms are split by the terms their flows first
+match in each revision, and the boxes accepted by one revision only are
+reported as compact regions.
+
+A flow is accepted when the first terminating term it matches has the accept
+action, flows matching no term are not. Criteria that are not modeled, like
+options or ICMP types, are compared as if terms matched every flow of their
+addresses, ports and protocols.
+"""
+
+import difflib
+
+from capirca.lib import aclgenerator
+from capirca.lib import flowspace
+
+# most pieces a changed term is split into.
+MAX_PIECES = 100000
+
+_PROTOCOL_NAMES = {number: name
+                   for name, number in aclgenerator.Term.PROTO_MAP.items()}
+
+
+class Error(Exception):
+  """Base error class."""
+
+
+class TooComplexError(Error):
+  """The changed flows can't be computed within the allowed pieces."""
+
+
+def _Range(first, last, names=None):
+  names = names or {}
+  if first == last:
+    return names.get(first, str(first))
+  return '%d-%d' % (first, last)
+
+
+class Region:
+  """A box of flows, as protocols, addresses and ports.
+
+  Empty lists match anything, as in policy.Term.
+
+  Attributes:
+    protocols: list of (first, last) protocol number ranges.
+    source_addresses: list of ipaddress networks.
+    destination_addresses: list of ipaddress networks.
+    source_ports: list of (first, last) port ranges.
+    destination_ports: list of (first, last) port ranges.
+  """
+
+  def __init__(self, box):
+    """Initializer.
+
+    Args:
+      box: box of flowspace.py.
+    """
+    def Sides(dimension):
+      intervals = box[dimension]
+      return [] if flowspace.IsAny(dimension, intervals) else list(intervals)
+
+    sources = Sides(flowspace.SOURCE)
+    destinations = Sides(flowspace.DESTINATION)
+    # boxes don't mix address families, so a side matching every address of
+    # the families of the other side matches anything.
+    if flowspace.IsFamilies(sources):
+      sources = []
+    elif flowspace.IsFamilies(destinations):
+      destinations = []
+    self.protocols = Sides(flowspace.PROTOCOL)
+    self.source_addresses = flowspace.Networks(sources)
+    self.destination_addresses = flowspace.Networks(destinations)
+    self.source_ports = Sides(flowspace.SOURCE_PORT)
+    self.destination_ports = Sides(flowspace.DESTINATION_PORT)
+
+  def __str__(self):
+    parts = []
+    if self.protocols:
+      parts.append('protocol:: %s' % ' '.join(
+          _Range(first, last, _PROTOCOL_NAMES)
+          for first, last in self.protocols))
+    for keyword, addresses in (('source-address', self.source_addresses),
+                               ('destination-address',
+                                self.destination_addresses)):
+      if addresses:
+        parts.append('%s:: %s' % (keyword, ' '.join(map(str, addresses))))
+    for keyword, ports in (('source-port', self.source_ports),
+                           ('destination-port', self.destination_ports)):
+      if ports:
+        parts.append('%s:: %s' % (keyword, ' '.join(
+            _Range(first, last) for first, last in ports)))
+    return ' '.join(parts) or 'any'
+
+
+class FilterDiff:
+  """The flows permitted and denied by the new revision of a filter.
+
+  Attributes:
+    filter: name of the filter.
+    permitted: list of Region newly accepted.
+    denied: list of Region no longer accepted.
+  """
+
+  def __init__(self, filtername, permitted, denied):
+    self.filter = filtername
+    self.permitted = permitted
+    self.denied = denied
+
+  def __bool__(self):
+    return bool(self.permitted or self.denied)
+
+  def __str__(self):
+    lines = ['%s:' % self.filter]
+    lines.extend('  + %s' % region for region in self.permitted)
+    lines.extend('  - %s' % region for region in self.denied)
+    return '\n'.join(lines)
+
+
+def _Signature(term):
+  return (term.decision, term.unmodeled, tuple(term.boxes))
+
+
+def _ChangedTerms(old, new):
+  """Returns the terminating terms of two FilterSpace not matched unchanged.
+  """
+  old_terms = [term for term in old.terms if term.terminating]
+  new_terms = [term for term in new.terms if term.terminating]
+  matcher = difflib.SequenceMatcher(
+      None, [_Signature(term) for term in old_terms],
+      [_Signature(term) for term in new_terms], autojunk=False)
+  old_changed = set(range(len(old_terms)))
+  new_changed = set(range(len(new_terms)))
+  for old_start, new_start, size in matcher.get_matching_blocks():
+    old_changed.difference_update(range(old_start, old_start + size))
+    new_changed.difference_update(range(new_start, new_start + size))
+  return ([old_terms[i] for i in sorted(old_changed)] +
+          [new_terms[i] for i in sorted(new_changed)])
+
+
+def _Accepts(term):
+  return term is not None and 'accept' in term.decision[0]
+
+
+def DiffTerms(filtername, old_terms, new_terms, max_pieces=MAX_PIECES):
+  """Find the flows the new terms of a filter permit or deny.
+
+  Args:
+    filtername: name of the filter, for the result.
+    old_terms: list of policy.Term objects of the old revision.
+    new_terms: list of policy.Term objects of the new revision.
+    max_pieces: most boxes a changed term is split into.
+
+  Returns:
+    FilterDiff object.
+
+  Raises:
+    TooComplexError: a changed term is split into more than max_pieces boxes.
+  """
+  old = flowspace.FilterSpace(old_terms)
+  new = flowspace.FilterSpace(new_terms)
+  permitted = []
+  denied = []
+  try:
+    for term in _ChangedTerms(old, new):
+      for new_term, new_boxes in new.FirstMatches(term.boxes, max_pieces):
+        for old_term, boxes in old.FirstMatches(new_boxes, max_pieces):
+          if _Accepts(new_term) and not _Accepts(old_term):
+            permitted.extend(boxes)
+          elif _Accepts(old_term) and not _Accepts(new_term):
+            denied.extend(boxes)
+    # changed terms may overlap, so may their boxes.
+    permitted = flowspace.Union(permitted, max_pieces)
+    denied = flowspace.Union(denied, max_pieces)
+  except flowspace.TooManyPiecesError as e:
+    raise TooComplexError('%s: %s' % (filtername, e))
+  return FilterDiff(filtername,
+                    [Region(box) for box in flowspace.Compact(permitted)],
+                    [Region(box) for box in flowspace.Compact(denied)])
+
+
+def DiffPolicies(old_pol, new_pol, max_pieces=MAX_PIECES):
+  """Find the flows the new revision of a policy permits or denies.
+
+  Filters are matched by name; a filter of one revision only is compared with
+  an empty filter.
+
+  Args:
+    old_pol: policy.Policy object of the old revision.
+    new_pol: policy.Policy object of the new revision.
+    max_pieces: see DiffTerms.
+
+  Returns:
+    list of FilterDiff, one for each filter of either revision.
+
+  Raises:
+    TooComplexError: see DiffTerms.
+  """
+  old_filters = {flowspace.FilterName(header): terms
+                 for header, terms in old_pol.filters}
+  new_filters = {flowspace.FilterName(header): terms
+                 for header, terms in new_pol.filters}
+  names = list(old_filters)
+  names.extend(name for name in new_filters if name not in old_filters)
+  return [DiffTerms(name, old_filters.get(name, []),
+                    new_filters.get(name, []), max_pieces)
+          for name in names]
@@ -0,0 +1,209 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Find unreachable, redundant and overlapping terms of a policy.
+
+Terms are modeled as unions of boxes by flowspace.py. The part of a term
+reachable by flows is found by subtracting the boxes of the prior terms
+overlapping it, so that a term is only compared with the terms it may share
+flows with.
+
+Findings are:
+  shaded: one prior term matches every flow of the term.
+  unreachable: prior terms together match every flow of the term.
+  redundant: the flows reaching the term would get the same decision from the
+    later terms if it was removed.
+  overlap: a prior term with a different decision matches some, but not all,
+    flows of the term, and the term does not contain it either.
+
+Criteria that are not modeled, like options, ICMP types or tags, make a term
+match fewer flows than its boxes. Such terms can be found unreachable or
+redundant, but never shade or make another term redundant. The decision of a
+term is its action and forwarding; counters and logging are not compared.
+"""
+
+from capirca.lib import flowspace
+
+SHADED = 'shaded'
+UNREACHABLE = 'unreachable'
+REDUNDANT = 'redundant'
+OVERLAP = 'overlap'
+KINDS = (SHADED, UNREACHABLE, REDUNDANT, OVERLAP)
+
+# most pieces a term is split into before its analysis is given up.
+MAX_PIECES = 1000
+
+
+class Finding:
+  """A term found shaded, unreachable, redundant or overlapping.
+
+  Attributes:
+    filter: name of the filter.
+    term: name of the term.
+    kind: one of KINDS.
+    terms: names of the terms responsible, in the order of the filter.
+  """
+
+  _MESSAGES = {
+      SHADED: 'is shaded by',
+      UNREACHABLE: 'is unreachable, shaded by the union of',
+      REDUNDANT: 'is redundant with the later terms',
+      OVERLAP: 'partly overlaps prior terms with a different action',
+  }
+
+  def __init__(self, filtername, term, kind, terms):
+    self.filter = filtername
+    self.term = term
+    self.kind = kind
+    self.terms = terms
+
+  def __str__(self):
+    return '%s: %s %s %s' % (self.filter, self.term, self._MESSAGES[self.kind],
+                             ', '.join(self.terms))
+
+  def __repr__(self):
+    return 'Finding(%r, %r, %r, %r)' % (self.filter, self.term, self.kind,
+                                        self.terms)
+
+
+class _FilterAnalysis:
+  """The findings of the terms of one filter."""
+
+  def __init__(self, filtername, terms, max_pieces):
+    self.filter = filtername
+    self.max_pieces = max_pieces
+    # terms without an action (verbatim) never match, inactive ones are not
+    # rendered.
+    self.space = flowspace.FilterSpace(terms)
+    self.terms = self.space.terms
+
+  def _Overlapping(self, index):
+    """Returns the sorted indexes of the other terms overlapping a term."""
+    return [i for i in self.space.Overlapping(self.terms[index].boxes)
+            if i != index]
+
+  def _Covers(self, outer, inner):
+    left, _ = flowspace.Subtract(inner.boxes, outer.boxes, self.max_pieces)
+    return left == []
+
+  def _Reach(self, term, prior):
+    """Returns the boxes of term reached by flows and the prior terms taking
+    some of its flows, or None for the boxes when giving up."""
+    boxes = term.boxes
+    taking = []
+    for other in prior:
+      if not other.exact:
+        continue
+      boxes, overlapped = flowspace.Subtract(boxes, other.boxes, self.max_pieces)
+      if overlapped:
+        taking.append(other)
+      if boxes is None or not boxes:
+        break
+    return boxes, taking
+
+  def _Redundancy(self, term, reach, later):
+    """Returns the later terms deciding the flows reaching term, if they all
+    decide like it, else None."""
+    deciding = []
+    for other in later:
+      if not flowspace.Overlap(reach, other.boxes):
+        continue
+      if other.decision != term.decision:
+        return None
+      if not other.exact:
+        continue
+      reach, _ = flowspace.Subtract(reach, other.boxes, self.max_pieces)
+      if reach is None:
+        return None
+      deciding.append(other)
+      if not reach:
+        return deciding
+    return None
+
+  def Findings(self):
+    """Yields the Finding of every term, in the order of the filter.
+
+    Unreachable terms are found first: they decide no flow, so they are
+    left out when looking for redundant and overlapping terms.
+    """
+    reaches = []
+    unreachable = set()
+    for index, term in enumerate(self.terms):
+      overlapping = self._Overlapping(index)
+      prior = [i for i in overlapping
+               if i < index and self.terms[i].terminating]
+      reach, taking = self._Reach(term, [self.terms[i] for i in prior])
+      reaches.append((overlapping, prior, reach, taking))
+      if reach == []:
+        unreachable.add(index)
+
+    for index, term in enumerate(self.terms):
+      overlapping, prior, reach, taking = reaches[index]
+      if index in unreachable:
+        yield self._Finding(term, SHADED if len(taking) == 1 else UNREACHABLE,
+                            taking)
+        continue
+      if not term.terminating:
+        continue
+      if reach:
+        later = [self.terms[i] for i in overlapping
+                 if i > index and i not in unreachable and
+                 self.terms[i].terminating]
+        deciding = self._Redundancy(term, reach, later)
+        if deciding:
+          yield self._Finding(term, REDUNDANT, deciding)
+      if term.exact:
+        overlaps = [self.terms[i] for i in prior if i not in unreachable]
+        overlaps = [other for other in overlaps
+                    if other.exact and other.decision != term.decision and
+                    not self._Covers(term, other) and
+                    not self._Covers(other, term)]
+        if overlaps:
+          yield self._Finding(term, OVERLAP, overlaps)
+
+  def _Finding(self, term, kind, others):
+    return Finding(self.filter, term.name, kind, [o.name for o in others])
+
+
+def AnalyzeTerms(filtername, terms, max_pieces=MAX_PIECES):
+  """Find the unreachable, redundant and overlapping terms of a filter.
+
+  Args:
+    filtername: name of the filter, for the findings.
+    terms: list of policy.Term objects, in the order of the filter.
+    max_pieces: most disjoint boxes a term is split into before giving up
+      on it, which bounds the time spent on terms overlapping many others.
+
+  Returns:
+    list of Finding, in the order of the terms.
+  """
+  return list(_FilterAnalysis(filtername, terms, max_pieces).Findings())
+
+
+def AnalyzePolicy(pol, max_pieces=MAX_PIECES):
+  """Find the unreachable, redundant and overlapping terms of a policy.
+
+  Args:
+    pol: policy.Policy object.
+    max_pieces: see AnalyzeTerms.
+
+  Returns:
+    list of Finding of every filter of the policy.
+  """
+  findings = []
+  for header, terms in pol.filters:
+    findings.extend(AnalyzeTerms(flowspace.FilterName(header), terms,
+                                 max_pieces))
+  return findings
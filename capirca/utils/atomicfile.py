@@ -0,0 +1,112 @@
+"""Files replaced atomically, and the state aclgen keeps between builds.
+
+A file is written to a temporary file in its own directory, then renamed
+over the previous one, so that readers, or a build interrupted by a crash
+or a full disk, never see a half-written file. Each writer gets its own
+temporary file, so concurrent runs sharing a file can't publish each
+other's partial writes; the last one to finish wins.
+
+The caches, manifests and times aclgen keeps between builds are JSON
+objects recording the version of their layout, written with Save and read
+back with Load, which ignores the files that are unreadable or out of date.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import tempfile
+
+from absl import logging
+
+
+def Stage(path):
+  """Create a temporary file to replace path with.
+
+  Args:
+    path: the file the temporary file will be renamed to; its directory is
+      created if needed.
+
+  Returns:
+    The open file descriptor and the path of the temporary file, with the
+    permissions of a newly created file.
+  """
+  directory, name = os.path.split(os.fspath(path))
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % name, suffix='.tmp',
+                                  dir=directory or None)
+  # mkstemp creates the file readable by its owner only.
+  os.chmod(tmp_path, 0o666 & ~_Umask())
+  return fd, tmp_path
+
+
+@functools.lru_cache(maxsize=None)
+def _Umask():
+  """Return the file mode creation mask of this process."""
+  umask = os.umask(0)
+  os.umask(umask)
+  return umask
+
+
+@contextlib.contextmanager
+def Open(path, mode='w', **kwargs):
+  """Open a file replacing path once it is closed without an error.
+
+  Args:
+    path: the file to replace.
+    mode: 'w' or 'wb'.
+    **kwargs: passed to open().
+
+  Yields:
+    The file object to write to.
+  """
+  fd, tmp_path = Stage(path)
+  try:
+    with open(fd, mode, **kwargs) as f:
+      yield f
+    os.replace(tmp_path, path)
+  except BaseException:
+    os.unlink(tmp_path)
+    raise
+
+
+def Load(path, description, version, **expected):
+  """Read a file written by Save.
+
+  Args:
+    path: path of the file; it does not need to exist.
+    description: what the file holds, for the log messages.
+    version: the version of the layout of the file.
+    **expected: other fields the file must hold with the same values.
+
+  Returns:
+    The dict saved, or None if the file is missing, unreadable or written
+    for another version or other values of the expected fields.
+  """
+  try:
+    with open(path) as f:
+      data = json.load(f)
+  except FileNotFoundError:
+    return None
+  except (IOError, ValueError) as e:
+    logging.warning('ignoring unreadable %s %s: %s', description, path, e)
+    return None
+  if (not isinstance(data, dict) or data.get('format') != version or
+      any(data.get(k) != v for k, v in expected.items())):
+    logging.info('ignoring out of date %s %s', description, path)
+    return None
+  return data
+
+
+def Save(path, version, **fields):
+  """Write the fields as a JSON object, replacing path atomically.
+
+  Args:
+    path: path of the file.
+    version: the version of the layout of the file, checked by Load.
+    **fields: the values to save.
+  """
+  data = dict(fields, format=version)
+  with Open(path) as f:
+    json.dump(data, f, indent=1, sort_keys=True)
@@ -0,0 +1,221 @@
+"""An on-disk cache letting aclgen skip policies whose inputs did not change.
+
+A policy is rendered again unless all of the following are unchanged since
+the build recorded in the cache:
+  * the policy text with its #include closure expanded,
+  * the definitions of every network and service token the policy looked up,
+    including the tokens nested in them,
+  * the aclgen options affecting the output,
+  * the source code of aclgen, of the generators and of the utilities they
+    use, so that upgrading capirca or fixing a generator renders everything
+    again,
+and every file rendered from the policy still exists.
+
+Policies with expiration dates also depend on the day they are rendered on.
+"""
+
+import datetime
+import functools
+import hashlib
+import os
+import pathlib
+
+from capirca.lib import policy
+from capirca.utils import atomicfile
+
+# Bump when the layout of the cache file or of the fingerprints changes.
+FORMAT_VERSION = 1
+
+DEFINITION_TYPES = ('networks', 'services')
+
+# The capirca package, whose code renders the policies.
+CAPIRCA_DIRECTORY = pathlib.Path(__file__).resolve().parent.parent
+
+
+class BuildCache:
+  """Fingerprints of the policies rendered by a previous aclgen run."""
+
+  def __init__(self, cache_file, definitions, base_directory, options):
+    """Load the cache.
+
+    Args:
+      cache_file: path of the cache file; it does not need to exist.
+      definitions: the definitions from naming.Naming().
+      base_directory: the base directory to look for include files.
+      options: dict of the options affecting the rendered output; the whole
+        cache is discarded if they differ from the recorded ones.
+    """
+    self.cache_file = cache_file
+    self.definitions = definitions
+    self.base_directory = base_directory
+    self.options = options
+    self.entries = {}
+    # fingerprints and token digests of this run, computed once.
+    self._fingerprints = {}
+    self._digests = {}
+    self._Load()
+
+  def _Load(self):
+    data = atomicfile.Load(self.cache_file, 'build cache', FORMAT_VERSION,
+                           options=self.options)
+    if data:
+      self.entries = data.get('policies', {})
+
+  def Save(self):
+    """Write the cache, replacing the previous file atomically."""
+    # forget the policies that were removed or renamed.
+    self.entries = {
+        k: v for k, v in self.entries.items() if os.path.exists(k)
+    }
+    atomicfile.Save(self.cache_file, FORMAT_VERSION, options=self.options,
+                    policies=self.entries)
+
+  def IsFresh(self, policy_file):
+    """Check if a policy can be skipped.
+
+    Args:
+      policy_file: pathlib.Path of the policy.
+
+    Returns:
+      True if the inputs of policy_file are unchanged since it was last
+      rendered and its rendered files exist.
+    """
+    entry = self.entries.get(str(policy_file))
+    if not entry:
+      return False
+    fingerprint = self.Fingerprint(policy_file)
+    if fingerprint is None or fingerprint != entry['fingerprint']:
+      return False
+    for def_type in DEFINITION_TYPES:
+      for token, digest in entry[def_type].items():
+        if self.TokenDigest(def_type, token) != digest:
+          return False
+    return all(os.path.exists(f) for f in entry['outputs'])
+
+  def Update(self, policy_file, outputs, references):
+    """Record a rendered policy.
+
+    Args:
+      policy_file: pathlib.Path of the policy.
+      outputs: list of the pathlib.Path files rendered from the policy.
+      references: dict of the network and service tokens the policy looked
+        up, as returned by naming.Naming.StopReferenceTracking.
+    """
+    fingerprint = self.Fingerprint(policy_file)
+    if fingerprint is None:
+      self.entries.pop(str(policy_file), None)
+      return
+    entry = {
+        'fingerprint': fingerprint,
+        'outputs': sorted(str(f) for f in outputs),
+    }
+    for def_type in DEFINITION_TYPES:
+      entry[def_type] = {
+          token: self.TokenDigest(def_type, token)
+          for token in references.get(def_type, [])
+      }
+    self.entries[str(policy_file)] = entry
+
+  def Fingerprint(self, policy_file):
+    """Hash a policy with its includes expanded, see Fingerprint()."""
+    key = str(policy_file)
+    if key not in self._fingerprints:
+      self._fingerprints[key] = Fingerprint(policy_file, self.base_directory)
+    return self._fingerprints[key]
+
+  def TokenDigest(self, def_type, token):
+    """Hash the definition of a token, see TokenDigest()."""
+    key = (def_type, token)
+    if key not in self._digests:
+      self._digests[key] = TokenDigest(self.definitions, def_type, token)
+    return self._digests[key]
+
+
+def Fingerprint(policy_file, base_directory):
+  """Hash a policy with its includes expanded.
+
+  Args:
+    policy_file: pathlib.Path of the policy.
+    base_directory: the base directory to look for include files.
+
+  Returns:
+    A hex digest, or None if the policy or its includes can't be read.
+  """
+  try:
+    with open(policy_file) as f:
+      lines = policy._Preprocess(  # pylint: disable=protected-access
+          f.read(), base_dir=base_directory)
+  except (IOError, policy.Error):
+    return None
+  sha = hashlib.sha256()
+  for line in lines:
+    sha.update(line.encode('utf-8'))
+    sha.update(b'\n')
+  # expired terms are dropped and expiring ones are reported, so the
+  # output also depends on the day the policy is rendered on.
+  if any('expiration::' in line for line in lines):
+    sha.update(datetime.date.today().isoformat().encode('utf-8'))
+  return sha.hexdigest()
+
+
+def TokenDigest(definitions, def_type, token):
+  """Hash the definition of a token and of the tokens nested in it.
+
+  Args:
+    definitions: the definitions from naming.Naming().
+    def_type: 'networks' or 'services'.
+    token: name of the token.
+
+  Returns:
+    A hex digest, or None if the token is not defined.
+  """
+  group = getattr(definitions, def_type)
+  if token not in group:
+    return None
+  sha = hashlib.sha256()
+  seen = set()
+  pending = [token]
+  while pending:
+    name = pending.pop()
+    if name in seen:
+      continue
+    seen.add(name)
+    sha.update(('%s\0' % name).encode('utf-8'))
+    for item in group[name].items:
+      sha.update(('%s\n' % item).encode('utf-8'))
+      # policies nesting undefined tokens fail to render and are never
+      # recorded, so every nested token is defined.
+      value = item.split('#')[0].strip()
+      if value in group:
+        pending.append(value)
+  return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def CodeDigest():
+  """Hash the source of aclgen and of the capirca/lib and utils modules.
+
+  Returns:
+    A hex digest, changing with any change to the code rendering policies.
+  """
+  sha = hashlib.sha256()
+  sources = [CAPIRCA_DIRECTORY / 'aclgen.py']
+  for package in ('lib', 'utils'):
+    sources.extend(sorted((CAPIRCA_DIRECTORY / package).glob('*.py')))
+  for source in sources:
+    sha.update(('%s\0' % source.relative_to(CAPIRCA_DIRECTORY)).encode(
+        'utf-8'))
+    sha.update(source.read_bytes())
+    sha.update(b'\0')
+  return sha.hexdigest()
+
+
+def Options(output_directory, exp_info, optimize, shade_check):
+  """Return the options recorded with a cache, as stored in the cache file."""
+  return {
+      'output_directory': str(pathlib.Path(output_directory).resolve()),
+      'exp_info': exp_info,
+      'optimize': bool(optimize),
+      'shade_check': bool(shade_check),
+      'code': CodeDigest(),
+  }
@@ -0,0 +1,197 @@
+"""Render times of the policies built by aclgen, to schedule the next build.
+
+aclgen renders the policies in a pool of processes, starting the most
+expensive work first so that a large policy does not keep the build waiting
+once every other policy is done. The cost of a policy is estimated from the
+times recorded by the previous builds, scaled by how much the policy grew
+since, or from its size and the time other policies took per byte when it
+was never rendered.
+
+Times are wall-clock seconds measured in the rendering processes; parsing a
+policy includes saving the parsed policy for its platforms, and rendering a
+platform includes loading it.
+"""
+
+import os
+import pathlib
+
+from absl import logging
+from capirca.utils import atomicfile
+
+# Bump when the layout of the file or the meaning of the times changes.
+FORMAT_VERSION = 2
+
+# Seconds per byte assumed before any policy was rendered.
+DEFAULT_PARSE_RATE = 1e-5
+DEFAULT_RENDER_RATE = 1e-6
+# Bytes of parsed policy per byte of policy assumed at first.
+DEFAULT_EXPANSION = 10.0
+
+# Number of policies listed by Report at the info level.
+REPORT_POLICIES = 10
+
+
+class BuildTimes:
+  """Render times of the policies, recorded by this and previous builds."""
+
+  def __init__(self, times_file=None):
+    """Load the recorded times.
+
+    Args:
+      times_file: optional path of the file holding the times; it does not
+        need to exist. Without it, costs are estimated from sizes only.
+    """
+    self.times_file = times_file
+    # the times of each policy, by resolved path, see _Key.
+    self.entries = {}
+    # the times measured by this build, by policy file.
+    self.measured = {}
+    self._rates = {}
+    if times_file:
+      self._Load()
+
+  def _Load(self):
+    data = atomicfile.Load(self.times_file, 'build times', FORMAT_VERSION)
+    if data:
+      self.entries = data.get('policies', {})
+
+  def Save(self):
+    """Write the times, replacing the previous file atomically."""
+    if not self.times_file:
+      return
+    # forget the policies that were removed or renamed.
+    self.entries = {
+        k: v for k, v in self.entries.items() if os.path.exists(k)
+    }
+    atomicfile.Save(self.times_file, FORMAT_VERSION, policies=self.entries)
+
+  def _Rate(self, platform=None):
+    """Return the seconds per byte parsing, or rendering a platform, took.
+
+    Args:
+      platform: the platform rendered, '' for any of them, or None for
+        parsing.
+
+    Returns:
+      The total time over the total size of the recorded policies, or None
+      if none of them was parsed or rendered for the platform.
+    """
+    if platform not in self._rates:
+      seconds = size = 0
+      for entry in self.entries.values():
+        if platform is None:
+          seconds += entry['parse']
+          size += entry['size']
+        elif platform:
+          if platform in entry['platforms']:
+            seconds += entry['platforms'][platform]
+            size += entry['snapshot']
+        else:
+          seconds += sum(entry['platforms'].values())
+          size += entry['snapshot'] * len(entry['platforms'])
+      self._rates[platform] = seconds / size if size and seconds else None
+    return self._rates[platform]
+
+  def _Expansion(self):
+    """Return how many bytes a parsed policy saves per byte of policy."""
+    if 'expansion' not in self._rates:
+      size = sum(entry['size'] for entry in self.entries.values())
+      snapshot = sum(entry['snapshot'] for entry in self.entries.values())
+      self._rates['expansion'] = (
+          snapshot / size if size and snapshot else DEFAULT_EXPANSION)
+    return self._rates['expansion']
+
+  def PolicyCost(self, policy_file, size):
+    """Estimate the time a policy keeps the build busy, before parsing it.
+
+    That is the time parsing it and then rendering its slowest platform,
+    which can't be started earlier.
+
+    Args:
+      policy_file: pathlib.Path of the policy.
+      size: size of the policy file in bytes.
+
+    Returns:
+      The estimated seconds.
+    """
+    entry = self.entries.get(_Key(policy_file))
+    if entry:
+      seconds = entry['parse'] + max(entry['platforms'].values(), default=0)
+      return seconds * size / entry['size'] if entry['size'] else seconds
+    parse_rate = self._Rate() or DEFAULT_PARSE_RATE
+    render_rate = self._Rate('') or DEFAULT_RENDER_RATE
+    return size * (parse_rate + self._Expansion() * render_rate)
+
+  def PlatformCost(self, policy_file, platform, snapshot_size):
+    """Estimate the time rendering a platform of a parsed policy takes.
+
+    Args:
+      policy_file: pathlib.Path of the policy.
+      platform: name of the platform.
+      snapshot_size: size of the saved parsed policy in bytes.
+
+    Returns:
+      The estimated seconds.
+    """
+    entry = self.entries.get(_Key(policy_file))
+    if entry and platform in entry['platforms']:
+      seconds = entry['platforms'][platform]
+      if entry['snapshot']:
+        return seconds * snapshot_size / entry['snapshot']
+      return seconds
+    rate = self._Rate(platform) or self._Rate('') or DEFAULT_RENDER_RATE
+    return snapshot_size * rate
+
+  def Record(self, policy_file, size, snapshot_size, parse, platforms):
+    """Record the times a policy took in this build.
+
+    Args:
+      policy_file: pathlib.Path of the policy.
+      size: size of the policy file in bytes.
+      snapshot_size: size of the saved parsed policy in bytes, or None if it
+        was not saved; the times are then reported but not kept.
+      parse: seconds parsing the policy took.
+      platforms: dict of the seconds rendering each platform took.
+    """
+    entry = {
+        'size': size,
+        'snapshot': snapshot_size,
+        'parse': parse,
+        'platforms': dict(platforms),
+    }
+    self.measured[str(policy_file)] = entry
+    if snapshot_size is not None:
+      self.entries[_Key(policy_file)] = entry
+
+  def Report(self):
+    """Log the times measured by this build, by platform and by policy."""
+    if not self.measured:
+      return
+    platforms = {}
+    for entry in self.measured.values():
+      for platform, seconds in entry['platforms'].items():
+        count, total = platforms.get(platform, (0, 0.0))
+        platforms[platform] = (count + 1, total + seconds)
+    policies = sorted(self.measured.items(), key=lambda item: -_Total(item[1]))
+    logging.info('render times of %d policies, %.2fs in all:', len(policies),
+                 sum(_Total(entry) for _, entry in policies))
+    logging.info('  %-20s %8s %10s', 'platform', 'policies', 'seconds')
+    for platform, (count, seconds) in sorted(platforms.items(),
+                                             key=lambda item: -item[1][1]):
+      logging.info('  %-20s %8d %10.2f', platform, count, seconds)
+    for index, (policy_file, entry) in enumerate(policies):
+      log = logging.info if index < REPORT_POLICIES else logging.debug
+      log('  %10.2fs %s (parse %.2fs%s)', _Total(entry), policy_file,
+          entry['parse'],
+          ''.join(', %s %.2fs' % item for item in sorted(
+              entry['platforms'].items(), key=lambda item: -item[1])))
+
+
+def _Key(policy_file):
+  """Return the key of a policy, the same whatever the current directory."""
+  return str(pathlib.Path(policy_file).resolve())
+
+
+def _Total(entry):
+  """Return the seconds parsing and rendering a policy took."""
+  return entry['parse'] + sum(entry['platforms'].values())
@@ -14,7 +14,13 @@ defaults = {
     'ignore_directories': ['DEPRECATED', 'def'],
     'max_renderers': 10,
     'shade_check': False,
-    'exp_info': 2
+    'exp_info': 2,
+    'build_cache': None,
+    'definitions_snapshot': None,
+    'output_manifest': None,
+    'build_times': None,
+    'profile': None,
+    'profile_trace': None,
 }
 
 
@@ -42,6 +48,12 @@ def flags_to_dict(absl_flags):
       'max_renderers': absl_flags.max_renderers,
       'shade_check': absl_flags.shade_check,
       'exp_info': absl_flags.exp_info,
+      'build_cache': absl_flags.build_cache,
+      'definitions_snapshot': absl_flags.definitions_snapshot,
+      'output_manifest': absl_flags.output_manifest,
+      'build_times': absl_flags.build_times,
+      'profile': absl_flags.profile,
+      'profile_trace': absl_flags.profile_trace,
   }
 
   return {
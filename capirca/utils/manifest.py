@@ -0,0 +1,190 @@
+"""A manifest of the files rendered by aclgen, to detect changed outputs.
+
+aclgen compares every rendered ACL with the file already on disk, ignoring
+the lines holding repository tags. The manifest records a digest of each
+rendered file normalized the same way, with the size and modification time
+the file had when it was recorded, so the comparison only needs the digest
+of the new text. A file is read again when its entry is missing or its size
+or modification time changed.
+"""
+
+import hashlib
+import os
+
+from capirca.utils import atomicfile
+
+# Bump when the layout of the manifest file or of the digests changes.
+FORMAT_VERSION = 1
+
+# Characters read at a time while hashing a file.
+READ_SIZE = 1 << 16
+
+# written apart so that the repository does not expand them here.
+_REPOSITORY_TAGS = tuple(
+    tag.replace(' ', '') for tag in ('$I d:', '$Da te:', '$Rev ision:'))
+
+
+def HasRepositoryTag(line):
+  """Check if a line holds a repository tag, such as Id:, expanded on submit."""
+  return any(tag in line for tag in _REPOSITORY_TAGS)
+
+
+class TextHasher:
+  r"""Hash text written in chunks, leaving out the repository tag lines.
+
+  Texts hash the same when their lines, as split by str.split('\n'), are
+  equal once the lines holding repository tags are removed.
+  """
+
+  def __init__(self, writer=None):
+    """Initializer.
+
+    Args:
+      writer: an optional object with a write(str) method the text is also
+        written to.
+    """
+    self.writer = writer
+    self._sha = hashlib.sha256()
+    # the text of the last line seen, which may continue in the next chunk.
+    self._partial = []
+
+  def write(self, text):  # pylint: disable=invalid-name
+    if self.writer is not None:
+      self.writer.write(text)
+    self._partial.append(text)
+    if '\n' not in text:
+      return
+    text = ''.join(self._partial)
+    end = text.rindex('\n') + 1
+    self._partial = [text[end:]]
+    self._Update(text[:end])
+
+  def _Update(self, lines):
+    """Hash complete lines, each ending in a newline."""
+    if HasRepositoryTag(lines):
+      lines = ''.join(line + '\n' for line in lines.split('\n')[:-1]
+                      if not HasRepositoryTag(line))
+    self._sha.update(lines.encode('utf-8'))
+
+  def hexdigest(self):  # pylint: disable=invalid-name
+    """Return the digest of the text written so far."""
+    sha = self._sha.copy()
+    line = ''.join(self._partial)
+    if not HasRepositoryTag(line):
+      sha.update(line.encode('utf-8'))
+      sha.update(b'\n')
+    return sha.hexdigest()
+
+
+def TextDigest(text):
+  """Return the digest of a text, see TextHasher."""
+  hasher = TextHasher()
+  hasher.write(text)
+  return hasher.hexdigest()
+
+
+def FileDigest(file_name):
+  """Return the digest of a text file, see TextHasher.
+
+  Args:
+    file_name: path of the file.
+
+  Returns:
+    A hex digest, or None if the file can't be read.
+  """
+  hasher = TextHasher()
+  try:
+    with open(file_name) as f:
+      for chunk in iter(lambda: f.read(READ_SIZE), ''):
+        hasher.write(chunk)
+  except (IOError, ValueError):
+    return None
+  return hasher.hexdigest()
+
+
+class Manifest:
+  """Digests of the files rendered by previous aclgen runs."""
+
+  def __init__(self, manifest_file):
+    """Load the manifest.
+
+    Args:
+      manifest_file: path of the manifest file; it does not need to exist.
+    """
+    self.manifest_file = manifest_file
+    self.entries = {}
+    # digests of the files rendered by this process, not yet recorded.
+    self.rendered = {}
+    self._Load()
+
+  def _Load(self):
+    data = atomicfile.Load(self.manifest_file, 'output manifest',
+                           FORMAT_VERSION)
+    if data:
+      self.entries = data.get('files', {})
+
+  def Save(self):
+    """Write the manifest, replacing the previous file atomically."""
+    # forget the files that were removed.
+    self.entries = {
+        k: v for k, v in self.entries.items() if os.path.exists(k)
+    }
+    atomicfile.Save(self.manifest_file, FORMAT_VERSION, files=self.entries)
+
+  def Digest(self, file_name):
+    """Return the digest of a file, reading it only if its entry is stale.
+
+    Args:
+      file_name: path of the file.
+
+    Returns:
+      A hex digest, or None if the file can't be read.
+    """
+    try:
+      stat = os.stat(file_name)
+    except OSError:
+      return None
+    entry = self.entries.get(str(file_name))
+    if (entry and entry['size'] == stat.st_size and
+        entry['mtime_ns'] == stat.st_mtime_ns):
+      return entry['digest']
+    return FileDigest(file_name)
+
+  def Changed(self, file_name, digest):
+    """Check if a file differs from a newly rendered text.
+
+    The digest of the new text is kept, see Update.
+
+    Args:
+      file_name: path of the file.
+      digest: digest of the newly rendered text.
+
+    Returns:
+      True if the file is missing or differs from the text.
+    """
+    self.rendered[str(file_name)] = digest
+    return self.Digest(file_name) != digest
+
+  def TakeRendered(self):
+    """Return and forget the digests kept by Changed."""
+    rendered, self.rendered = self.rendered, {}
+    return rendered
+
+  def Update(self, rendered):
+    """Record files holding newly rendered texts.
+
+    Args:
+      rendered: dict of the digests of the texts by file name, as returned by
+        TakeRendered once the changed files are written.
+    """
+    for file_name, digest in rendered.items():
+      try:
+        stat = os.stat(file_name)
+      except OSError:
+        self.entries.pop(file_name, None)
+        continue
+      self.entries[file_name] = {
+          'digest': digest,
+          'size': stat.st_size,
+          'mtime_ns': stat.st_mtime_ns,
+      }
@@ -0,0 +1,307 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Timers and counters of where the time goes while rendering policies.
+
+Profiling is off unless Enable is called, and the timers then cost a
+function call. Once enabled, every Timer records how many times it ran and
+the seconds it took, under the policy file set by File and in aggregate.
+Timers are inclusive: the time of a timer running inside another one, such
+as Term.AddObject within the parse, is counted in both. A timer running
+inside itself, like a recursive function, is only counted once.
+
+Processes record their own profile; a pool process sends what it recorded
+with each result, see Collect and Merge.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Bump when the layout of the saved profile changes.
+FORMAT_VERSION = 1
+
+# The file of the timers running outside of a File block.
+NO_FILE = ''
+
+
+class _NullTimer:
+  """A context manager doing nothing, the Timer of a disabled profile."""
+
+  def __enter__(self):
+    return None
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# The profile recorded by this process, or None when profiling is off.
+_profile = None
+
+
+class Profile:
+  """Timers, counters and trace events recorded by a process."""
+
+  def __init__(self, trace=False):
+    """Initializer.
+
+    Args:
+      trace: also record each run of the timers, for a Chrome trace.
+    """
+    self.trace = trace
+    # {file: {'timers': {name: [count, seconds]}, 'counters': {name: count}}}
+    self.files = {}
+    # trace events in the Chrome trace event format.
+    self.events = []
+    self._lock = threading.Lock()
+    # the file and the running timers of each thread.
+    self._local = threading.local()
+
+  def _File(self, file_name):
+    entry = self.files.get(file_name)
+    if entry is None:
+      entry = self.files[file_name] = {'timers': {}, 'counters': {}}
+    return entry
+
+  @property
+  def current_file(self):
+    return getattr(self._local, 'file', NO_FILE)
+
+  @contextlib.contextmanager
+  def File(self, file_name):
+    previous = self.current_file
+    self._local.file = str(file_name)
+    try:
+      yield
+    finally:
+      self._local.file = previous
+
+  @contextlib.contextmanager
+  def Timer(self, name):
+    running = getattr(self._local, 'running', None)
+    if running is None:
+      running = self._local.running = set()
+    if name in running:
+      yield
+      return
+    running.add(name)
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      seconds = time.perf_counter() - start
+      running.discard(name)
+      self._AddTime(name, start, seconds)
+
+  def _AddTime(self, name, start, seconds):
+    file_name = self.current_file
+    with self._lock:
+      timers = self._File(file_name)['timers']
+      count, total = timers.get(name, (0, 0.0))
+      timers[name] = [count + 1, total + seconds]
+      if self.trace:
+        self.events.append({
+            'name': name,
+            'cat': 'aclgen',
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': seconds * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': {'file': file_name},
+        })
+
+  def Count(self, name, count):
+    file_name = self.current_file
+    with self._lock:
+      counters = self._File(file_name)['counters']
+      counters[name] = counters.get(name, 0) + count
+
+  def Collect(self):
+    with self._lock:
+      data = {'files': self.files, 'events': self.events}
+      self.files = {}
+      self.events = []
+    return data
+
+  def Merge(self, data):
+    with self._lock:
+      for file_name, recorded in data['files'].items():
+        entry = self._File(file_name)
+        for name, (count, seconds) in recorded['timers'].items():
+          total_count, total_seconds = entry['timers'].get(name, (0, 0.0))
+          entry['timers'][name] = [total_count + count, total_seconds + seconds]
+        for name, count in recorded['counters'].items():
+          entry['counters'][name] = entry['counters'].get(name, 0) + count
+      self.events.extend(data['events'])
+
+
+def Enable(trace=False):
+  """Start recording a new profile in this process.
+
+  Args:
+    trace: also record each run of the timers, for a Chrome trace.
+  """
+  global _profile
+  _profile = Profile(trace)
+
+
+def Disable():
+  """Stop profiling, forgetting what was recorded."""
+  global _profile
+  _profile = None
+
+
+def Enabled():
+  """Return True if a profile is being recorded."""
+  return _profile is not None
+
+
+def Tracing():
+  """Return True if the runs of the timers are recorded for a trace."""
+  return _profile is not None and _profile.trace
+
+
+def Timer(name):
+  """Return a context manager timing its block under name.
+
+  Args:
+    name: name of the timer.
+
+  Returns:
+    A context manager, doing nothing when profiling is off.
+  """
+  if _profile is None:
+    return _NULL_TIMER
+  return _profile.Timer(name)
+
+
+def Timed(name):
+  """Decorate a function to time each call of it under name, see Timer."""
+
+  def Decorator(function):
+
+    @functools.wraps(function)
+    def Wrapper(*args, **kwargs):
+      if _profile is None:
+        return function(*args, **kwargs)
+      with _profile.Timer(name):
+        return function(*args, **kwargs)
+
+    return Wrapper
+
+  return Decorator
+
+
+def Count(name, count=1):
+  """Add count to the counter name."""
+  if _profile is not None:
+    _profile.Count(name, count)
+
+
+def File(file_name):
+  """Return a context manager recording the timers of its block under a file.
+
+  Args:
+    file_name: path of the policy file being rendered.
+
+  Returns:
+    A context manager, doing nothing when profiling is off.
+  """
+  if _profile is None:
+    return _NULL_TIMER
+  return _profile.File(file_name)
+
+
+def Collect():
+  """Return and forget what this process recorded, or None if it is off.
+
+  Returns:
+    A dict to Merge in the profile of another process.
+  """
+  if _profile is None:
+    return None
+  return _profile.Collect()
+
+
+def Merge(data):
+  """Add what another process recorded, as returned by Collect, if any."""
+  if _profile is not None and data is not None:
+    _profile.Merge(data)
+
+
+def _Summary(entries):
+  """Sum the timers and counters of several files."""
+  timers = {}
+  counters = {}
+  for entry in entries:
+    for name, (count, seconds) in entry['timers'].items():
+      total_count, total_seconds = timers.get(name, (0, 0.0))
+      timers[name] = (total_count + count, total_seconds + seconds)
+    for name, count in entry['counters'].items():
+      counters[name] = counters.get(name, 0) + count
+  return {
+      'timers': {
+          name: {'count': count, 'seconds': seconds}
+          for name, (count, seconds) in timers.items()
+      },
+      'counters': counters,
+  }
+
+
+def Results():
+  """Return what was recorded, by policy file and in aggregate.
+
+  Returns:
+    A dict holding the 'total' timers and counters, and those of each policy
+    file in 'files', or None if profiling is off.
+  """
+  if _profile is None:
+    return None
+  with _profile._lock:  # pylint: disable=protected-access
+    files = dict(_profile.files)
+  return {
+      'format': FORMAT_VERSION,
+      'total': _Summary(files.values()),
+      'files': {
+          file_name: _Summary([entry])
+          for file_name, entry in sorted(files.items())
+          if file_name != NO_FILE
+      },
+  }
+
+
+def Save(profile_file=None, trace_file=None):
+  """Write the recorded profile as JSON, and its Chrome trace.
+
+  Args:
+    profile_file: optional path of the profile, see Results.
+    trace_file: optional path of the trace, in the Chrome trace event format
+      read by chrome://tracing and Perfetto.
+  """
+  if _profile is None:
+    return
+  if profile_file:
+    with open(profile_file, 'w') as f:
+      json.dump(Results(), f, indent=1, sort_keys=True)
+  if trace_file:
+    with _profile._lock:  # pylint: disable=protected-access
+      events = list(_profile.events)
+    with open(trace_file, 'w') as f:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,59 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Command line interface to policydiff library.
+
+Prints the flows newly permitted (+) and denied (-) by every filter of the
+new revision of a policy, e.g. of a policy before and after a change:
+  git show HEAD~:policies/pol/sample.pol > /tmp/old.pol
+  python policydiff_cmdline.py /tmp/old.pol policies/pol/sample.pol
+"""
+
+from optparse import OptionParser
+
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import policydiff
+
+
+def main():
+  usage = 'usage: %prog [options] old-policy-file new-policy-file'
+  _parser = OptionParser(usage)
+  _parser.add_option('--definitions-directory', dest='definitions',
+                     help='definitions directory', default='./def')
+  _parser.add_option('--old-definitions-directory', dest='old_definitions',
+                     help='definitions directory of the old policy, '
+                     'defaults to --definitions-directory', default=None)
+  _parser.add_option('--base-directory', dest='base_dir',
+                     help='base directory for includes', default='./policies')
+  (FLAGS, args) = _parser.parse_args()
+  if len(args) != 2:
+    _parser.error('expected an old and a new policy file')
+
+  defs = naming.Naming(FLAGS.definitions)
+  old_defs = defs
+  if FLAGS.old_definitions:
+    old_defs = naming.Naming(FLAGS.old_definitions)
+  old_pol = policy.ParsePolicy(open(args[0]).read(), old_defs,
+                               base_dir=FLAGS.base_dir, filename=args[0])
+  new_pol = policy.ParsePolicy(open(args[1]).read(), defs,
+                               base_dir=FLAGS.base_dir, filename=args[1])
+  for diff in policydiff.DiffPolicies(old_pol, new_pol):
+    if diff:
+      print(str(diff))
+
+
+if __name__ == '__main__':
+  main()
@@ -38,7 +38,11 @@ setuptools.setup(
     packages=setuptools.find_packages(exclude=['tests*']),
     zip_safe=False,
     entry_points={
-        'console_scripts': ['aclgen = capirca.aclgen:EntryPoint'],
+        'console_scripts': [
+            'aclgen = capirca.aclgen:EntryPoint',
+            'aclcheck_server = capirca.aclcheck_server:EntryPoint',
+            'aclanalyze = capirca.aclanalyze:EntryPoint',
+        ],
     },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
@@ -57,5 +61,9 @@ setuptools.setup(
         'six',
         'PyYAML',
     ],
+    extras_require={
+        # aclcheck_numpy checks arrays of flows.
+        'numpy': ['numpy'],
+    },
     python_requires='>=3.6',
 )
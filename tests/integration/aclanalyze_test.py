@@ -0,0 +1,59 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for aclanalyze.py module."""
+
+import os
+
+from absl.testing import absltest
+from capirca import aclanalyze
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import redundancy
+
+# the sample policy includes policies/includes/untrusted-networks-blocking.inc.
+POLICY_FILE = os.path.join('policies', 'pol', 'sample_multitarget.pol')
+
+
+class AclAnalyzeTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.definitions = naming.Naming('def')
+
+  def testAnalyzeSamplePolicy(self):
+    findings = aclanalyze.Analyze([POLICY_FILE], self.definitions, 'policies',
+                                  redundancy.KINDS, redundancy.MAX_PIECES)
+    self.assertIn(
+        (POLICY_FILE, 'edge-inbound: deny-to-rfc1918 is redundant with the '
+         'later terms default-deny'),
+        [(f, str(finding)) for f, finding in findings])
+    self.assertCountEqual({f for f, _ in findings}, [POLICY_FILE])
+
+  def testAnalyzeKinds(self):
+    findings = aclanalyze.Analyze([POLICY_FILE], self.definitions, 'policies',
+                                  [redundancy.REDUNDANT], redundancy.MAX_PIECES)
+    self.assertEqual(
+        [(finding.filter, finding.term, finding.terms)
+         for _, finding in findings],
+        [('edge-inbound', 'deny-to-rfc1918', ['default-deny'])])
+
+  def testAnalyzeIncludesFromBaseDirectory(self):
+    with self.assertRaises(policy.Error):
+      aclanalyze.Analyze([POLICY_FILE], self.definitions,
+                         os.path.join('policies', 'pol'), redundancy.KINDS,
+                         redundancy.MAX_PIECES)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,161 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for aclcheck_server.py module."""
+
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from urllib import error
+from urllib import request
+
+from absl.testing import absltest
+from capirca import aclcheck_server
+from capirca.lib import policy
+
+POLICY = """
+header {
+  target:: juniper test-filter
+}
+term allow-web {
+  destination-address:: WEB
+  destination-port:: HTTP
+  protocol:: tcp
+  action:: accept
+}
+term deny-other {
+  action:: deny
+}
+"""
+
+OTHER_POLICY = """
+header {
+  target:: juniper other-filter
+}
+term allow-other {
+  destination-address:: OTHER
+  action:: accept
+}
+"""
+
+
+class PolicyStoreTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.def_dir = os.path.join(self.base_dir, 'def')
+    os.mkdir(self.def_dir)
+    self.pol_dir = os.path.join(self.base_dir, 'policies')
+    os.mkdir(self.pol_dir)
+    self._WriteDefinitions('WEB = 10.0.0.1/32\nOTHER = 10.2.0.0/16\n')
+    pathlib.Path(self.def_dir, 'SERVICES.svc').write_text('HTTP = 80/tcp\n')
+    self.policy_file = pathlib.Path(self.pol_dir, 'test.pol')
+    self.policy_file.write_text(POLICY)
+    pathlib.Path(self.pol_dir, 'other.pol').write_text(OTHER_POLICY)
+    self.now = 0.0
+    self.store = aclcheck_server.PolicyStore(
+        self.def_dir, self.pol_dir, reload_interval=1.0,
+        clock=lambda: self.now)
+
+  def _WriteDefinitions(self, text):
+    pathlib.Path(self.def_dir, 'NETWORK.net').write_text(text)
+
+  def _Term(self, policy_file, dst):
+    result = self.store.Checker(policy_file).Check(dst=dst, dport='80',
+                                                   proto='tcp')
+    return [match.term for match in result.ExactMatches()]
+
+  def testCompiledOnce(self):
+    with mock.patch.object(policy, 'ParsePolicy',
+                           wraps=policy.ParsePolicy) as parse:
+      self.assertEqual(self._Term('test.pol', '10.0.0.1'), ['allow-web'])
+      self.now = 5.0
+      self.assertEqual(self._Term('test.pol', '10.0.0.1'), ['allow-web'])
+      self.assertEqual(parse.call_count, 1)
+
+  def testPolicyChanged(self):
+    self.assertEqual(self._Term('test.pol', '10.0.0.1'), ['allow-web'])
+    self.policy_file.write_text(POLICY.replace('accept', 'reject'))
+    # not checked again within the reload interval.
+    self.now = 0.5
+    checker = self.store.Checker('test.pol')
+    self.assertEqual(
+        checker.Check(dst='10.0.0.1', dport='80', proto='tcp')
+        .ExactMatches()[0].action, 'accept')
+    self.now = 1.5
+    checker = self.store.Checker('test.pol')
+    self.assertEqual(
+        checker.Check(dst='10.0.0.1', dport='80', proto='tcp')
+        .ExactMatches()[0].action, 'reject')
+
+  def testDefinitionsChanged(self):
+    self.assertEqual(self._Term('test.pol', '10.0.0.9'), ['deny-other'])
+    self.assertEqual(self._Term('other.pol', '10.2.0.1'), ['allow-other'])
+    self._WriteDefinitions('WEB = 10.0.0.0/24\nOTHER = 10.2.0.0/16\n')
+    self.now = 1.5
+    with mock.patch.object(policy, 'ParsePolicy',
+                           wraps=policy.ParsePolicy) as parse:
+      self.assertEqual(self._Term('test.pol', '10.0.0.9'), ['allow-web'])
+      self.assertEqual(self._Term('other.pol', '10.2.0.1'), ['allow-other'])
+      # other.pol does not use WEB.
+      parse.assert_called_once()
+
+  def testPolicyNotFound(self):
+    for policy_file in ('missing.pol', '../def/NETWORK.net', '/etc/passwd'):
+      with self.subTest(policy_file=policy_file):
+        self.assertRaises(aclcheck_server.PolicyNotFoundError,
+                          self.store.Checker, policy_file)
+
+  def testServer(self):
+    server = aclcheck_server.TCPServer(('127.0.0.1', 0), self.store)
+    self.addCleanup(server.server_close)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(server.shutdown)
+    url = 'http://127.0.0.1:%d/check' % server.server_address[1]
+
+    with request.urlopen(url + '?policy=test.pol&dst=10.0.0.1&dport=80'
+                         '&proto=tcp') as response:
+      result = json.load(response)
+    self.assertEqual(result['exact_matches'], [
+        {'filter': 'test-filter', 'term': 'allow-web', 'action': 'accept',
+         'possibles': [], 'qos': None}])
+
+    body = json.dumps({'policy': 'test.pol',
+                       'flows': [{'dst': '10.0.0.1', 'dport': 80,
+                                  'proto': 'tcp'},
+                                 {'dst': '10.0.0.9'}]}).encode('utf-8')
+    with request.urlopen(url, body) as response:
+      results = json.load(response)['results']
+    self.assertEqual([[m['term'] for m in r['exact_matches']]
+                      for r in results], [['allow-web'], ['deny-other']])
+
+    for query, status in (('?policy=missing.pol', 404),
+                          ('?dst=10.0.0.1', 400),
+                          ('?policy=test.pol&dst=10.0.0.300', 400)):
+      with self.subTest(query=query):
+        with self.assertRaises(error.HTTPError) as e:
+          request.urlopen(url + query)
+        self.assertEqual(e.exception.code, status)
+        self.assertIn('error', json.load(e.exception))
+        e.exception.close()
+
+
+if __name__ == '__main__':
+  absltest.main()
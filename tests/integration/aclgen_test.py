@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import multiprocessing
 import os
 import pathlib
@@ -24,12 +25,72 @@ from absl import app
 from absl import flags
 from absl.testing import absltest
 from capirca import aclgen
+from capirca.lib import cisco
+from capirca.lib import iptables
+from capirca.lib import juniper
+from capirca.lib import junipermsmpc
+from capirca.lib import junipersrx
+from capirca.lib import naming
+from capirca.lib import pcap
+from capirca.lib import policy
+from capirca.utils import atomicfile
+from capirca.utils import buildtimes
+from capirca.utils import manifest
+from capirca.utils import profiling
 
 FLAGS = flags.FLAGS
 aclgen.SetupFlags()  # Ensure flags are set up only once
 # Pass only the program name into absl so it uses the default flags
 FLAGS(sys.argv[0:1])
 
+# msmpc renames the application of deny-other-web, which repeats the ports
+# of accept-web, in the policy it renders; cisco rejects the renamed term.
+MULTI_PLATFORM_POLICY = """
+header {
+  target:: juniper multi inet
+  target:: msmpc multi
+  target:: cisco multi extended
+  target:: iptables INPUT ACCEPT
+  target:: pcap multi
+}
+term accept-web {
+  source-address:: INTERNAL
+  destination-address:: WEB_SERVERS
+  protocol:: tcp
+  destination-port:: HTTP HTTPS
+  action:: accept
+}
+term deny-other-web {
+  protocol:: tcp
+  destination-port:: HTTP HTTPS
+  action:: deny
+}
+term deny-rest {
+  action:: deny
+}
+header {
+  target:: srx from-zone internal to-zone external
+}
+term allow-dns {
+  destination-address:: %s
+  protocol:: udp
+  destination-port:: DNS
+  action:: accept
+}
+"""
+
+# the generator rendering each file of MULTI_PLATFORM_POLICY.
+MULTI_PLATFORM_FILES = {
+    'multi.jcl': juniper.Juniper,
+    'multi.msmpc': junipermsmpc.JuniperMSMPC,
+    'multi.acl': cisco.Cisco,
+    'multi': iptables.Iptables,
+    'multi-accept.pcap': pcap.PcapFilter,
+    'multi-deny.pcap': lambda pol, exp_info: pcap.PcapFilter(
+        pol, exp_info, invert=True),
+    'multi.srx': junipersrx.JuniperSRX,
+}
+
 
 class TestAclGenDemo(absltest.TestCase):
   """Ensure Capirca demo runs successfully out-of-the-box."""
@@ -119,6 +180,320 @@ class TestAclGenDemo(absltest.TestCase):
     mock_writer.assert_called_with(
         pathlib.Path(self.test_subdirectory, 'sample_cisco_lab.acl'), mock.ANY)
 
+  @mock.patch.object(aclgen, '_WriteFile', autospec=True)
+  def test_errors_do_not_block_other_policies(self, mock_writer):
+    base_dir = os.path.join(self.test_subdirectory, 'streamed')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    shutil.copy(os.path.join(self.pol_dir, 'pol/sample_cisco_lab.pol'),
+                os.path.join(base_dir, 'pol'))
+    with open(os.path.join(base_dir, 'pol/broken.pol'), 'w') as f:
+      f.write('header {\n  target:: juniper broken\n}\n'
+              'term broken {\n  source-address:: UNDEFINED_TOKEN\n'
+              '  action:: accept\n}\n')
+    with self.assertRaises(SystemExit):
+      aclgen.Run(
+          base_dir,
+          self.def_dir,
+          None,
+          self.test_subdirectory,
+          self.exp_info,
+          2,
+          self.ignore_directories,
+          None,
+          None,
+          self.context,
+      )
+    mock_writer.assert_called_once_with(
+        pathlib.Path(self.test_subdirectory, 'sample_cisco_lab.acl'), mock.ANY)
+
+  def _MultiPlatformPolicy(self, network='INTERNAL'):
+    base_dir = os.path.join(self.test_subdirectory, 'multi')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    policy_file = pathlib.Path(base_dir, 'pol', 'multi.pol')
+    policy_file.write_text(MULTI_PLATFORM_POLICY % network)
+    return base_dir, policy_file
+
+  def test_every_platform_renders_from_an_unmodified_policy(self):
+    base_dir, policy_file = self._MultiPlatformPolicy()
+    definitions = naming.Naming(self.def_dir)
+    for max_renderers in (1, 2):
+      with self.subTest(max_renderers=max_renderers):
+        output_dir = os.path.join(self.test_subdirectory,
+                                  'filters-%d' % max_renderers)
+        aclgen.Run(base_dir, self.def_dir, None, output_dir, self.exp_info,
+                   max_renderers, self.ignore_directories, None, None,
+                   self.context)
+        self.assertCountEqual(os.listdir(output_dir), MULTI_PLATFORM_FILES)
+        # each file is the same as rendering its platform alone, so the
+        # platforms rendered before it left the policy unchanged.
+        for name, generator in MULTI_PLATFORM_FILES.items():
+          pol = policy.ParsePolicy(policy_file.read_text(), definitions)
+          self.assertEqual(pathlib.Path(output_dir, name).read_text(),
+                           str(generator(pol, self.exp_info)), name)
+
+  def test_pool_renders_with_the_definitions_of_the_initializer(self):
+    # the policy uses a token only the definitions handed to the pool
+    # processes have, not those a process would parse itself.
+    base_dir, _ = self._MultiPlatformPolicy('POOL_ONLY')
+    output_dir = os.path.join(self.test_subdirectory, 'filters')
+    parse_definitions = naming.Naming.__init__
+
+    def Definitions(definitions, *args, **kwargs):
+      parse_definitions(definitions, *args, **kwargs)
+      definitions.ParseNetworkList(['POOL_ONLY = 192.0.2.0/24'])
+
+    # spawned processes inherit nothing from this one.
+    context = multiprocessing.get_context('spawn')
+    with mock.patch.object(naming.Naming, '__init__', Definitions):
+      with mock.patch.object(context, 'Pool', wraps=context.Pool) as pool:
+        aclgen.Run(base_dir, self.def_dir, None, output_dir, self.exp_info,
+                   2, self.ignore_directories, None, None, context)
+    pool.assert_called_once()
+    self.assertIs(pool.call_args.kwargs['initializer'], aclgen._InitRenderer)
+    definitions = pool.call_args.kwargs['initargs'][0]
+    self.assertIn('POOL_ONLY', definitions.networks)
+    self.assertIn('192.0.2.0/24',
+                  pathlib.Path(output_dir, 'multi.srx').read_text())
+
+  def test_platforms_of_a_policy_are_written_together(self):
+    base_dir = os.path.join(self.test_subdirectory, 'platforms')
+    output_dir = os.path.join(self.test_subdirectory, 'filters')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    shutil.copytree(os.path.join(self.pol_dir, 'includes'),
+                    os.path.join(base_dir, 'includes'))
+    shutil.copy(os.path.join(self.pol_dir, 'pol/sample_multitarget.pol'),
+                os.path.join(base_dir, 'pol'))
+    # juniper renders this policy, cisco rejects it: neither file is written.
+    with open(os.path.join(base_dir, 'pol/mixed.pol'), 'w') as f:
+      f.write('header {\n  target:: juniper mixed\n'
+              '  target:: cisco mixed standard\n}\n'
+              'term web {\n  protocol:: tcp\n  destination-port:: HTTP\n'
+              '  action:: accept\n}\n')
+    with self.assertRaises(SystemExit):
+      aclgen.Run(base_dir, self.def_dir, None, output_dir, self.exp_info,
+                 2, self.ignore_directories, None, None, self.context)
+    sequential_dir = os.path.join(self.test_subdirectory, 'sequential')
+    aclgen.Run(base_dir, self.def_dir,
+               os.path.join(base_dir, 'pol/sample_multitarget.pol'),
+               sequential_dir, self.exp_info, 1, self.ignore_directories,
+               None, None, self.context)
+    written = sorted(os.listdir(output_dir))
+    self.assertEqual(written, sorted(os.listdir(sequential_dir)))
+    self.assertNotIn('mixed.jcl', written)
+    for name in written:
+      self.assertEqual(pathlib.Path(output_dir, name).read_text(),
+                       pathlib.Path(sequential_dir, name).read_text(), name)
+
+  def test_scheduler_starts_expensive_jobs_first(self):
+    started = []
+
+    class Pool:
+
+      def apply_async(self, function, args, callback, error_callback):
+        started.append(args[0])
+        try:
+          callback(function(*args))
+        except ValueError as e:
+          error_callback(e)
+
+    def Job(name):
+      if name == 'error':
+        raise ValueError(name)
+      return name
+
+    scheduler = aclgen._Scheduler(Pool(), 1)
+    for cost, name in ((1, 'cheap'), (3, 'costly'), (2, 'error'), (1, 'last')):
+      scheduler.Add(cost, Job, name)
+    results = []
+    for result in scheduler.Results():
+      results.append(result)
+      if result == 'costly':
+        scheduler.Add(2.5, Job, 'added')
+    self.assertEqual(started, ['costly', 'added', 'error', 'cheap', 'last'])
+    self.assertEqual(results[:2], ['costly', 'added'])
+    self.assertIsInstance(results[2], ValueError)
+
+  def test_build_times_are_recorded(self):
+    base_dir = os.path.join(self.test_subdirectory, 'timed')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    shutil.copytree(os.path.join(self.pol_dir, 'includes'),
+                    os.path.join(base_dir, 'includes'))
+    for name in ('sample_cisco_lab.pol', 'sample_multitarget.pol'):
+      shutil.copy(os.path.join(self.pol_dir, 'pol', name),
+                  os.path.join(base_dir, 'pol'))
+    build_times = os.path.join(self.test_subdirectory, 'build_times.json')
+    output_dir = os.path.join(self.test_subdirectory, 'filters')
+
+    def Run():
+      with mock.patch.object(aclgen._Scheduler, 'Add', autospec=True,
+                             side_effect=aclgen._Scheduler.Add) as add:
+        aclgen.Run(base_dir, self.def_dir, None, output_dir, self.exp_info,
+                   2, self.ignore_directories, None, None, self.context,
+                   build_times=build_times)
+      # the estimated cost of parsing each policy.
+      return {c.args[3].name: c.args[1] for c in add.call_args_list[:2]}
+
+    Run()
+    times = buildtimes.BuildTimes(build_times)
+    entry = times.entries[os.path.join(base_dir, 'pol/sample_multitarget.pol')]
+    self.assertIn('msmpc', entry['platforms'])
+    self.assertIn('juniper', entry['platforms'])
+    self.assertGreater(entry['snapshot'], entry['size'])
+    # parsing it, then rendering its slowest platform.
+    self.assertEqual(Run()['sample_multitarget.pol'],
+                     entry['parse'] + max(entry['platforms'].values()))
+
+  def test_profile_of_each_policy(self):
+    base_dir = os.path.join(self.test_subdirectory, 'profiled')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    for name in ('sample_cisco_lab.pol', 'sample_speedway.pol'):
+      shutil.copy(os.path.join(self.pol_dir, 'pol', name),
+                  os.path.join(base_dir, 'pol'))
+    profile = os.path.join(self.test_subdirectory, 'profile.json')
+    trace = os.path.join(self.test_subdirectory, 'trace.json')
+    aclgen.Run(base_dir, self.def_dir, None,
+               os.path.join(self.test_subdirectory, 'filters'), self.exp_info,
+               2, self.ignore_directories, None, None, self.context,
+               profile=profile, profile_trace=trace)
+    self.assertFalse(profiling.Enabled())
+    with open(profile) as f:
+      results = json.load(f)
+    cisco_lab = os.path.join(base_dir, 'pol/sample_cisco_lab.pol')
+    timers = results['files'][cisco_lab]['timers']
+    for name in ('parse', 'snapshot.save', 'snapshot.load',
+                 'Cisco._TranslatePolicy', 'Cisco.Render', 'diff', 'write'):
+      self.assertEqual(timers[name]['count'], 1, name)
+    self.assertGreater(timers['Term.AddObject']['count'], 1)
+    self.assertEqual(results['total']['timers']['definitions']['count'], 1)
+    self.assertEqual(results['total']['timers']['write']['count'], 2)
+    self.assertEqual(results['total']['counters']['files.changed'], 2)
+    with open(trace) as f:
+      events = json.load(f)['traceEvents']
+    # the definitions are loaded by this process, the policies in the pool.
+    self.assertGreater(len(set(event['pid'] for event in events)), 1)
+
+  def test_build_cache_skips_unchanged_policies(self):
+    base_dir = os.path.join(self.test_subdirectory, 'cached')
+    output_dir = os.path.join(self.test_subdirectory, 'filters')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    os.mkdir(output_dir)
+    for name in ('sample_cisco_lab.pol', 'sample_speedway.pol'):
+      shutil.copy(os.path.join(self.pol_dir, 'pol', name),
+                  os.path.join(base_dir, 'pol'))
+    build_cache = os.path.join(self.test_subdirectory, 'build_cache')
+
+    def Run():
+      with mock.patch.object(aclgen, 'RenderFile',
+                             wraps=aclgen.RenderFile) as render:
+        aclgen.Run(base_dir, self.def_dir, None, output_dir, self.exp_info,
+                   1, self.ignore_directories, None, None, self.context,
+                   build_cache)
+      return sorted(c.args[1].name for c in render.call_args_list)
+
+    self.assertEqual(Run(), ['sample_cisco_lab.pol', 'sample_speedway.pol'])
+    self.assertEqual(Run(), [])
+    # sample_cisco_lab.pol refers to GOOGLE_DNS, sample_speedway.pol doesn't.
+    networks = pathlib.Path(self.def_dir, 'NETWORK.net')
+    networks.write_text(networks.read_text().replace(
+        'GOOGLE_DNS = GOOGLE_PUBLIC_DNS_ANYCAST',
+        'GOOGLE_DNS = GOOGLE_PUBLIC_DNS_ANYCAST 192.0.2.1/32'))
+    self.assertEqual(Run(), ['sample_cisco_lab.pol'])
+    os.unlink(os.path.join(output_dir, 'sample_speedway.ipt'))
+    self.assertEqual(Run(), ['sample_speedway.pol'])
+
+  def test_definitions_snapshot_renders_the_same(self):
+    snapshot = os.path.join(self.test_subdirectory, 'definitions.snapshot')
+    policy_file = os.path.join(self.pol_dir, 'pol', 'sample_cisco_lab.pol')
+
+    def Run(output_dir):
+      output_dir = os.path.join(self.test_subdirectory, output_dir)
+      aclgen.Run(self.pol_dir, self.def_dir, policy_file, output_dir,
+                 self.exp_info, 1, self.ignore_directories, None, None,
+                 self.context, definitions_snapshot=snapshot)
+      return pathlib.Path(output_dir, 'sample_cisco_lab.acl').read_text()
+
+    parsed = Run('parsed')
+    self.assertTrue(os.path.exists(snapshot))
+    self.assertEqual(Run('loaded'), parsed)
+
+  def test_rendered_files_are_streamed_through_temporary_files(self):
+    policy_file = os.path.join(self.pol_dir, 'pol', 'sample_multitarget.pol')
+    output_dir = os.path.join(self.test_subdirectory, 'streamed')
+
+    def Run():
+      with mock.patch.object(aclgen, '_WriteFile',
+                             wraps=aclgen._WriteFile) as writer:
+        aclgen.Run(self.pol_dir, self.def_dir, policy_file, output_dir,
+                   self.exp_info, 1, self.ignore_directories, None, None,
+                   self.context)
+      return sorted(c.args[0].name for c in writer.call_args_list)
+
+    written = Run()
+    self.assertIn('sample_multitarget.jcl', written)
+    # the files are staged next to their output and renamed into place.
+    self.assertEqual(sorted(os.listdir(output_dir)), written)
+    jcl = pathlib.Path(output_dir, 'sample_multitarget.jcl')
+    self.assertTrue(jcl.read_text().startswith('firewall {\n'))
+    self.assertEqual(jcl.stat().st_mode & 0o777, 0o666 & ~atomicfile._Umask())
+    # unchanged files are compared with the rendered ones and left alone.
+    self.assertEqual(Run(), [])
+    self.assertEqual(sorted(os.listdir(output_dir)), written)
+
+  def test_failed_generator_discards_the_files_of_the_policy(self):
+    base_dir = os.path.join(self.test_subdirectory, 'failing')
+    output_dir = pathlib.Path(self.test_subdirectory, 'filters')
+    os.makedirs(os.path.join(base_dir, 'pol'))
+    input_file = pathlib.Path(base_dir, 'pol', 'mixed.pol')
+    # juniper renders this policy, then cisco rejects it.
+    input_file.write_text('header {\n  target:: juniper mixed\n'
+                          '  target:: cisco mixed standard\n}\n'
+                          'term web {\n  protocol:: tcp\n'
+                          '  destination-port:: HTTP\n  action:: accept\n}\n')
+    earlier = (output_dir / 'earlier.acl', 'earlier\n')
+    write_files = [earlier]
+    with self.assertRaises(aclgen.ACLGeneratorError):
+      aclgen.RenderFile(base_dir, input_file, output_dir,
+                        naming.Naming(self.def_dir), self.exp_info, False,
+                        False, write_files)
+    # the juniper file is dropped, the files of other policies are kept.
+    self.assertEqual(write_files, [earlier])
+    self.assertEqual(list(output_dir.iterdir()), [])
+
+  def test_failed_write_keeps_the_previous_file(self):
+    output_file = pathlib.Path(self.test_subdirectory, 'filters', 'test.acl')
+    aclgen.WriteFiles([(output_file, 'previous\n')])
+    with mock.patch.object(aclgen.os, 'replace', side_effect=OSError('full')):
+      with self.assertRaises(OSError):
+        aclgen.WriteFiles([(output_file, 'new\n')])
+    self.assertEqual(output_file.read_text(), 'previous\n')
+    self.assertEqual(os.listdir(output_file.parent), ['test.acl'])
+
+  def test_output_manifest_avoids_reading_unchanged_files(self):
+    policy_file = os.path.join(self.pol_dir, 'pol', 'sample_multitarget.pol')
+    output_dir = os.path.join(self.test_subdirectory, 'manifest')
+    output_manifest = os.path.join(self.test_subdirectory, 'manifest.json')
+
+    def Run():
+      with mock.patch.object(manifest, 'FileDigest',
+                             wraps=manifest.FileDigest) as file_digest:
+        with mock.patch.object(aclgen, '_WriteFile',
+                               wraps=aclgen._WriteFile) as writer:
+          aclgen.Run(self.pol_dir, self.def_dir, policy_file, output_dir,
+                     self.exp_info, 1, self.ignore_directories, None, None,
+                     self.context, output_manifest=output_manifest)
+      return (sorted(c.args[0].name for c in writer.call_args_list),
+              sorted(c.args[0].name for c in file_digest.call_args_list))
+
+    written, read = Run()
+    self.assertIn('sample_multitarget.jcl', written)
+    self.assertEqual(read, [])
+    self.assertEqual(Run(), ([], []))
+    jcl = pathlib.Path(output_dir, 'sample_multitarget.jcl')
+    jcl.write_text(jcl.read_text() + 'edited\n')
+    self.assertEqual(Run(), (['sample_multitarget.jcl'],
+                             ['sample_multitarget.jcl']))
+    self.assertEqual(Run(), ([], []))
+
   # Test to ensure existence of the entry point function for installed script.
   @mock.patch.object(aclgen, 'SetupFlags', autospec=True)
   @mock.patch.object(app, 'run', autospec=True)
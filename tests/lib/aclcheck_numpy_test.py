@@ -0,0 +1,150 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unit tests for aclcheck_numpy."""
+
+import ipaddress
+import unittest
+
+from absl.testing import absltest
+from capirca.lib import aclcheck
+from capirca.lib import naming
+from capirca.lib import policy
+
+try:
+  import numpy as np  # pylint: disable=g-import-not-at-top
+  from capirca.lib import aclcheck_numpy  # pylint: disable=g-import-not-at-top
+except ImportError:
+  np = None
+
+POLICYTEXT = """
+header {
+  target:: juniper test-filter
+}
+term term-1 {
+  protocol:: tcp
+  action:: next
+}
+term term-2 {
+  source-address:: NET172
+  destination-address:: NET10
+  protocol:: tcp
+  destination-port:: SSH
+  option:: tcp-established
+  action:: accept
+}
+term term-3 {
+  source-address:: NET172
+  destination-address:: NET10
+  protocol:: tcp
+  destination-port:: SSH
+  action:: accept
+}
+term term-4 {
+  protocol:: udp
+  destination-port:: DNS
+  action:: accept
+}
+term term-5 {
+  protocol-except:: icmp
+  action:: reject
+}
+header {
+  target:: juniper test-filter-2
+}
+term v6-only {
+  destination-address:: NET6
+  action:: deny
+}
+"""
+
+FLOWS = [('172.16.1.1', '10.1.1.1', 1025, 22, 'tcp'),
+         ('172.16.1.1', '10.1.1.1', 1025, 23, 'tcp'),
+         ('192.168.1.1', '10.1.1.1', 1025, 22, 'tcp'),
+         ('192.168.1.1', '10.1.1.1', 1025, 53, 'udp'),
+         ('192.168.1.1', '10.1.1.1', 1025, 54, 'udp'),
+         ('192.168.1.1', '10.1.1.1', 0, 0, 'icmp')]
+PROTOCOLS = {'tcp': 6, 'udp': 17, 'icmp': 1}
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class FlowArrayCheckerTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    defs = naming.Naming(None)
+    defs.ParseServiceList(['SSH = 22/tcp', 'DNS = 53/udp'])
+    defs.ParseNetworkList(['NET172 = 172.16.0.0/12', 'NET10 = 10.0.0.0/8',
+                           'NET6 = 2001:db8::/32'])
+    self.pol = policy.ParsePolicy(POLICYTEXT, defs)
+    self.checker = aclcheck_numpy.FlowArrayChecker(self.pol)
+
+  def _Columns(self, flows):
+    src, dst, sport, dport, proto = zip(*flows)
+    return (np.array([int(ipaddress.ip_address(a)) for a in src], np.uint32),
+            np.array([int(ipaddress.ip_address(a)) for a in dst], np.uint32),
+            np.array(sport, np.uint16), np.array(dport, np.uint16),
+            np.array([PROTOCOLS[p] for p in proto], np.uint8))
+
+  def testMatchesAclCheck(self):
+    results = self.checker.Check(*self._Columns(FLOWS))
+    self.assertEqual([r.filter for r in results],
+                     ['test-filter', 'test-filter-2'])
+    for row, flow in enumerate(FLOWS):
+      exact = {m.filter: (m.term, m.action) for m in
+               aclcheck.AclCheck(self.pol, *map(str, flow)).ExactMatches()}
+      for result in results:
+        index = result.term_index[row]
+        got = None
+        if index != aclcheck_numpy.NO_MATCH:
+          got = (result.terms[index], result.Actions()[row])
+        self.assertEqual(got, exact.get(result.filter))
+    self.assertEqual(list(results[0].term_index), [2, 4, 4, 3, 4, -1])
+    self.assertEqual(list(results[0].Actions()),
+                     ['accept', 'reject', 'reject', 'accept', 'reject', ''])
+    self.assertEqual(list(results[1].term_index), [-1] * len(FLOWS))
+
+  def testMissingColumnsMatchAnything(self):
+    src, dst, _, dport, _ = self._Columns(FLOWS)
+    result = self.checker.Check(src, dst, dport=dport)[0]
+    # the first exact match ignoring protocols is term-3 or term-4.
+    self.assertEqual(list(result.term_index), [2, 4, 4, 3, 4, 4])
+
+  def testIPv6(self):
+    addrs = [int(ipaddress.ip_address(a)) for a in
+             ('2001:db8::1', '2001:db9::1')]
+    dst = np.array([(a >> 64, a & (1 << 64) - 1) for a in addrs], np.uint64)
+    result = self.checker.Check(dst=dst)[1]
+    self.assertEqual(list(result.term_index), [0, -1])
+    self.assertEqual(list(result.Actions()), ['deny', ''])
+
+  def testErrors(self):
+    src, dst, sport, _, _ = self._Columns(FLOWS)
+    self.assertRaises(ValueError, self.checker.Check, src, dst[:2])
+    self.assertRaises(ValueError, self.checker.Check, src,
+                      np.zeros((len(FLOWS), 2), np.uint64))
+    self.assertRaises(ValueError, self.checker.Check, sport.reshape(2, 3))
+    # addresses are checked before being cast to unsigned integers.
+    for bad in (np.array([-1, 1]), np.array([1 << 32]), np.array([1.5]),
+                np.array([(-1, 0)]), np.array([(0, 1 << 64)], object)):
+      with self.assertRaisesRegex(ValueError, 'source_address'):
+        self.checker.Check(bad)
+    self.assertEqual(
+        list(self.checker.Check(src.astype(np.int64))[0].term_index),
+        list(self.checker.Check(src)[0].term_index))
+    self.assertRaises(aclcheck.BadPolicyError,
+                      aclcheck_numpy.FlowArrayChecker, None)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -148,5 +148,38 @@ class AclCheckTest(absltest.TestCase):
                       )
 
 
+  def testFlowChecker(self):
+    checker = aclcheck.FlowChecker(self.pol)
+    flows = [('172.16.1.1', '10.2.2.10', '10000', '22', 'tcp'),
+             ('172.16.1.1', '10.1.1.1', '1025', '22', 'tcp'),
+             ('172.16.1.1', '10.1.1.1', '1025', '53', 'udp'),
+             ('192.168.1.1', '10.1.1.1', 'any', '22', 'tcp'),
+             ('172.16.0.0/16', '10.0.0.0/8', 'any', 'any', 'tcp'),
+             ('172.0.0.0/8', 'any', 'any', '22', 'any'),
+             ('2001:db8::1', '10.1.1.1', '1025', '22', 'icmp'),
+             ('any', 'any', 'any', 'any', 'any')]
+    results = list(checker.CheckFlows(flows))
+    self.assertLen(results, len(flows))
+    for flow, result in zip(flows, results):
+      check = aclcheck.AclCheck(self.pol, *flow)
+      self.assertEqual(str(result), str(check))
+      self.assertEqual([str(m) for m in result.ExactMatches()],
+                       [str(m) for m in check.ExactMatches()])
+      self.assertEqual([str(m) for m in result.ActionMatch('accept')],
+                       [str(m) for m in check.ActionMatch('accept')])
+    self.assertEqual([m.term for m in results[0].Matches()],
+                     ['term-1', 'term-2', 'term-3'])
+    self.assertEqual([m.term for m in results[2].ExactMatches()], ['term-4'])
+
+  def testFlowCheckerExceptions(self):
+    checker = aclcheck.FlowChecker(self.pol)
+    self.assertRaises(port.BadPortValue, checker.Check, 'any', 'any',
+                      'port_99')
+    self.assertRaises(port.BadPortRange, checker.Check, 'any', 'any', 'any',
+                      '99999')
+    self.assertRaises(aclcheck.AddressError, checker.Check, '300.400.500.600')
+    self.assertRaises(aclcheck.BadPolicyError, aclcheck.FlowChecker, None)
+
+
 if __name__ == '__main__':
   absltest.main()
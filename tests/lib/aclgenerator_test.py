@@ -199,6 +199,29 @@ class ACLGeneratorTest(absltest.TestCase):
         ['"%sDate:%s"' % ('$', '$')],
         aclgenerator.AddRepositoryTags(revision=False, rid=False, wrap=True))
 
+  def testWriteLines(self):
+    writer = mock.Mock()
+    lines = ['a' * 3, 'b' * 3, '', 'c']
+    with mock.patch.object(aclgenerator, 'WRITE_CHUNK_SIZE', 4):
+      aclgenerator.WriteLines(writer, iter(lines))
+    self.assertEqual(
+        [c.args[0] for c in writer.write.call_args_list],
+        ['aaa\nbbb', '\n\nc'])
+    writer.reset_mock()
+    aclgenerator.WriteLines(writer, ['{', '}'], joiner='')
+    writer.write.assert_called_once_with('{}')
+    writer.reset_mock()
+    aclgenerator.WriteLines(writer, [])
+    writer.write.assert_not_called()
+
+  def testRenderWritesStr(self):
+    pol = policy.ParsePolicy(GOOD_HEADER_1 + GOOD_TERM_1, self.naming)
+    acl = ACLMock(pol, EXP_INFO)
+    writer = mock.Mock()
+    with mock.patch.object(ACLMock, '__str__', return_value='rendered'):
+      acl.Render(writer)
+    writer.write.assert_called_once_with('rendered')
+
 
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,41 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Smoke tests for the benchmarks of tools/benchmark.py."""
+
+import contextlib
+import io
+
+from absl.testing import absltest
+from tools import benchmark
+
+
+class BenchmarkTest(absltest.TestCase):
+
+  def _Run(self, *args):
+    options = benchmark.cli_options().parse_args(args)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+      options.func(options)
+    return output.getvalue()
+
+  def testRenderers(self):
+    output = self._Run('renderers', '--max_renderers', '1', '2', '--files',
+                       '3', '--terms', '3', '--networks', '50')
+    for renderers in ('1', '2'):
+      for definitions in ('per task', 'per process'):
+        self.assertRegex(output, r'\n%-10s %-12s ' % (renderers, definitions))
+
+
+if __name__ == '__main__':
+  absltest.main()
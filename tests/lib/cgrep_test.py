@@ -21,6 +21,13 @@
 """
 
 import argparse
+import marshal
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import mock
+
 from absl.testing import absltest
 
 from capirca.lib import nacaddr
@@ -529,5 +536,142 @@ class CgrepTest(absltest.TestCase):
     self.assertEqual(results, arg)
 
 
+class CgrepIndexTest(CgrepTest):
+  """Runs the tests of CgrepTest against a TokenIndex of the definitions."""
+
+  def setUp(self):
+    super().setUp()
+    self.naming = self.db
+    self.db = cgrep.TokenIndex(self.naming)
+
+  def test_same_answers(self):
+    for ip in ('10.1.1.1', '8.8.8.8', '127.0.0.1', 'fe80::1', '2001:db8::/48'):
+      self.assertEqual(self.db.GetIpParents(ip),
+                       self.naming.GetIpParents(ip))
+      self.assertEqual(cgrep.get_ip_parents(ip, self.db),
+                       cgrep.get_ip_parents(ip, self.naming))
+    for token in self.naming.networks:
+      self.assertEqual(self.db.GetNetParents(token),
+                       self.naming.GetNetParents(token))
+      self.assertEqual(
+          [(str(x), x.token, x.text, x.parent_token)
+           for x in self.db.GetNet(token)],
+          [(str(x), x.token, x.text, x.parent_token)
+           for x in self.naming.GetNet(token)])
+    for token in self.naming.services:
+      self.assertEqual(self.db.GetService(token),
+                       self.naming.GetService(token))
+    for port, proto in (('22', 'tcp'), ('53', 'udp'), ('2000', 'udp')):
+      self.assertEqual(self.db.GetPortParents(port, proto),
+                       self.naming.GetPortParents(port, proto))
+
+  def test_large_token(self):
+    # tokens expanding to many networks are looked up by prefix length.
+    self.naming.ParseNetworkList(
+        ['WIDE = %s' % ' '.join('10.%d.0.0/16' % i for i in range(100)),
+         'WIDE_GROUP = WIDE RFC1918 10.5.0.0/24'])
+    self.db = cgrep.TokenIndex(self.naming)
+    for ip in ('10.5.0.1', '10.99.1.1', '10.200.0.1', '172.16.0.1'):
+      self.assertEqual(cgrep.get_ip_parents(ip, self.db),
+                       cgrep.get_ip_parents(ip, self.naming))
+    self.assertEqual(self.db.GetNetsContaining('10.5.0.1', 'WIDE_GROUP'),
+                     (24, ['10.5.0.0/16', '10.0.0.0/8', '10.5.0.0/24']))
+
+  def test_undefined(self):
+    self.assertRaises(naming.UndefinedAddressError, self.db.GetNet, 'NOPE')
+    self.assertRaises(naming.UndefinedServiceError, self.db.GetService, 'NOPE')
+    self.assertRaises(naming.UndefinedPortError, self.db.GetPortParents,
+                      '7', 'tcp')
+
+  def test_reference_cycle(self):
+    self.naming.ParseNetworkList(['LOOP_A = LOOP_B', 'LOOP_B = LOOP_A'])
+    index = cgrep.TokenIndex(self.naming)
+    self.assertRaises(naming.ReferenceCycleError, index.GetNet, 'LOOP_A')
+    self.assertRaises(naming.ReferenceCycleError, index.GetNetParents,
+                      'LOOP_A')
+
+
+class CgrepIndexFileTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmpdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmpdir)
+    self.defs = os.path.join(self.tmpdir, 'def')
+    os.mkdir(self.defs)
+    self._Write('NETWORK.net', _NETWORK)
+    self._Write('SERVICES.svc', _SERVICE)
+    self.index_file = os.path.join(self.tmpdir, 'cgrep.index')
+
+  def _Write(self, name, text):
+    with open(os.path.join(self.defs, name), 'w') as f:
+      f.write(text)
+
+  def test_load_index(self):
+    index = cgrep.load_index(self.defs, self.index_file)
+    self.assertTrue(os.path.exists(self.index_file))
+    self.assertEqual(index.GetIpParents('8.8.8.8'),
+                     ['ANY', 'GOOGLE_DNS', 'GOOGLE_PUBLIC_DNS_ANYCAST'])
+    loaded = cgrep.load_index(self.defs, self.index_file)
+    self.assertEqual(loaded.fingerprint, index.fingerprint)
+    self.assertEqual(loaded.GetIpParents('8.8.8.8'),
+                     index.GetIpParents('8.8.8.8'))
+
+  def test_load_index_rebuilds_changed_definitions(self):
+    index = cgrep.load_index(self.defs, self.index_file)
+    self.assertNotIn('OTHER', index.GetIpParents('192.0.2.1'))
+    self._Write('OTHER.net', 'OTHER = 192.0.2.0/24\n')
+    index = cgrep.load_index(self.defs, self.index_file)
+    self.assertIn('OTHER', index.GetIpParents('192.0.2.1'))
+
+  def test_load_index_ignores_corrupt_file(self):
+    with open(self.index_file, 'wb') as f:
+      f.write(b'not an index')
+    index = cgrep.load_index(self.defs, self.index_file)
+    self.assertEqual(index.GetService('SSH'), ['22/tcp'])
+
+  def test_load_index_keeps_errors(self):
+    self._Write('LOOP.net', 'LOOP_A = LOOP_B\nLOOP_B = LOOP_A\n')
+    cgrep.load_index(self.defs, self.index_file)
+    loaded = cgrep.load_index(self.defs, self.index_file)
+    self.assertRaises(naming.ReferenceCycleError, loaded.GetNet, 'LOOP_A')
+    self.assertRaises(naming.ReferenceCycleError, loaded.GetNetParents,
+                      'LOOP_A')
+
+  def test_load_index_ignores_pickle(self):
+    index = cgrep.load_index(self.defs, self.index_file)
+    with open(self.index_file, 'wb') as f:
+      pickle.dump(index, f)
+    with mock.patch.object(pickle, 'loads') as loads:
+      loaded = cgrep.load_index(self.defs, self.index_file)
+    loads.assert_not_called()
+    self.assertEqual(loaded.GetService('SSH'), ['22/tcp'])
+    with open(self.index_file, 'rb') as f:
+      self.assertEqual(marshal.load(f)[0][0], 'capirca-cgrep-index')
+
+  def test_load_index_rejects_unknown_errors(self):
+    cgrep.load_index(self.defs, self.index_file)
+    fingerprint = cgrep.definitions_fingerprint(self.defs)
+    with open(self.index_file, 'rb') as f:
+      header, tables = marshal.load(f)
+    tables = list(tables)
+    tables[cgrep.TokenIndex._TABLES.index('_services')] = (
+        {}, {'SSH': ('SystemExit', 'boom')})
+    with open(self.index_file, 'wb') as f:
+      marshal.dump((header, tuple(tables)), f)
+    self.assertIsNone(cgrep.TokenIndex.Load(self.index_file, fingerprint))
+    index = cgrep.load_index(self.defs, self.index_file)
+    self.assertEqual(index.GetService('SSH'), ['22/tcp'])
+
+  def test_read_ips(self):
+    ip_file = os.path.join(self.tmpdir, 'ips.txt')
+    with open(ip_file, 'w') as f:
+      f.write('# servers\n8.8.8.8\n\n2001:db8::1  # v6\n')
+    self.assertEqual(cgrep.read_ips(ip_file), ['8.8.8.8', '2001:db8::1'])
+    with open(ip_file, 'a') as f:
+      f.write('10.0.0.256\n')
+    self.assertRaises(argparse.ArgumentTypeError, cgrep.read_ips, ip_file)
+
+
 if __name__ == '__main__':
   absltest.main()
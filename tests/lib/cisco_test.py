@@ -657,6 +657,34 @@ class CiscoTest(absltest.TestCase):
                                              mock.call('SOME_HOST')])
     self.naming.GetServiceByProto.assert_called_once_with('HTTP', 'tcp')
 
+  def testRenderWritesObjectGroupsFirst(self):
+    self.naming.GetNetAddr.return_value = [
+        nacaddr.IP('10.0.0.0/8', token='SOME_HOST')]
+    self.naming.GetServiceByProto.return_value = ['80']
+
+    pol = policy.ParsePolicy(
+        GOOD_OBJGRP_HEADER + GOOD_TERM_2 + GOOD_HEADER + GOOD_TERM_1 +
+        GOOD_OBJGRP_HEADER.replace('objgroupheader', 'objgroupheader2') +
+        GOOD_TERM_18, self.naming)
+    acl = cisco.Cisco(pol, EXP_INFO)
+    writer = mock.Mock()
+    with mock.patch.object(aclgenerator, 'WRITE_CHUNK_SIZE', 1):
+      acl.Render(writer)
+    self.assertGreater(writer.write.call_count, 1)
+    output = ''.join(c.args[0] for c in writer.write.call_args_list)
+    self.assertEqual(output, str(acl))
+    # the object groups of the last policy come first, then those of the
+    # first, and then the access lists in policy order.
+    self.assertLess(output.index('object-group network ipv4 SOME_HOST'),
+                    output.index('object-group port 80-80'))
+    self.assertLess(output.index('object-group port 1024-65535'),
+                    output.index('! $Id:$'))
+    self.assertLess(output.index('ip access-list extended objgroupheader\n'),
+                    output.index('ip access-list extended test-filter'))
+    self.assertLess(output.index('ip access-list extended test-filter'),
+                    output.index('ip access-list extended objgroupheader2'))
+    self.assertTrue(output.endswith('\nexit\n'), output)
+
   def testInet6(self):
     self.naming.GetNetAddr.return_value = [nacaddr.IP('10.0.0.0/8'),
                                            nacaddr.IP('2001:4860:8000::/33')]
@@ -678,6 +678,22 @@ class GCETest(parameterized.TestCase):
         mock.call('DNS', 'udp'),
         mock.call('DNS', 'tcp')])
 
+  def testRenderWritesChunks(self):
+    self.naming.GetNetAddr.return_value = TEST_IPS
+    self.naming.GetServiceByProto.side_effect = [['53'], ['53']]
+
+    acl = gce.GCE(policy.ParsePolicy(
+        GOOD_HEADER + GOOD_TERM, self.naming), EXP_INFO)
+    writer = mock.Mock()
+    with mock.patch.object(aclgenerator, 'WRITE_CHUNK_SIZE', 1):
+      acl.Render(writer)
+    self.assertGreater(writer.write.call_count, 1)
+    output = ''.join(c.args[0] for c in writer.write.call_args_list)
+    self.assertEqual(output, str(acl))
+    self.assertEqual(output, json.dumps(acl.gce_policies, indent=2,
+                                        separators=(',', ': '),
+                                        sort_keys=True) + '\n\n')
+
   def testTermWithPriority(self):
     self.naming.GetNetAddr.return_value = TEST_IPS
     self.naming.GetServiceByProto.side_effect = [['53'], ['53']]
@@ -185,6 +185,19 @@ class IpsetTest(absltest.TestCase):
 
     self.naming.GetNetAddr.assert_called_once_with('INTERNAL')
 
+  def testRenderWritesSetsBeforeRules(self):
+    self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8')]
+
+    acl = ipset.Ipset(policy.ParsePolicy(GOOD_HEADER_1 + GOOD_TERM_1,
+                                         self.naming), EXP_INFO)
+    writer = mock.Mock()
+    acl.Render(writer)
+    output = ''.join(c.args[0] for c in writer.write.call_args_list)
+    self.assertEqual(output, str(acl))
+    self.assertTrue(output.startswith('# begin:ipset-rules\n'), output)
+    self.assertLess(output.index('# end:ipset-rules'),
+                    output.index('-P OUTPUT DROP'))
+
   def testGenerateSetName(self):
     # iptables superclass currently limits term name length to 26 characters,
     # but that could change
@@ -607,6 +607,17 @@ class AclCheckTest(absltest.TestCase):
                   '--state NEW,ESTABLISHED,RELATED -j ACCEPT', result,
                   'did not find append for good-term-1.')
 
+  def testRenderWritesChunks(self):
+    acl = iptables.Iptables(policy.ParsePolicy(GOOD_HEADER_2 + GOOD_TERM_1,
+                                               self.naming), EXP_INFO)
+    writer = mock.Mock()
+    with mock.patch.object(aclgenerator, 'WRITE_CHUNK_SIZE', 1):
+      acl.Render(writer)
+    self.assertGreater(writer.write.call_count, 1)
+    output = ''.join(c.args[0] for c in writer.write.call_args_list)
+    self.assertEqual(output, str(acl))
+    self.assertTrue(output.endswith('ACCEPT\n'), output)
+
   def testCustomChain(self):
     acl = iptables.Iptables(policy.ParsePolicy(NON_STANDARD_CHAIN + GOOD_TERM_1,
                                                self.naming), EXP_INFO)
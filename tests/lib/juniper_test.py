@@ -729,6 +729,20 @@ class JuniperTest(parameterized.TestCase):
     self.naming.GetNetAddr.assert_called_once_with('SOME_HOST')
     self.naming.GetServiceByProto.assert_called_once_with('HTTP', 'tcp')
 
+  def testRenderWritesChunks(self):
+    self.naming.GetNetAddr.return_value = [nacaddr.IP('10.0.0.0/8')]
+    self.naming.GetServiceByProto.return_value = ['80']
+
+    jcl = juniper.Juniper(policy.ParsePolicy(GOOD_HEADER + GOOD_TERM_2,
+                                             self.naming), EXP_INFO)
+    writer = mock.Mock()
+    with mock.patch.object(aclgenerator, 'WRITE_CHUNK_SIZE', 1):
+      jcl.Render(writer)
+    self.assertGreater(writer.write.call_count, 1)
+    self.assertEqual(''.join(c.args[0] for c in writer.write.call_args_list),
+                     str(jcl))
+    self.assertTrue(str(jcl).endswith('    }\n}\n'), str(jcl))
+
   def testTermAndFilterName(self):
     self.naming.GetNetAddr.return_value = [nacaddr.IP('10.0.0.0/8')]
     self.naming.GetServiceByProto.return_value = ['25']
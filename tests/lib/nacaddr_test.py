@@ -14,6 +14,10 @@
 
 """Unittest for nacaddr.py module."""
 
+import copy
+import pickle
+import random
+
 from absl.testing import absltest
 
 from capirca.lib import nacaddr
@@ -75,6 +79,27 @@ class NacaddrUnitTest(absltest.TestCase):
   def testNacaddrV6Comment(self):
     self.assertEqual(self.addr2.text, 'An IPv6 Address')
 
+  def testCopy(self):
+    for addr in (self.addr1, self.addr2):
+      addr.token = 'TOKEN'
+      dup = copy.copy(addr)
+      self.assertEqual(dup, addr)
+      self.assertEqual(dup.text, addr.text)
+      self.assertEqual(dup.token, 'TOKEN')
+      dup.AddComment('more')
+      self.assertNotIn('more', addr.text)
+
+  def testPickle(self):
+    for addr in (self.addr1, self.addr2):
+      addr.token = 'TOKEN'
+      addr.parent_token = 'PARENT'
+      dup = pickle.loads(pickle.dumps(addr, pickle.HIGHEST_PROTOCOL))
+      self.assertIs(type(dup), type(addr))
+      self.assertEqual(dup, addr)
+      self.assertEqual(
+          (dup.text, dup.token, dup.parent_token),
+          (addr.text, 'TOKEN', 'PARENT'))
+
   def testSupernetting(self):
     self.assertEqual(self.addr1.Supernet().text, 'The 10 block')
     self.assertEqual(self.addr2.Supernet().text, 'An IPv6 Address')
@@ -247,6 +272,46 @@ class NacaddrUnitTest(absltest.TestCase):
     self.assertFalse(nacaddr.IsSuperNet(addrs2, addrs5))
     self.assertTrue(nacaddr.IsSuperNet(addrs5, addrs2))
 
+  def testAddressSet(self):
+    addrs = nacaddr.AddressSet([nacaddr.IPv4('10.0.0.0/25'),
+                                nacaddr.IPv4('10.0.0.128/25'),
+                                nacaddr.IPv4('10.0.0.128/26'),
+                                nacaddr.IPv4('172.16.0.0/12'),
+                                nacaddr.IPv6('2001:db8::/32')])
+    self.assertLen(addrs, 4)
+    self.assertIn(nacaddr.IPv4('10.0.0.1/32'), addrs)
+    self.assertIn(nacaddr.IPv4('172.16.0.0/12'), addrs)
+    self.assertIn(nacaddr.IPv6('2001:db8:1::/48'), addrs)
+    # adjacent networks are not merged.
+    self.assertNotIn(nacaddr.IPv4('10.0.0.0/24'), addrs)
+    self.assertNotIn(nacaddr.IPv4('172.0.0.0/8'), addrs)
+    self.assertNotIn(nacaddr.IPv6('::ffff:172.16.0.0/108'), addrs)
+    self.assertTrue(addrs.Overlaps(nacaddr.IPv4('10.0.0.0/24')))
+    self.assertTrue(addrs.Overlaps(nacaddr.IPv4('172.0.0.0/8')))
+    self.assertFalse(addrs.Overlaps(nacaddr.IPv4('10.0.1.0/24')))
+    self.assertFalse(addrs.Overlaps(nacaddr.IPv6('2001:db9::/32')))
+    self.assertTrue(addrs.IsSuperSetOf([nacaddr.IPv4('10.0.0.0/26'),
+                                        nacaddr.IPv4('172.31.0.0/16')]))
+    self.assertFalse(addrs.IsSuperSetOf([nacaddr.IPv4('10.0.0.0/26'),
+                                         nacaddr.IPv4('192.168.0.0/16')]))
+
+  def testAddressSetMatchesSubnetOf(self):
+    rand = random.Random(42)
+
+    def RandomNetwork():
+      prefixlen = rand.randint(20, 32)
+      return nacaddr.IPv4((10 << 24 | rand.getrandbits(16) << 8, prefixlen),
+                          strict=False)
+
+    supernets = [RandomNetwork() for _ in range(200)]
+    addrs = nacaddr.AddressSet(supernets)
+    for _ in range(1000):
+      network = RandomNetwork()
+      self.assertEqual(network in addrs,
+                       any(network.subnet_of(s) for s in supernets))
+      self.assertEqual(addrs.Overlaps(network),
+                       any(network.overlaps(s) for s in supernets))
+
   def testSafeCollapsing(self):
     test_data = [([nacaddr.IPv4('10.0.0.0/8'),
                    nacaddr.IPv4('10.0.0.0/10')],
@@ -275,5 +340,45 @@ class NacaddrUnitTest(absltest.TestCase):
                                                 complement_addresses), result)
 
 
+  def testCollapsingKeepsCommentsAndTokens(self):
+    first = nacaddr.IPv4('10.0.0.0/25', comment='first', token='FIRST')
+    second = nacaddr.IPv4('10.0.0.128/25', comment='second', token='SECOND')
+    third = nacaddr.IPv4('10.0.1.0/24', comment='third', token='THIRD')
+    inner = nacaddr.IPv4('10.0.2.1/32', comment='inner', token='INNER')
+    outer = nacaddr.IPv4('10.0.2.0/24', comment='outer', token='OUTER')
+    result = nacaddr.CollapseAddrList([third, second, inner, outer, first])
+    self.assertEqual(result, [nacaddr.IPv4('10.0.0.0/23'), outer])
+    self.assertEqual(result[0].text, 'first, second, third')
+    self.assertEqual(result[0].token, 'FIRST')
+    self.assertEqual(result[0].parent_token, 'FIRST')
+    # networks of the result that were not merged are the objects passed in.
+    self.assertIs(result[1], outer)
+    self.assertEqual(outer.text, 'outer, inner')
+    self.assertEqual(first.text, 'first, second')
+
+  def testCollapsingMixedVersionComplements(self):
+    addresses = [nacaddr.IPv4('10.0.0.0/8'), nacaddr.IPv4('10.0.0.0/10'),
+                 nacaddr.IPv6('::/1'), nacaddr.IPv6('8000::/1')]
+    complement_addresses = [nacaddr.IPv4('10.0.0.0/9'), nacaddr.IPv6('::/2')]
+    self.assertEqual(
+        nacaddr.CollapseAddrList(addresses, complement_addresses),
+        [nacaddr.IPv4('10.0.0.0/8'), nacaddr.IPv4('10.0.0.0/10'),
+         nacaddr.IPv6('::/0')])
+
+  def testAddressListExcludeComments(self):
+    kept = nacaddr.IPv4('10.1.0.0/16', comment='kept')
+    split = nacaddr.IPv4('10.2.0.0/16', comment='split')
+    v6 = nacaddr.IPv6('2001:db8::/32', comment='v6')
+    result = nacaddr.AddressListExclude(
+        [v6, split, kept],
+        [nacaddr.IPv4('10.2.0.0/17'), nacaddr.IPv6('2001:db8::/33')])
+    self.assertEqual(result, [nacaddr.IPv4('10.1.0.0/16'),
+                              nacaddr.IPv4('10.2.128.0/17'),
+                              nacaddr.IPv6('2001:db8:8000::/33')])
+    self.assertIs(result[0], kept)
+    # what is left of a split network is new and has no comment.
+    self.assertEqual([addr.text for addr in result], ['kept', '', ''])
+
+
 if __name__ == '__main__':
   absltest.main()
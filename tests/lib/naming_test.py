@@ -14,6 +14,14 @@
 
 """Unittest for naming.py module."""
 
+import concurrent.futures
+import ipaddress
+import os
+import random
+import shutil
+import tempfile
+from unittest import mock
+
 from absl.testing import absltest
 
 from capirca.lib import nacaddr
@@ -145,6 +153,170 @@ class NamingUnitTest(absltest.TestCase):
     self.assertListEqual(self.defs.GetIpParents('10.11.12.13/32'),
                          ['BING', 'NET1', 'NET2'])
 
+  def testGetIpParentsOfToken(self):
+    self.assertListEqual(self.defs.GetIpParents('NET1'), ['BING', 'NET2'])
+    self.assertListEqual(self.defs.GetIpParents('BAR_V6'), ['BAZ'])
+
+  def testGetNetPrefixes(self):
+    prefixes = self.defs.GetNetPrefixes()
+    self.assertEqual(prefixes[(4, 8)],
+                     {int(ipaddress.ip_address('10.0.0.0')): ['NET1']})
+    self.assertEqual(prefixes[(4, 32)],
+                     {int(ipaddress.ip_address('1.2.3.4')): ['9OCLOCK']})
+    # the tables are copies the caller owns.
+    prefixes[(4, 8)].clear()
+    self.assertLen(self.defs.GetNetPrefixes()[(4, 8)], 1)
+
+  def testGetNetItemParents(self):
+    parents = self.defs.GetNetItemParents()
+    self.assertEqual(parents['NET1'], ['NET2', 'BING'])
+    self.assertEqual(parents['10.2.0.0/16'], ['NET2'])
+    self.assertEqual(parents['FOO_V6'], ['BAZ', 'BING'])
+    self.assertNotIn('BING', parents)
+
+  def testGetIpParentsBatch(self):
+    self.defs.ParseNetworkList(['NET3 = 10.2.3.0/24', 'NET4 = 10.2.3.0/24',
+                                'NET_V6 = 2001:db8::/32', 'BAZ_V6 = NET_V6'])
+    results = self.defs.GetIpParentsBatch(
+        ['10.2.3.4', '10.11.12.13', '192.0.2.1', '10.2.0.0/16', '2001:db8::1',
+         nacaddr.IP('10.2.3.0/25'), ipaddress.ip_address('1.2.3.4'),
+         int(ipaddress.ip_address('10.2.3.5'))])
+    self.assertEqual(results, [
+        ('NET3', ('BING', 'NET1', 'NET2', 'NET3', 'NET4')),
+        ('NET1', ('BING', 'NET1', 'NET2')),
+        (None, ()),
+        ('NET2', ('BING', 'NET1', 'NET2')),
+        ('NET_V6', ('BAZ_V6', 'NET_V6')),
+        ('NET3', ('BING', 'NET1', 'NET2', 'NET3', 'NET4')),
+        # 9OCLOCK is not reported, as in GetIpParents.
+        (None, ()),
+        ('NET3', ('BING', 'NET1', 'NET2', 'NET3', 'NET4')),
+    ])
+    self.assertEqual(
+        self.defs.GetIpParentsBatch(
+            [int(ipaddress.ip_address('2001:db8::5'))], version=6),
+        [('NET_V6', ('BAZ_V6', 'NET_V6'))])
+    self.assertRaises(ValueError, self.defs.GetIpParentsBatch, ['10.0.0.256'])
+
+  def testGetIpParentsBatchMatchesGetIpParents(self):
+    rand = random.Random(0)
+    networks = []
+    for i in range(200):
+      prefixlen = rand.randrange(8, 33)
+      net = ipaddress.ip_network(
+          (rand.randrange(10 << 24, 11 << 24), prefixlen), strict=False)
+      networks.append('RAND%d = %s' % (i, net))
+      if i % 10 == 9:
+        networks.append('GROUP%d = RAND%d RAND%d' % (i, i, i - 5))
+    self.defs.ParseNetworkList(networks)
+    ips = [str(ipaddress.ip_address(rand.randrange(10 << 24, 11 << 24)))
+           for _ in range(500)]
+    for ip, (_, parents) in zip(ips, self.defs.GetIpParentsBatch(ips)):
+      self.assertEqual(list(parents), self.defs.GetIpParents(ip))
+
+  def testGetIpParentsBatchKeepsIpVersionsApart(self):
+    # the IPv4 and IPv6 networks start at the same integer, with the same
+    # prefix length.
+    self.defs.ParseNetworkList(['ZERO_V4 = 0.0.0.0/8', 'ZERO_V6 = 0000::/8',
+                                'BOGON_V4 = ZERO_V4', 'BOGON_V6 = ZERO_V6',
+                                'RESERVED = ZERO_V4 ZERO_V6'])
+    queries = ['0::1', '0.0.0.1', '0.0.0.0/8', '0::/8', '0.0.0.0/16', '0::2']
+    results = []
+    # one query at a time, in both orders, then all at once.
+    for ip in queries + queries[::-1]:
+      results.extend(zip([ip], self.defs.GetIpParentsBatch([ip])))
+    results.extend(zip(queries, self.defs.GetIpParentsBatch(queries)))
+    for ip, (token, parents) in results:
+      self.assertEqual(list(parents), self.defs.GetIpParents(ip), ip)
+      self.assertEqual(token, 'ZERO_V6' if ':' in ip else 'ZERO_V4', ip)
+
+  def testParseIpMatchesIpaddress(self):
+    for address in ('10.1.2.3/8', '1.2.3.4', '0.0.0.0/0', '10.0.0.0/08',
+                    '10.0.0.0/255.0.0.0', '::1', '2001:db8::1/32',
+                    '::ffff:1.2.3.4/120', '10.0.0.0/33', '10.0.0.0/',
+                    '01.2.3.4/8', '1.2.3/24', '2001:db8::/129',
+                    '10.0.0.0/\u0668', '10.0.0.0/8\n'):
+      try:
+        net = ipaddress.ip_network(address, strict=False)
+      except ValueError:
+        self.assertRaises(ValueError, naming._ParseIp, address)
+        continue
+      self.assertEqual(naming._ParseIp(address),
+                       (net.version, int(net.network_address), net.prefixlen))
+
+  def testItemsUnchangedByLookups(self):
+    items = {token: unit.items for token, unit in self.defs.networks.items()}
+    for token in self.defs.networks:
+      self.defs.GetNet(token)
+      self.defs.GetNetChildren(token)
+    self.defs.GetIpParents('10.1.1.1')
+    self.assertEqual(
+        {token: unit.items for token, unit in self.defs.networks.items()},
+        items)
+    self.assertEqual(self.defs.networks['NET1'].items,
+                     ['10.1.0.0/8 #  network1'])
+
+  def testContinuationOfParsedToken(self):
+    self.defs.ParseNetworkList(['NET3 = 10.3.0.0/16 # first'])
+    self.assertLen(self.defs.GetNet('NET3'), 1)
+    self.defs.ParseNetworkList(['       10.4.0.0/16 # second'])
+    self.assertEqual([(str(addr), addr.text)
+                      for addr in self.defs.GetNet('NET3')],
+                     [('10.3.0.0/16', 'first'), ('10.4.0.0/16', 'second')])
+    self.assertEqual(self.defs.networks['NET3'].items,
+                     ['10.3.0.0/16 #  first', '10.4.0.0/16 #  second'])
+
+  def testParentQueriesSeeNewDefinitions(self):
+    self.assertListEqual(self.defs.GetIpParents('10.11.12.13/32'),
+                         ['BING', 'NET1', 'NET2'])
+    self.assertListEqual(self.defs.GetServiceParents('90/tcp'),
+                         ['TCP_90', 'SVC5', 'SVC6'])
+    self.defs.ParseNetworkList(['NET3 = NET2', 'NET4 = 10.11.0.0/16'])
+    self.defs.ParseServiceList(['SVC7 = SVC6'])
+    self.assertListEqual(self.defs.GetIpParents('10.11.12.13/32'),
+                         ['BING', 'NET1', 'NET2', 'NET3', 'NET4'])
+    self.assertListEqual(self.defs.GetServiceParents('90/tcp'),
+                         ['TCP_90', 'SVC5', 'SVC6', 'SVC7'])
+
+  def testGetNetReturnsCopies(self):
+    first = self.defs.GetNet('NET2')
+    first[0].AddComment('changed')
+    first[0].parent_token = 'OTHER'
+    second = self.defs.GetNet('NET2')
+    self.assertEqual(second[0].text, 'network2.0')
+    self.assertEqual(second[0].parent_token, 'NET2')
+    self.assertEqual(second[1].token, 'NET1')
+    self.assertEqual(second[1].parent_token, 'NET2')
+    self.assertEqual(self.defs.GetNet('NET1')[0].parent_token, 'NET1')
+
+  def testGetNetSeesNewDefinitions(self):
+    self.assertEqual(self.defs.GetNet('NET2'),
+                     [nacaddr.IP('10.2.0.0/16'), nacaddr.IP('10.0.0.0/8')])
+    self.defs.ParseNetworkList(['       192.168.0.0/16'])
+    self.assertEqual(self.defs.GetNet('NET2'),
+                     [nacaddr.IP('10.2.0.0/16'), nacaddr.IP('10.0.0.0/8')])
+    self.assertEqual(self.defs.GetNet('BING')[-1], nacaddr.IP('192.168.0.0/16'))
+
+  def testGetNetReferenceCycle(self):
+    self.defs.ParseNetworkList(['LOOP1 = 10.0.0.0/8 LOOP2',
+                                'LOOP2 = LOOP1'])
+    self.assertRaises(naming.ReferenceCycleError, self.defs.GetNet, 'LOOP1')
+    self.assertRaises(naming.ReferenceCycleError, self.defs.GetNet, 'LOOP2')
+
+  def testReferenceTracking(self):
+    self.defs.GetNet('NET1')
+    self.defs.StartReferenceTracking()
+    self.defs.GetNetAddr('NET2')
+    self.defs.GetServiceByProto('SVC5', 'tcp')
+    self.assertRaises(naming.UndefinedServiceError, self.defs.GetService,
+                      'FOO')
+    self.assertEqual(self.defs.StopReferenceTracking(),
+                     {'networks': ['NET2'],
+                      'services': ['FOO', 'SVC5', 'TCP_90']})
+    self.defs.GetNet('BING')
+    self.assertEqual(self.defs.StopReferenceTracking(),
+                     {'networks': [], 'services': []})
+
   def testUndefinedTokenNesting(self):
     bad_servicedata = ['FOO = 7/tcp BAR']
     bad_networkdata = ['NETGROUP = 10.0.0.0/8 FOOBAR']
@@ -191,5 +363,142 @@ class NamingUnitTest(absltest.TestCase):
     self.assertEqual([], self.defs.GetNetChildren('NET1'))
 
 
+class NamingSnapshotTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.def_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.def_dir)
+    self.snapshot = os.path.join(self.def_dir, 'definitions.snapshot')
+    self._Write('NETWORK.net', 'NET1 = 10.0.0.0/8 # network1\n'
+                'NET2 = NET1\n'
+                '       192.168.0.0/24\n'
+                'NET_V6 = 2001:db8::/32\n')
+    self._Write('SERVICES.svc', 'HTTP = 80/tcp # web\n'
+                'WEB = HTTP\n'
+                '      443/tcp\n')
+
+  def _Write(self, name, text):
+    with open(os.path.join(self.def_dir, name), 'w') as f:
+      f.write(text)
+
+  def _AssertSameDefinitions(self, first, second):
+    for group in ('networks', 'services'):
+      self.assertEqual(
+          {token: unit.items for token, unit in getattr(first, group).items()},
+          {token: unit.items for token, unit in getattr(second,
+                                                        group).items()})
+    self.assertEqual(first.GetNet('NET2'), second.GetNet('NET2'))
+    self.assertEqual(first.GetService('WEB'), second.GetService('WEB'))
+    for ip in ('10.1.2.3', '192.168.0.1', '2001:db8::1'):
+      self.assertEqual(first.GetIpParents(ip), second.GetIpParents(ip))
+
+  def testRoundTrip(self):
+    parsed = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self.assertTrue(os.path.exists(self.snapshot))
+    loaded = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self.assertIsNotNone(loaded._snapshot_prefixes)
+    self._AssertSameDefinitions(loaded, naming.Naming(self.def_dir))
+    self._AssertSameDefinitions(loaded, parsed)
+    self.assertEqual(loaded.GetNetAddr('NET1')[0].text, 'network1')
+    self.assertEqual(loaded.GetIpParents('10.1.2.3'), ['NET1', 'NET2'])
+
+  def testStaleSnapshot(self):
+    naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self._Write('NETWORK.net', 'NET1 = 172.16.0.0/12\n'
+                'NET2 = NET1\n'
+                'NET_V6 = 2001:db8::/32\n')
+    defs = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self.assertIsNone(defs._snapshot_prefixes)
+    self.assertEqual(defs.GetIpParents('172.16.0.1'), ['NET1', 'NET2'])
+    self.assertEqual(defs.GetIpParents('10.1.2.3'), [])
+    # the snapshot was saved again for the new definitions.
+    loaded = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self.assertIsNotNone(loaded._snapshot_prefixes)
+    self._AssertSameDefinitions(loaded, defs)
+
+  def testCorruptSnapshot(self):
+    with open(self.snapshot, 'wb') as f:
+      f.write(b'\x00not a snapshot')
+    defs = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self._AssertSameDefinitions(defs, naming.Naming(self.def_dir))
+    loaded = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    self.assertIsNotNone(loaded._snapshot_prefixes)
+
+  def testNewDefinitionsAfterLoad(self):
+    naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    loaded = naming.Naming(self.def_dir, snapshot_file=self.snapshot)
+    loaded.ParseNetworkList(['NET3 = 10.1.0.0/16'])
+    self.assertEqual(loaded.GetIpParents('10.1.2.3'), ['NET1', 'NET2', 'NET3'])
+
+
+class _OldExecutor(concurrent.futures.ThreadPoolExecutor):
+  """An executor whose shutdown has the arguments of Python 3.8."""
+
+  def shutdown(self, wait=True):  # pylint: disable=arguments-differ
+    super().shutdown(wait)
+
+
+class NamingParallelParseTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.def_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.def_dir)
+    self._Write('SERVICES.svc', 'HTTP = 80/tcp # web\n'
+                'WEB = HTTP\n'
+                '      443/tcp\n')
+    for number in range(4):
+      self._Write('NETWORK%d.net' % number,
+                  'NET%d = 10.%d.0.0/16 # network %d\n'
+                  '       NET%d\n' % (number, number, number, number + 1))
+    self._Write('NETWORK4.net', 'NET4 = 192.168.0.0/24\n')
+    # parse every file in a worker.
+    patcher = mock.patch.object(naming, 'PARALLEL_PARSE_BYTES', 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def _Write(self, name, text):
+    with open(os.path.join(self.def_dir, name), 'w') as f:
+      f.write(text)
+
+  def testSameDefinitions(self):
+    serial = naming.Naming(self.def_dir)
+    parallel = naming.Naming(self.def_dir, max_parsers=3)
+    for group in ('networks', 'services'):
+      self.assertEqual(
+          [(token, unit.items) for token, unit in getattr(serial,
+                                                          group).items()],
+          [(token, unit.items) for token, unit in getattr(parallel,
+                                                          group).items()])
+    self.assertEqual(parallel.GetIpParents('192.168.0.1'),
+                     ['NET0', 'NET1', 'NET2', 'NET3', 'NET4'])
+    self.assertEqual(parallel.GetService('WEB'), ['443/tcp', '80/tcp'])
+
+  def testCollisionBetweenFiles(self):
+    self._Write('NETWORK5.net', 'NET1 = 10.1.0.0/16\n')
+    self.assertRaises(naming.NamespaceCollisionError, naming.Naming,
+                      self.def_dir, max_parsers=3)
+
+  def testUndefinedToken(self):
+    os.unlink(os.path.join(self.def_dir, 'NETWORK4.net'))
+    self.assertRaises(naming.UndefinedAddressError, naming.Naming,
+                      self.def_dir, max_parsers=3)
+
+  def testSyntaxError(self):
+    self._Write('SERVICES.svc', 'HTTP = 80//tcp\n')
+    self.assertRaises(naming.NamingSyntaxError, naming.Naming,
+                      self.def_dir, max_parsers=3)
+
+  @mock.patch.object(naming.concurrent.futures, 'ProcessPoolExecutor',
+                     _OldExecutor)
+  def testExecutorOfOlderPythons(self):
+    self.assertEqual(naming.Naming(self.def_dir, max_parsers=3).GetService(
+        'WEB'), ['443/tcp', '80/tcp'])
+    self._Write('SERVICES.svc', 'HTTP = 80//tcp\n')
+    self.assertRaises(naming.NamingSyntaxError, naming.Naming,
+                      self.def_dir, max_parsers=3)
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -14,6 +14,8 @@
 
 """Unit tests for policy.py library."""
 
+from concurrent import futures
+
 from absl.testing import absltest
 from unittest import mock
 
@@ -1112,6 +1114,59 @@ class PolicyTest(absltest.TestCase):
         mock.call('PROD_NETWRK')])
     self.naming.GetServiceByProto.assert_called_once_with('SMTP', 'tcp')
 
+  def testShadingErrorMessages(self):
+    pol = HEADER + """
+term web-any {
+  destination-address:: WEB_NET
+  protocol:: tcp
+  destination-port:: HIGH_PORTS
+  action:: accept
+}
+term web-host {
+  destination-address:: WEB_HOST
+  protocol:: tcp
+  destination-port:: HTTP_ALT
+  action:: accept
+}
+term check {
+  source-address:: MONITORING
+  protocol:: tcp
+  action:: next
+}
+term check-again {
+  source-address:: MONITORING
+  protocol:: tcp
+  action:: accept
+}
+term dns {
+  destination-address:: WEB_HOST
+  protocol:: udp
+  destination-port:: DNS
+  action:: accept
+}
+term dns-again {
+  destination-address:: WEB_HOST
+  protocol:: udp
+  destination-port:: DNS
+  action:: deny
+}
+"""
+    addresses = {
+        'WEB_NET': [nacaddr.IPv4('10.0.0.0/8')],
+        'WEB_HOST': [nacaddr.IPv4('10.1.1.1/32')],
+        'MONITORING': [nacaddr.IPv4('192.168.0.0/24')],
+    }
+    ports = {'HIGH_PORTS': ['1024-65535'], 'HTTP_ALT': ['8080'], 'DNS': ['53']}
+    self.naming.GetNetAddr.side_effect = lambda token: addresses[token]
+    self.naming.GetServiceByProto.side_effect = (
+        lambda service, proto: ports[service])
+
+    with self.assertRaises(policy.ShadingError) as context:
+      policy.ParsePolicy(pol, self.naming, shade_check=True)
+    self.assertEqual(str(context.exception),
+                     '  web-host is shaded by web-any.\n'
+                     '  dns-again is shaded by dns.')
+
   def testVpnConfigWithoutPairPolicy(self):
     pol = policy.ParsePolicy(HEADER_4 + GOOD_TERM_30, self.naming)
     self.assertEqual(len(pol.filters), 1)
@@ -1232,6 +1287,27 @@ class PolicyTest(absltest.TestCase):
     _ = policy.ParsePolicy(pol, self.naming)
     self.assertFalse(policy._SHADE_CHECK)
 
+  @mock.patch.object(policy.lex, 'lex')
+  def testLexerIsBuiltOnce(self, mock_lex):
+    self.naming.GetNetAddr.return_value = [nacaddr.IPv4('10.0.0.0/8')]
+    for _ in range(2):
+      policy.ParsePolicy(HEADER + GOOD_TERM_2, self.naming)
+    mock_lex.assert_not_called()
+
+  def testParseInThreads(self):
+    parser = policy.PolicyParser()
+
+    def Parse(index):
+      defs = naming.Naming(None)
+      defs.ParseNetworkList(['PROD_NETWRK = 10.0.%d.0/24' % index])
+      pol = parser.Parse(HEADER + GOOD_TERM_2, defs, optimize=bool(index % 2))
+      return pol.filters[0][1][0].source_address
+
+    with futures.ThreadPoolExecutor(max_workers=8) as pool:
+      results = list(pool.map(Parse, range(64)))
+    self.assertEqual(
+        results, [[nacaddr.IPv4('10.0.%d.0/24' % i)] for i in range(64)])
+
   def testEncapsulate(self):
     pol = HEADER + GOOD_TERM_46
     result = policy.ParsePolicy(pol, self.naming)
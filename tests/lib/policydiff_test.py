@@ -0,0 +1,137 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for policydiff.py."""
+
+from absl.testing import absltest
+
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import policydiff
+
+HEADER = """
+header {
+  target:: juniper test-filter mixed
+}
+"""
+
+WEB = """
+term allow-web {
+  destination-address:: WEB_SERVERS
+  protocol:: tcp
+  destination-port:: HTTP
+  action:: accept
+}
+"""
+
+WEB_TLS = """
+term allow-web {
+  destination-address:: WEB_SERVERS
+  protocol:: tcp
+  destination-port:: HTTP HTTPS
+  action:: accept
+}
+"""
+
+DENY_HOST = """
+term deny-host {
+  destination-address:: HOST
+  action:: deny
+}
+"""
+
+ALLOW_ALL = """
+term allow-all {
+  action:: accept
+}
+"""
+
+
+class PolicyDiffTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.defs = naming.Naming(None)
+    self.defs.ParseNetworkList(['WEB_SERVERS = 10.0.0.0/24',
+                                'HOST = 10.0.0.5/32'])
+    self.defs.ParseServiceList(['HTTP = 80/tcp', 'HTTPS = 443/tcp'])
+
+  def _Diff(self, old, new, header=HEADER):
+    diffs = policydiff.DiffPolicies(
+        policy.ParsePolicy(header + old, self.defs),
+        policy.ParsePolicy(header + new, self.defs))
+    self.assertLen(diffs, 1)
+    return ([str(region) for region in diffs[0].permitted],
+            [str(region) for region in diffs[0].denied])
+
+  def testUnchanged(self):
+    self.assertEqual(self._Diff(WEB + DENY_HOST, WEB + DENY_HOST), ([], []))
+
+  def testNewPort(self):
+    self.assertEqual(
+        self._Diff(WEB, WEB_TLS),
+        (['protocol:: tcp destination-address:: 10.0.0.0/24 '
+          'destination-port:: 443'], []))
+    self.assertEqual(
+        self._Diff(WEB_TLS, WEB),
+        ([], ['protocol:: tcp destination-address:: 10.0.0.0/24 '
+              'destination-port:: 443']))
+
+  def testReorderedTerms(self):
+    self.assertEqual(
+        self._Diff(DENY_HOST + WEB, WEB + DENY_HOST),
+        (['protocol:: tcp destination-address:: 10.0.0.5/32 '
+          'destination-port:: 80'], []))
+
+  def testDeniedByNewTerm(self):
+    permitted, denied = self._Diff(ALLOW_ALL, DENY_HOST + ALLOW_ALL)
+    self.assertEqual(permitted, [])
+    self.assertEqual(denied, ['destination-address:: 10.0.0.5/32'])
+
+  def testCompactRegions(self):
+    # allow-all minus deny-host is split in many boxes, merged back into the
+    # IPv4 flows not to the host and the IPv6 flows.
+    permitted, denied = self._Diff(DENY_HOST, DENY_HOST + ALLOW_ALL)
+    self.assertEqual(denied, [])
+    self.assertLen(permitted, 2)
+    self.assertStartsWith(permitted[0],
+                          'destination-address:: 0.0.0.0/5 8.0.0.0/7 '
+                          '10.0.0.0/30 10.0.0.4/32 10.0.0.6/31 ')
+    self.assertNotIn('10.0.0.5/32', permitted[0])
+    self.assertEqual(permitted[1], 'destination-address:: ::/0')
+
+  def testFiltersOfOneRevision(self):
+    old = policy.ParsePolicy(HEADER + WEB, self.defs)
+    new = policy.ParsePolicy(
+        HEADER + WEB + HEADER.replace('test-filter', 'other-filter') + WEB,
+        self.defs)
+    diffs = policydiff.DiffPolicies(old, new)
+    self.assertEqual([diff.filter for diff in diffs],
+                     ['test-filter', 'other-filter'])
+    self.assertFalse(diffs[0])
+    self.assertLen(diffs[1].permitted, 1)
+    self.assertEqual(str(diffs[1]),
+                     'other-filter:\n'
+                     '  + protocol:: tcp destination-address:: 10.0.0.0/24 '
+                     'destination-port:: 80')
+
+  def testTooComplex(self):
+    old = policy.ParsePolicy(HEADER + WEB, self.defs)
+    new = policy.ParsePolicy(HEADER + WEB + DENY_HOST + ALLOW_ALL, self.defs)
+    self.assertRaises(policydiff.TooComplexError, policydiff.DiffPolicies,
+                      old, new, max_pieces=2)
+
+
+if __name__ == '__main__':
+  absltest.main()
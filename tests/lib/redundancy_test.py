@@ -0,0 +1,203 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for redundancy.py."""
+
+from absl.testing import absltest
+
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import redundancy
+
+HEADER = """
+header {
+  target:: juniper test-filter mixed
+}
+"""
+
+TERM = """
+term %(name)s {
+  %(body)s
+  action:: %(action)s
+}
+"""
+
+
+class RedundancyTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.defs = naming.Naming(None)
+    self.defs.ParseNetworkList([
+        'NET_LOW = 10.0.0.0/25',
+        'NET_HIGH = 10.0.0.128/25',
+        'NET_ALL = 10.0.0.0/24',
+        'HOST = 10.0.0.5/32',
+        'NET6 = 2001:db8::/32',
+        'HOST6 = 2001:db8::1/128',
+        'MIXED = 10.0.0.0/24 2001:db8::/32',
+    ])
+    self.defs.ParseServiceList([
+        'HTTP = 80/tcp',
+        'HTTPS = 443/tcp',
+        'WEB = 80/tcp 443/tcp',
+        'HIGH_PORTS = 1024-65535/tcp',
+    ])
+
+  def _Findings(self, *terms, **kwargs):
+    text = HEADER + ''.join(
+        TERM % {'name': name, 'body': body, 'action': action}
+        for name, body, action in terms)
+    pol = policy.ParsePolicy(text, self.defs, optimize=False)
+    return [(f.term, f.kind, f.terms)
+            for f in redundancy.AnalyzePolicy(pol, **kwargs)]
+
+  def testShaded(self):
+    self.assertEqual(
+        self._Findings(
+            ('wide', 'destination-address:: NET_ALL', 'accept'),
+            ('narrow', 'destination-address:: HOST\nprotocol:: tcp', 'deny')),
+        [('narrow', redundancy.SHADED, ['wide'])])
+
+  def testUnreachable(self):
+    self.assertEqual(
+        self._Findings(
+            ('low', 'destination-address:: NET_LOW', 'accept'),
+            ('high', 'destination-address:: NET_HIGH', 'deny'),
+            ('all', 'destination-address:: NET_ALL', 'reject')),
+        [('all', redundancy.UNREACHABLE, ['low', 'high'])])
+
+  def testUnreachableByPorts(self):
+    self.assertEqual(
+        self._Findings(
+            ('http', 'protocol:: tcp\ndestination-port:: HTTP', 'accept'),
+            ('https', 'protocol:: tcp\ndestination-port:: HTTPS', 'accept'),
+            ('web', 'destination-address:: HOST\nprotocol:: tcp\n'
+             'destination-port:: WEB', 'deny')),
+        [('web', redundancy.UNREACHABLE, ['http', 'https'])])
+
+  def testRedundant(self):
+    self.assertEqual(
+        self._Findings(
+            ('host', 'destination-address:: HOST', 'accept'),
+            ('other', 'destination-address:: NET_HIGH', 'deny'),
+            ('all', 'destination-address:: NET_ALL', 'accept')),
+        [('host', redundancy.REDUNDANT, ['all'])])
+
+  def testNotRedundantWithDifferentDecisionInBetween(self):
+    self.assertEqual(
+        self._Findings(
+            ('host', 'destination-address:: HOST', 'accept'),
+            ('low', 'destination-address:: NET_LOW\nprotocol:: tcp', 'deny'),
+            ('all', 'destination-address:: NET_ALL', 'accept')),
+        [('low', redundancy.OVERLAP, ['host'])])
+
+  def testUnreachableTermsAreLeftOut(self):
+    # 'all' is unreachable, so 'low' and 'high' decide their flows.
+    self.assertEqual(
+        self._Findings(
+            ('low', 'destination-address:: NET_LOW', 'accept'),
+            ('high', 'destination-address:: NET_HIGH', 'accept'),
+            ('all', 'destination-address:: NET_ALL', 'accept')),
+        [('all', redundancy.UNREACHABLE, ['low', 'high'])])
+
+  def testOverlap(self):
+    # 'wider' contains 'host', which is not an overlap.
+    self.assertEqual(
+        self._Findings(
+            ('http', 'destination-address:: NET_ALL\nprotocol:: tcp\n'
+             'destination-port:: HTTP', 'accept'),
+            ('host', 'destination-address:: HOST\nprotocol:: tcp\n'
+             'destination-port:: WEB', 'deny'),
+            ('wider', 'destination-address:: NET_ALL\nprotocol:: tcp\n'
+             'destination-port:: WEB', 'reject')),
+        [('host', redundancy.OVERLAP, ['http'])])
+
+  def testNextTermsNeverShade(self):
+    self.assertEqual(
+        self._Findings(
+            ('count', 'destination-address:: NET_ALL', 'next'),
+            ('host', 'destination-address:: HOST', 'accept')),
+        [])
+
+  def testNextTermShaded(self):
+    self.assertEqual(
+        self._Findings(
+            ('all', 'destination-address:: NET_ALL', 'accept'),
+            ('count', 'destination-address:: HOST', 'next')),
+        [('count', redundancy.SHADED, ['all'])])
+
+  def testUnmodeledCriteria(self):
+    # established terms match fewer flows than their addresses and ports.
+    self.assertEqual(
+        self._Findings(
+            ('established', 'protocol:: tcp\noption:: tcp-established',
+             'accept'),
+            ('host', 'destination-address:: HOST\nprotocol:: tcp', 'deny'),
+            ('icmp', 'destination-address:: HOST\nprotocol:: icmp\n'
+             'icmp-type:: echo-request', 'deny'),
+            ('all', 'destination-address:: NET_ALL', 'deny')),
+        [('host', redundancy.REDUNDANT, ['all']),
+         ('icmp', redundancy.REDUNDANT, ['all'])])
+
+  def testAddressFamilies(self):
+    self.assertEqual(
+        self._Findings(
+            ('v4', 'destination-address:: NET_ALL', 'accept'),
+            ('v6', 'destination-address:: NET6', 'accept'),
+            ('mixed', 'destination-address:: MIXED', 'accept'),
+            ('host6', 'source-address:: HOST6\n'
+             'destination-address:: NET_ALL', 'deny')),
+        [('mixed', redundancy.UNREACHABLE, ['v4', 'v6'])])
+
+  def testExcludes(self):
+    self.assertEqual(
+        self._Findings(
+            ('not-host', 'destination-address:: NET_LOW\n'
+             'destination-exclude:: HOST', 'accept'),
+            ('host', 'destination-address:: HOST', 'deny'),
+            ('low', 'destination-address:: NET_LOW', 'reject')),
+        [('low', redundancy.UNREACHABLE, ['not-host', 'host'])])
+
+  def testEitherPort(self):
+    self.assertEqual(
+        self._Findings(
+            ('either', 'protocol:: tcp\nport:: HTTP', 'accept'),
+            ('source', 'protocol:: tcp\nsource-port:: HTTP\n'
+             'destination-port:: HIGH_PORTS', 'deny'),
+            ('destination', 'protocol:: tcp\ndestination-port:: HTTP',
+             'deny')),
+        [('source', redundancy.SHADED, ['either']),
+         ('destination', redundancy.SHADED, ['either'])])
+
+  def testGiveUp(self):
+    terms = [('host', 'destination-address:: HOST\nprotocol:: tcp\n'
+              'destination-port:: HTTP', 'accept'),
+             ('low', 'destination-address:: NET_LOW\nprotocol:: tcp', 'deny'),
+             ('all', 'destination-address:: NET_ALL', 'deny')]
+    self.assertEqual(self._Findings(*terms),
+                     [('low', redundancy.REDUNDANT, ['all'])])
+    # the reach of 'low' is split in more pieces than that.
+    self.assertEqual(self._Findings(*terms, max_pieces=1), [])
+
+  def testFindingString(self):
+    finding = redundancy.Finding('test-filter', 'all', redundancy.UNREACHABLE,
+                                 ['low', 'high'])
+    self.assertEqual(str(finding),
+                     'test-filter: all is unreachable, shaded by the union of '
+                     'low, high')
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,91 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for atomicfile.py module."""
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from capirca.utils import atomicfile
+
+
+class AtomicFileTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.path = os.path.join(self.base_dir, 'state', 'state.json')
+
+  def testOpenReplacesTheFile(self):
+    with atomicfile.Open(self.path) as f:
+      f.write('first')
+    with atomicfile.Open(self.path) as f:
+      f.write('second')
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'second')
+    self.assertEqual(os.listdir(os.path.dirname(self.path)), ['state.json'])
+    self.assertEqual(os.stat(self.path).st_mode & 0o777,
+                     0o666 & ~atomicfile._Umask())
+
+  def testFailedWriteKeepsThePreviousFile(self):
+    with atomicfile.Open(self.path) as f:
+      f.write('first')
+    with self.assertRaises(ValueError):
+      with atomicfile.Open(self.path) as f:
+        f.write('partial')
+        raise ValueError('full')
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'first')
+    self.assertEqual(os.listdir(os.path.dirname(self.path)), ['state.json'])
+
+  def testConcurrentWritersStageApart(self):
+    with atomicfile.Open(self.path) as first:
+      first.write('first')
+      with atomicfile.Open(self.path) as second:
+        second.write('second')
+      self.assertNotEqual(first.name, second.name)
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'first')
+
+  def testSaveAndLoad(self):
+    atomicfile.Save(self.path, 2, entries={'a': 1}, options={'b': True})
+    self.assertEqual(
+        atomicfile.Load(self.path, 'state', 2, options={'b': True}),
+        {'format': 2, 'entries': {'a': 1}, 'options': {'b': True}})
+
+  def testLoadMissingFile(self):
+    with mock.patch.object(atomicfile.logging, 'warning') as warning:
+      self.assertIsNone(atomicfile.Load(self.path, 'state', 1))
+    warning.assert_not_called()
+
+  def testLoadUnreadableFile(self):
+    os.makedirs(os.path.dirname(self.path))
+    with open(self.path, 'w') as f:
+      f.write('{not json')
+    with mock.patch.object(atomicfile.logging, 'warning') as warning:
+      self.assertIsNone(atomicfile.Load(self.path, 'state', 1))
+    warning.assert_called_once()
+
+  def testLoadOutOfDateFile(self):
+    atomicfile.Save(self.path, 1, options={'b': True})
+    self.assertIsNone(atomicfile.Load(self.path, 'state', 2))
+    self.assertIsNone(
+        atomicfile.Load(self.path, 'state', 1, options={'b': False}))
+
+
+if __name__ == '__main__':
+  absltest.main()
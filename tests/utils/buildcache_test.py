@@ -0,0 +1,155 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for buildcache.py module."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from capirca.lib import naming
+from capirca.utils import buildcache
+
+POLICY = """
+header {
+  target:: juniper test-filter
+}
+#include 'includes/term.inc'
+"""
+
+INCLUDE = """
+term allow-web {
+  destination-address:: WEB
+  destination-port:: HTTP
+  protocol:: tcp
+  action:: accept
+}
+"""
+
+
+class BuildCacheTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    os.mkdir(os.path.join(self.base_dir, 'includes'))
+    self.policy_file = pathlib.Path(self.base_dir, 'test.pol')
+    self.policy_file.write_text(POLICY)
+    self.include_file = pathlib.Path(self.base_dir, 'includes/term.inc')
+    self.include_file.write_text(INCLUDE)
+    self.output_file = pathlib.Path(self.base_dir, 'test.jcl')
+    self.output_file.write_text('rendered')
+    self.cache_file = os.path.join(self.base_dir, 'cache.json')
+    self.options = buildcache.Options(self.base_dir, 2, False, False)
+    self.networks = ['WEB = 10.0.0.1/32 SERVERS', 'SERVERS = 10.1.0.0/16',
+                     'OTHER = 10.2.0.0/16']
+    self.services = ['HTTP = 80/tcp']
+    self._Build()
+
+  def _Cache(self, options=None):
+    defs = naming.Naming(None)
+    defs.ParseNetworkList(self.networks)
+    defs.ParseServiceList(self.services)
+    return buildcache.BuildCache(self.cache_file, defs, self.base_dir,
+                                 options or self.options)
+
+  def _Build(self):
+    cache = self._Cache()
+    cache.Update(self.policy_file, [self.output_file],
+                 {'networks': ['WEB'], 'services': ['HTTP']})
+    cache.Save()
+
+  def testUnchangedPolicyIsFresh(self):
+    self.assertTrue(self._Cache().IsFresh(self.policy_file))
+
+  def testUnknownPolicyIsStale(self):
+    other = pathlib.Path(self.base_dir, 'other.pol')
+    other.write_text(POLICY)
+    self.assertFalse(self._Cache().IsFresh(other))
+
+  def testPolicyChange(self):
+    self.policy_file.write_text(POLICY + '\n# a comment\n')
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testIncludeChange(self):
+    self.include_file.write_text(INCLUDE.replace('accept', 'deny'))
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testMissingInclude(self):
+    self.include_file.unlink()
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testNestedTokenChange(self):
+    self.networks[1] = 'SERVERS = 10.1.0.0/24'
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testUnreferencedTokenChange(self):
+    self.networks[2] = 'OTHER = 10.3.0.0/16'
+    self.services.append('SSH = 22/tcp')
+    self.assertTrue(self._Cache().IsFresh(self.policy_file))
+
+  def testServiceChange(self):
+    self.services[0] = 'HTTP = 80/tcp 8080/tcp'
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testRemovedToken(self):
+    del self.networks[0]
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testMissingOutput(self):
+    self.output_file.unlink()
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testOptionsChange(self):
+    options = buildcache.Options(self.base_dir, 2, True, False)
+    self.assertFalse(self._Cache(options).IsFresh(self.policy_file))
+
+  def testCodeChange(self):
+    with mock.patch.object(buildcache, 'CodeDigest', return_value='upgraded'):
+      options = buildcache.Options(self.base_dir, 2, False, False)
+    self.assertNotEqual(options, self.options)
+    self.assertFalse(self._Cache(options).IsFresh(self.policy_file))
+
+  def testCodeDigest(self):
+    self.assertLen(buildcache.CodeDigest(), 64)
+    self.assertEqual(self.options['code'], buildcache.CodeDigest())
+
+  def testCodeDigestCoversUtils(self):
+    code_dir = pathlib.Path(self.base_dir, 'capirca')
+    for source in ('aclgen.py', 'lib/nacaddr.py', 'utils/iputils.py'):
+      (code_dir / source).parent.mkdir(parents=True, exist_ok=True)
+      (code_dir / source).write_text('# %s\n' % source)
+    self.addCleanup(buildcache.CodeDigest.cache_clear)
+    with mock.patch.object(buildcache, 'CAPIRCA_DIRECTORY', code_dir):
+      buildcache.CodeDigest.cache_clear()
+      before = buildcache.CodeDigest()
+      (code_dir / 'utils/iputils.py').write_text('# fixed\n')
+      buildcache.CodeDigest.cache_clear()
+      self.assertNotEqual(buildcache.CodeDigest(), before)
+
+  def testUnreadableCache(self):
+    pathlib.Path(self.cache_file).write_text('{not json')
+    self.assertFalse(self._Cache().IsFresh(self.policy_file))
+
+  def testRemovedPolicyIsForgotten(self):
+    self.policy_file.unlink()
+    self._Cache().Save()
+    self.assertEmpty(self._Cache().entries)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,123 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for buildtimes.py module."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from capirca.utils import buildtimes
+
+
+class BuildTimesTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.times_file = os.path.join(self.base_dir, 'times.json')
+    self.small = pathlib.Path(self.base_dir, 'small.pol')
+    self.large = pathlib.Path(self.base_dir, 'large.pol')
+    self.small.write_text('small')
+    self.large.write_text('large')
+
+  def _Recorded(self):
+    times = buildtimes.BuildTimes(self.times_file)
+    times.Record(self.small, 100, 1000, 1.0, {'juniper': 2.0, 'cisco': 3.0})
+    times.Record(self.large, 1000, 10000, 4.0, {'juniper': 40.0})
+    times.Save()
+    return buildtimes.BuildTimes(self.times_file)
+
+  def testRecordedPolicyCost(self):
+    times = self._Recorded()
+    # parsing, then the slowest platform.
+    self.assertEqual(times.PolicyCost(self.small, 100), 4.0)
+    # scaled by the size of the policy.
+    self.assertEqual(times.PolicyCost(self.small, 200), 8.0)
+    self.assertEqual(times.PlatformCost(self.large, 'juniper', 5000), 20.0)
+
+  def testCostLearnedFromOtherPolicies(self):
+    times = self._Recorded()
+    new = pathlib.Path(self.base_dir, 'new.pol')
+    # 5s per 1100 bytes parsed, 10 bytes saved per byte, and 45s per 12000
+    # bytes rendered, counting the bytes once per platform.
+    self.assertAlmostEqual(times.PolicyCost(new, 1100),
+                           5.0 + 11000 * 45.0 / 12000)
+    # juniper took 42s for 11000 bytes, cisco 3s for 1000 bytes.
+    self.assertAlmostEqual(times.PlatformCost(new, 'juniper', 1100), 4.2)
+    self.assertAlmostEqual(times.PlatformCost(self.large, 'cisco', 1100), 3.3)
+    self.assertAlmostEqual(times.PlatformCost(new, 'srx', 1200), 4.5)
+
+  def testCostWithoutTimes(self):
+    times = buildtimes.BuildTimes()
+    self.assertGreater(times.PolicyCost(self.large, 200),
+                       times.PolicyCost(self.small, 100))
+    self.assertGreater(times.PlatformCost(self.large, 'juniper', 200),
+                       times.PlatformCost(self.small, 'juniper', 100))
+    times.Record(self.small, 100, 1000, 1.0, {'juniper': 2.0})
+    times.Save()
+    self.assertFalse(os.path.exists(self.times_file))
+
+  def testUnsavedTimesAreReportedOnly(self):
+    times = buildtimes.BuildTimes(self.times_file)
+    times.Record(self.small, 100, None, 1.0, {'juniper': 2.0})
+    times.Save()
+    self.assertEqual(buildtimes.BuildTimes(self.times_file).entries, {})
+    with mock.patch.object(buildtimes.logging, 'info') as info:
+      times.Report()
+    self.assertIn(mock.call('  %-20s %8d %10.2f', 'juniper', 1, 2.0),
+                  info.call_args_list)
+
+  def testRemovedPoliciesAreForgotten(self):
+    self.large.unlink()
+    times = self._Recorded()
+    self.assertEqual(list(times.entries), [str(self.small.resolve())])
+
+  def testRelativePathsFromAnotherDirectory(self):
+    sub_dir = os.path.join(self.base_dir, 'sub')
+    os.mkdir(sub_dir)
+    self.addCleanup(os.chdir, os.getcwd())
+    os.chdir(self.base_dir)
+    times = buildtimes.BuildTimes(self.times_file)
+    times.Record(pathlib.Path('small.pol'), 100, 1000, 1.0, {'juniper': 2.0})
+    times.Save()
+    # the same policy, seen from another directory.
+    os.chdir(sub_dir)
+    times = buildtimes.BuildTimes(self.times_file)
+    self.assertEqual(times.PolicyCost(pathlib.Path('../small.pol'), 100), 3.0)
+    times.Save()
+    self.assertLen(buildtimes.BuildTimes(self.times_file).entries, 1)
+
+  def testReport(self):
+    times = self._Recorded()
+    self.assertEqual(times.measured, {})
+    times.Record(self.small, 100, 1000, 1.0, {'juniper': 2.0, 'cisco': 3.0})
+    with mock.patch.object(buildtimes.logging, 'info') as info:
+      times.Report()
+    lines = [c.args[0] % c.args[1:] for c in info.call_args_list]
+    self.assertIn('render times of 1 policies, 6.00s in all:', lines)
+    self.assertIn('        6.00s %s (parse 1.00s, cisco 3.00s, juniper 2.00s)'
+                  % self.small, lines)
+
+  def testUnreadableTimesAreIgnored(self):
+    with open(self.times_file, 'w') as f:
+      f.write('{not json')
+    self.assertEqual(buildtimes.BuildTimes(self.times_file).entries, {})
+
+
+if __name__ == '__main__':
+  absltest.main()
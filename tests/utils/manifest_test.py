@@ -0,0 +1,110 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Unittest for manifest.py module."""
+
+import os
+import pathlib
+import shutil
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from capirca.utils import manifest
+
+# written apart so that the repository does not expand them here.
+RENDERED = """! %sId:%s
+! %sDate:%s
+ip access-list extended test-filter
+ permit ip any any
+exit
+""" % ('$', '$', '$', '$')
+
+
+class ManifestTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.base_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.base_dir)
+    self.output_file = pathlib.Path(self.base_dir, 'test.acl')
+    self.output_file.write_text(RENDERED)
+    self.manifest_file = os.path.join(self.base_dir, 'manifest.json')
+
+  def _Record(self, digest):
+    files = manifest.Manifest(self.manifest_file)
+    self.assertFalse(files.Changed(self.output_file, digest))
+    files.Update(files.TakeRendered())
+    files.Save()
+
+  def testTextDigestIgnoresRepositoryTags(self):
+    digest = manifest.TextDigest(RENDERED)
+    self.assertEqual(manifest.TextDigest(RENDERED.replace('Id:', 'Id: 1 ')),
+                     digest)
+    self.assertNotEqual(manifest.TextDigest(RENDERED.replace('any any', 'any')),
+                        digest)
+    self.assertNotEqual(manifest.TextDigest(RENDERED + '\n'), digest)
+    self.assertNotEqual(manifest.TextDigest(RENDERED.rstrip('\n')), digest)
+
+  def testTextHasherJoinsChunks(self):
+    writer = mock.Mock()
+    hasher = manifest.TextHasher(writer)
+    for char in RENDERED:
+      hasher.write(char)
+    self.assertEqual(hasher.hexdigest(), manifest.TextDigest(RENDERED))
+    self.assertEqual(
+        ''.join(c.args[0] for c in writer.write.call_args_list), RENDERED)
+    self.assertEqual(manifest.FileDigest(self.output_file),
+                     manifest.TextDigest(RENDERED))
+    self.assertIsNone(manifest.FileDigest(self.output_file.with_suffix('.x')))
+
+  def testRecordedFileIsNotRead(self):
+    self._Record(manifest.TextDigest(RENDERED))
+    files = manifest.Manifest(self.manifest_file)
+    with mock.patch.object(manifest, 'FileDigest') as file_digest:
+      self.assertFalse(files.Changed(self.output_file,
+                                     manifest.TextDigest(RENDERED)))
+      self.assertTrue(files.Changed(self.output_file,
+                                    manifest.TextDigest('other')))
+    file_digest.assert_not_called()
+
+  def testModifiedFileIsRead(self):
+    self._Record(manifest.TextDigest(RENDERED))
+    self.output_file.write_text(RENDERED + 'end\n')
+    files = manifest.Manifest(self.manifest_file)
+    self.assertTrue(files.Changed(self.output_file,
+                                  manifest.TextDigest(RENDERED)))
+    self.assertFalse(files.Changed(self.output_file,
+                                   manifest.TextDigest(RENDERED + 'end\n')))
+
+  def testMissingFileChanged(self):
+    self._Record(manifest.TextDigest(RENDERED))
+    self.output_file.unlink()
+    files = manifest.Manifest(self.manifest_file)
+    self.assertTrue(files.Changed(self.output_file,
+                                  manifest.TextDigest(RENDERED)))
+    files.Update(files.TakeRendered())
+    files.Save()
+    self.assertEqual(manifest.Manifest(self.manifest_file).entries, {})
+
+  def testUnreadableManifestIsIgnored(self):
+    with open(self.manifest_file, 'w') as f:
+      f.write('{not json')
+    files = manifest.Manifest(self.manifest_file)
+    self.assertEqual(files.entries, {})
+    self.assertFalse(files.Changed(self.output_file,
+                                   manifest.TextDigest(RENDERED)))
+
+
+if __name__ == '__main__':
+  absltest.main()
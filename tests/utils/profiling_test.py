@@ -0,0 +1,131 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unittest for profiling.py module."""
+
+import json
+import os
+import shutil
+import tempfile
+
+from absl.testing import absltest
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.utils import profiling
+
+POLICY = """
+header {
+  target:: juniper test-filter
+}
+term good-term {
+  source-address:: PRODUCTION
+  protocol:: tcp
+  action:: accept
+}
+"""
+
+
+@profiling.Timed('recursive')
+def Recursive(depth):
+  if depth:
+    Recursive(depth - 1)
+
+
+class ProfilingTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.addCleanup(profiling.Disable)
+
+  def _Timers(self, file_name=None):
+    results = profiling.Results()
+    if file_name is None:
+      return results['total']['timers']
+    return results['files'][file_name]['timers']
+
+  def testDisabled(self):
+    with profiling.File('test.pol'), profiling.Timer('timer'):
+      profiling.Count('counter')
+    Recursive(2)
+    with self.assertRaises(ValueError), profiling.Timer('timer'):
+      raise ValueError('not swallowed')
+    self.assertFalse(profiling.Enabled())
+    self.assertIsNone(profiling.Collect())
+    self.assertIsNone(profiling.Results())
+
+  def testTimersByFile(self):
+    profiling.Enable()
+    with profiling.Timer('outside'):
+      pass
+    with profiling.File('test.pol'):
+      Recursive(3)
+      with profiling.Timer('timer'):
+        profiling.Count('counter', 2)
+      with profiling.Timer('timer'):
+        profiling.Count('counter')
+    self.assertEqual(self._Timers('test.pol')['recursive']['count'], 1)
+    self.assertEqual(self._Timers('test.pol')['timer']['count'], 2)
+    self.assertNotIn('outside', self._Timers('test.pol'))
+    self.assertEqual(self._Timers()['outside']['count'], 1)
+    self.assertEqual(
+        profiling.Results()['files']['test.pol']['counters'], {'counter': 3})
+    self.assertEqual(list(profiling.Results()['files']), ['test.pol'])
+
+  def testCollectAndMerge(self):
+    profiling.Enable()
+    with profiling.File('test.pol'), profiling.Timer('timer'):
+      pass
+    collected = profiling.Collect()
+    self.assertIsNone(profiling.Results()['total']['timers'].get('timer'))
+    profiling.Merge(json.loads(json.dumps(collected)))
+    profiling.Merge(collected)
+    self.assertEqual(self._Timers('test.pol')['timer']['count'], 2)
+
+  def testParsePolicy(self):
+    defs = naming.Naming(None)
+    defs.ParseNetworkList(['PRODUCTION = 10.0.0.0/8'])
+    profiling.Enable()
+    with profiling.File('test.pol'):
+      policy.ParsePolicy(POLICY, defs, shade_check=True)
+    timers = self._Timers('test.pol')
+    for name in ('_Preprocess', 'parse', 'Term.AddObject',
+                 'Term.AddressCleanup', 'shading'):
+      self.assertIn(name, timers)
+    self.assertGreaterEqual(timers['parse']['seconds'],
+                            timers['Term.AddObject']['seconds'])
+    self.assertEqual(
+        profiling.Results()['files']['test.pol']['counters'], {'terms': 1})
+
+  def testSave(self):
+    profiling.Enable(trace=True)
+    with profiling.File('test.pol'), profiling.Timer('timer'):
+      pass
+    output_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, output_dir)
+    profile_file = os.path.join(output_dir, 'profile.json')
+    trace_file = os.path.join(output_dir, 'trace.json')
+    profiling.Save(profile_file, trace_file)
+    with open(profile_file) as f:
+      self.assertEqual(json.load(f), json.loads(json.dumps(
+          profiling.Results())))
+    with open(trace_file) as f:
+      events = json.load(f)['traceEvents']
+    self.assertLen(events, 1)
+    self.assertEqual(events[0]['name'], 'timer')
+    self.assertEqual(events[0]['ph'], 'X')
+    self.assertEqual(events[0]['args'], {'file': 'test.pol'})
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,965 @@
+# Copyright 2021 The Capirca Project Authors All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for the hot paths of aclgen and the capirca libraries.
+
+Every benchmark runs in a freshly forked process so that wall time and peak
+resident set size are measured independently of each other.
+
+Examples:
+  To compare eager and lazy per-platform policy copies in RenderFile use
+  $ python -m tools.benchmark render --terms 5000
+
+  To compare pool startup and throughput for several --max_renderers use
+  $ python -m tools.benchmark renderers --max_renderers 1 4 16
+
+  To compare pairwise and indexed shading detection use
+  $ python -m tools.benchmark shading --terms 1000 10000 50000
+
+  To compare linear and AddressSet containment checks use
+  $ python -m tools.benchmark containment --addresses 10 100 1000
+
+  To compare object and integer based address collapsing and excludes use
+  $ python -m tools.benchmark collapse --prefixes 200000
+
+  To compare AclCheck and FlowChecker on a batch of flows use
+  $ python -m tools.benchmark aclcheck --terms 1000 --flows 50000
+
+  To check arrays of flows with aclcheck_numpy (needs numpy) use
+  $ python -m tools.benchmark flowarray --terms 1000 --flows 1000000
+
+  To find the unreachable, redundant and overlapping terms of a filter use
+  $ python -m tools.benchmark redundancy --terms 1000 10000
+
+  To find the flows permitted and denied by a few changed terms of a filter use
+  $ python -m tools.benchmark policydiff --terms 1000 10000 --changes 10
+
+  To compare cgrep queries against Naming and against a cgrep index use
+  $ python -m tools.benchmark cgrep --networks 40000 --ips 1000
+
+  To compare Naming.GetIpParents and GetIpParentsBatch on many IPs use
+  $ python -m tools.benchmark ipparents --networks 40000 --ips 200000
+
+  To compare serial, parallel and snapshot loading of large definitions use
+  $ python -m tools.benchmark definitions --files 8 --max_parsers 1 4
+"""
+
+import argparse
+import copy
+import functools
+import ipaddress
+import multiprocessing
+import os
+import pathlib
+import pickle
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+
+from capirca import aclgen
+from capirca.lib import aclcheck
+from capirca.lib import nacaddr
+from capirca.lib import naming
+from capirca.lib import policy
+from capirca.lib import policydiff
+from capirca.lib import redundancy
+from tools import cgrep
+
+_RENDER_HEADER = """
+header {
+  target:: juniper bench-filter inet
+  target:: srx from-zone trust to-zone untrust
+  target:: cisco bench-filter
+  target:: iptables INPUT ACCEPT
+}
+"""
+
+_RENDER_TERM = """
+term bench-term-%(index)d {
+  source-address:: NET%(src)d
+  destination-address:: NET%(dst)d
+  protocol:: tcp
+  destination-port:: SVC%(svc)d
+  action:: accept
+}
+"""
+
+
+def _Measure(func, *args):
+  """Run func(*args) in a forked child and report its cost.
+
+  Args:
+    func: callable to benchmark.
+    *args: arguments passed to func.
+
+  Returns:
+    tuple of (wall time in seconds, peak RSS in MiB, return value of func).
+  """
+  context = multiprocessing.get_context('fork')
+  reader, writer = context.Pipe(duplex=False)
+
+  def Child():
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    writer.send((elapsed, peak, result))
+
+  process = context.Process(target=Child)
+  process.start()
+  # Close our end of the pipe so a crashed child surfaces as EOFError.
+  writer.close()
+  try:
+    measurement = reader.recv()
+  except EOFError:
+    measurement = None
+  process.join()
+  if measurement is None:
+    raise RuntimeError('benchmark child exited with %s' % process.exitcode)
+  return measurement
+
+
+def _Report(name, measurement):
+  print('%-32s %10.3fs %10.1f MiB' % (name, measurement[0], measurement[1]))
+
+
+def SyntheticDefinitions(networks, services, prefixes_per_network=4):
+  """Build a naming.Naming object with generated tokens.
+
+  Args:
+    networks: number of network tokens, NET0..NETn.
+    services: number of service tokens, SVC0..SVCn.
+    prefixes_per_network: number of /24 prefixes in each network token.
+
+  Returns:
+    naming.Naming object.
+  """
+  defs = naming.Naming(None)
+  network_lines = []
+  for i in range(networks):
+    prefixes = []
+    for j in range(prefixes_per_network):
+      value = i * prefixes_per_network + j
+      prefixes.append('10.%d.%d.0/24' % (value // 256 % 256, value % 256))
+    network_lines.append('NET%d = %s' % (i, ' '.join(prefixes)))
+  defs.ParseNetworkList(network_lines)
+  defs.ParseServiceList(
+      ['SVC%d = %d/tcp' % (i, 1000 + i) for i in range(services)])
+  return defs
+
+
+def SyntheticPolicy(header, terms, networks, services):
+  """Return the text of a policy with generated terms under header."""
+  text = [header]
+  for i in range(terms):
+    text.append(_RENDER_TERM % {'index': i,
+                                'src': i % networks,
+                                'dst': (i * 7 + 1) % networks,
+                                'svc': i % services})
+  return ''.join(text)
+
+
+def _RenderEager(base_dir, policy_file, defs):
+  """Render policy_file the way RenderFile did before lazy copies."""
+  pol = policy.ParsePolicy(open(policy_file).read(), defs, optimize=True,
+                           base_dir=base_dir)
+  platforms = set()
+  for header in pol.headers:
+    platforms.update(header.platforms)
+  renderers = [r for r in aclgen.RENDERERS if r[0] in platforms]
+  copies = [copy.deepcopy(pol) for _ in renderers]
+  sizes = 0
+  for (_, generator, _), platform_pol in zip(renderers, copies):
+    sizes += len(str(generator(platform_pol, 2)))
+  return sizes
+
+
+def _RenderLazy(base_dir, policy_file, defs):
+  """Render policy_file through aclgen.RenderFile."""
+  write_files = []
+  aclgen.RenderFile(base_dir, pathlib.Path(policy_file),
+                    pathlib.Path(base_dir), defs, 2, True, False, write_files)
+  sizes = sum(os.path.getsize(rendered.path) for _, rendered in write_files)
+  aclgen.DiscardFiles(write_files)
+  return sizes
+
+
+def BenchmarkRender(args):
+  """Compare eager and lazy policy copies while rendering one policy."""
+  defs = SyntheticDefinitions(args.networks, args.services)
+  base_dir = tempfile.mkdtemp()
+  try:
+    pol_dir = os.path.join(base_dir, 'pol')
+    os.mkdir(pol_dir)
+    policy_file = os.path.join(pol_dir, 'bench.pol')
+    with open(policy_file, 'w') as f:
+      f.write(SyntheticPolicy(_RENDER_HEADER, args.terms, args.networks,
+                              args.services))
+    print('rendering %d terms for juniper, srx, cisco and iptables' %
+          args.terms)
+    eager = _Measure(_RenderEager, base_dir, policy_file, defs)
+    _Report('eager copies', eager)
+    lazy = _Measure(_RenderLazy, base_dir, policy_file, defs)
+    _Report('lazy copies', lazy)
+    if eager[2] != lazy[2]:
+      print('WARNING: rendered output sizes differ (%d vs %d)' %
+            (eager[2], lazy[2]))
+  finally:
+    shutil.rmtree(base_dir)
+
+
+def _RunPool(context, processes, func, tasks):
+  """Render tasks in a pool and time it.
+
+  Returns:
+    tuple of (seconds until the first file rendered, total seconds).
+  """
+  finished = []
+  errors = []
+  start = time.perf_counter()
+  pool = context.Pool(processes=processes)
+  for args in tasks:
+    pool.apply_async(func, args=args,
+                     callback=lambda _: finished.append(time.perf_counter()),
+                     error_callback=errors.append)
+  pool.close()
+  pool.join()
+  if errors:
+    raise errors[0]
+  return min(finished) - start, time.perf_counter() - start
+
+
+def _RunPhasedPool(context, processes, defs, policy_files, base_dir,
+                   output_dir):
+  """Render policy files in a pool the way aclgen.Run does, and time it.
+
+  The definitions are handed to each process once by aclgen._InitRenderer,
+  every policy is parsed once and each platform rendered as a task of its
+  own.
+
+  Returns:
+    tuple of (seconds until the first file rendered, total seconds).
+  """
+  # pylint: disable=protected-access
+  finished = []
+  start = time.perf_counter()
+  snapshot_dir = tempfile.mkdtemp(dir=base_dir)
+  pool = context.Pool(processes=processes, initializer=aclgen._InitRenderer,
+                      initargs=(defs,))
+  try:
+    parse = functools.partial(
+        aclgen._ParseFileInPool, base_directory=base_dir,
+        output_directory=output_dir, optimize=True, shade_check=False,
+        snapshot_directory=snapshot_dir)
+    render = functools.partial(aclgen._RenderPlatformInPool, exp_info=2)
+    scheduler = aclgen._Scheduler(pool, processes)
+    for policy_file in policy_files:
+      scheduler.Add(0, parse, policy_file)
+    for result in scheduler.Results():
+      if isinstance(result, BaseException):
+        raise result
+      if isinstance(result, aclgen.ParsedPolicy):
+        for task in result.tasks:
+          scheduler.Add(0, render, task)
+        continue
+      finished.append(time.perf_counter())
+      aclgen.DiscardFiles(result.write_files)
+      if result.error:
+        raise RuntimeError(result.error)
+    pool.close()
+    pool.join()
+  finally:
+    pool.terminate()
+  return min(finished) - start, time.perf_counter() - start
+
+
+def BenchmarkRenderers(args):
+  """Compare pool startup and throughput for several max_renderers values."""
+  defs = SyntheticDefinitions(args.networks, args.services)
+  context = multiprocessing.get_context(args.start_method)
+  base_dir = tempfile.mkdtemp()
+  try:
+    pol_dir = os.path.join(base_dir, 'pol')
+    os.mkdir(pol_dir)
+    policy_files = []
+    for i in range(args.files):
+      policy_file = pathlib.Path(pol_dir, 'bench%d.pol' % i)
+      policy_file.write_text(SyntheticPolicy(
+          '\nheader {\n  target:: juniper bench-filter inet\n}\n',
+          args.terms, args.networks, args.services))
+      policy_files.append(policy_file)
+    output_dir = pathlib.Path(base_dir)
+
+    print('%d policies of %d terms, definitions pickle to %.1f MiB' %
+          (args.files, args.terms,
+           len(pickle.dumps(defs)) / 1024.0 / 1024.0))
+    print('%-10s %-12s %12s %12s %12s' % ('renderers', 'definitions',
+                                          'startup', 'total', 'files/s'))
+    for processes in args.max_renderers:
+      per_task = [(base_dir, f, output_dir, defs, 2, True, False, [])
+                  for f in policy_files]
+      pickled = _RunPool(context, processes, aclgen.RenderFile, per_task)
+      inherited = _RunPhasedPool(context, processes, defs, policy_files,
+                                 base_dir, output_dir)
+      for name, (startup, total) in (('per task', pickled),
+                                     ('per process', inherited)):
+        print('%-10d %-12s %11.3fs %11.3fs %12.1f' %
+              (processes, name, startup, total, args.files / total))
+  finally:
+    shutil.rmtree(base_dir)
+
+
+_SHADING_TERM = """
+term shading-term-%(index)d {
+  source-address:: NET%(src)d
+  destination-address:: NET%(dst)d
+  protocol:: tcp
+  destination-port:: SVC%(svc)d
+  action:: accept
+}
+"""
+
+
+def SyntheticShadingPolicy(terms, services, shaded_every):
+  """Return the text of a policy whose terms mostly don't shade each other.
+
+  Every shaded_every-th term repeats the term shaded_every / 2 terms before it
+  and is shaded by it.
+  """
+  text = ['\nheader {\n  target:: juniper bench-filter inet\n}\n']
+  for i in range(terms):
+    source = i
+    if shaded_every and i % shaded_every == shaded_every - 1:
+      source = i - shaded_every // 2
+    text.append(_SHADING_TERM % {'index': i,
+                                 'src': source,
+                                 'dst': (source * 7 + 1) % terms,
+                                 'svc': source % services})
+  return ''.join(text)
+
+
+def _DetectShadingPairwise(terms):
+  """Compare every term with every prior one, as _DetectShading used to."""
+  shading_errors = []
+  for index, term in enumerate(terms):
+    for prior_index in range(index):
+      if (term in terms[prior_index]
+          and 'next' not in terms[prior_index].action):
+        shading_errors.append('  %s is shaded by %s.' % (
+            term.name, terms[prior_index].name))
+  return '\n'.join(shading_errors)
+
+
+def _DetectShadingIndexed(pol, terms):
+  try:
+    pol._DetectShading(terms)  # pylint: disable=protected-access
+  except policy.ShadingError as e:
+    return str(e)
+  return ''
+
+
+def BenchmarkShading(args):
+  """Compare pairwise and indexed shading detection."""
+  for terms in args.terms:
+    defs = SyntheticDefinitions(terms, args.services, prefixes_per_network=1)
+    pol = policy.ParsePolicy(
+        SyntheticShadingPolicy(terms, args.services, args.shaded_every),
+        defs, optimize=False, shade_check=False)
+    filter_terms = pol.filters[0][1]
+    print('%d terms' % terms)
+    indexed = _Measure(_DetectShadingIndexed, pol, filter_terms)
+    if terms <= args.pairwise_max:
+      pairwise = _Measure(_DetectShadingPairwise, filter_terms)
+      _Report('  pairwise', pairwise)
+      if pairwise[2] != indexed[2]:
+        print('WARNING: shading errors differ')
+    else:
+      print('  pairwise skipped, above --pairwise_max')
+    _Report('  indexed', indexed)
+    print('  %d shaded terms' % len(indexed[2].splitlines()))
+
+
+def _RandomNetworks(rand, count):
+  """Return count random IPv4 networks in 10.0.0.0/8, /16 to /32."""
+  return [nacaddr.IPv4((10 << 24 | rand.getrandbits(24), rand.randint(16, 32)),
+                       strict=False) for _ in range(count)]
+
+
+def _IsSuperNetLinear(supernets, subnets):
+  """Check containment by scanning supernets for every subnet."""
+  for net in subnets:
+    for addr in supernets:
+      if net.subnet_of(addr):
+        break
+    else:
+      return False
+  return True
+
+
+def _CheckContainment(func, pairs):
+  start = time.perf_counter()
+  results = [func(supernets, subnets) for supernets, subnets in pairs]
+  return time.perf_counter() - start, results
+
+
+def BenchmarkContainment(args):
+  """Compare linear and AddressSet address containment checks."""
+  rand = random.Random(0)
+  print('%-10s %12s %12s' % ('addresses', 'linear', 'nacaddr'))
+  for count in args.addresses:
+    pairs = []
+    for _ in range(args.checks):
+      supernets = _RandomNetworks(rand, count)
+      # mostly contained subnets, so that the whole list is checked.
+      subnets = [nacaddr.IPv4((int(a.network_address), a.max_prefixlen))
+                 for a in rand.sample(supernets, min(count, 64))]
+      pairs.append((supernets, subnets))
+    # ipaddress caches broadcast addresses, warm them up for both checks.
+    _CheckContainment(_IsSuperNetLinear, pairs)
+    linear, expected = _CheckContainment(_IsSuperNetLinear, pairs)
+    indexed, results = _CheckContainment(nacaddr.IsSuperNet, pairs)
+    print('%-10d %11.3fs %11.3fs' % (count, linear, indexed))
+    if results != expected:
+      print('WARNING: containment results differ')
+
+
+def _CollapseObjects(addresses):
+  """CollapseAddrList merging nacaddr objects, without complement addresses."""
+  ret_array = []
+  for addr in sorted(addresses, key=ipaddress.get_mixed_type_key):
+    while True:
+      if not ret_array:
+        ret_array.append(addr)
+        break
+      prev_addr = ret_array[-1]
+      if prev_addr.supernet_of(addr):
+        prev_addr.AddComment(addr.text)
+        break
+      if (prev_addr.version == addr.version and
+          prev_addr.prefixlen == addr.prefixlen and
+          int(prev_addr.broadcast_address) + 1 == int(addr.network_address) and
+          prev_addr.supernet().network_address == prev_addr.network_address):
+        prev_addr.AddComment(addr.text)
+        addr = ret_array.pop().Supernet()
+        continue
+      ret_array.append(addr)
+      break
+  return ret_array
+
+
+def _ExcludeObjects(superset, excludes):
+  """AddressListExclude removing one nacaddr object at a time."""
+  superset = _CollapseObjects(superset)[::-1]
+  excludes = _CollapseObjects(excludes)[::-1]
+  ret_array = []
+  while superset and excludes:
+    if superset[-1].overlaps(excludes[-1]):
+      ip = superset.pop()
+      superset.extend(
+          reversed(nacaddr.RemoveAddressFromList([ip], excludes[-1])))
+    elif superset[-1]._get_networks_key() < excludes[-1]._get_networks_key():  # pylint: disable=protected-access
+      ret_array.append(superset.pop())
+    else:
+      excludes.pop()
+  return _CollapseObjects(ret_array + superset)
+
+
+def _GeoNetworks(rand, count):
+  """Return count networks clustered like geo and cloud provider lists."""
+  networks = []
+  for _ in range(count):
+    if rand.random() < 0.9:
+      prefixlen = rand.randint(20, 24)
+      # a /8 per cluster keeps many networks adjacent to each other.
+      address = rand.randint(1, 32) << 24 | rand.getrandbits(24)
+      networks.append(nacaddr.IPv4((address, prefixlen), comment='geo',
+                                   strict=False))
+    else:
+      prefixlen = rand.randint(32, 48)
+      address = 0x2001 << 112 | rand.getrandbits(24) << 80
+      networks.append(nacaddr.IPv6((address, prefixlen), comment='cloud',
+                                   strict=False))
+  return networks
+
+
+def _Sizes(func, *args):
+  """Returns the number of networks of each result, cheap to send back."""
+  return [len(func(*args))]
+
+
+def BenchmarkCollapse(args):
+  """Compare object and integer based CollapseAddrList and AddressListExclude."""
+  rand = random.Random(0)
+  for count in args.prefixes:
+    networks = _GeoNetworks(rand, count)
+    excludes = _GeoNetworks(rand, count // 10)
+    print('%d prefixes, %d excludes' % (count, len(excludes)))
+    objects = _Measure(_Sizes, _CollapseObjects, networks)
+    integers = _Measure(_Sizes, nacaddr.CollapseAddrList, networks)
+    _Report('  collapse objects', objects)
+    _Report('  collapse nacaddr', integers)
+    if objects[2] != integers[2]:
+      print('WARNING: collapsed networks differ')
+    objects = _Measure(_Sizes, _ExcludeObjects, networks, excludes)
+    integers = _Measure(_Sizes, nacaddr.AddressListExclude, networks, excludes)
+    _Report('  exclude objects', objects)
+    _Report('  exclude nacaddr', integers)
+    if objects[2] != integers[2]:
+      print('WARNING: excluded networks differ')
+
+
+def _RandomFlows(rand, count, networks, services, prefixes_per_network=4):
+  """Return count tcp flows between the networks of SyntheticDefinitions."""
+  flows = []
+  for _ in range(count):
+    addrs = []
+    for _ in range(2):
+      value = rand.randrange(networks * prefixes_per_network)
+      addrs.append('10.%d.%d.%d' % (value // 256 % 256, value % 256,
+                                    rand.randrange(256)))
+    flows.append((addrs[0], addrs[1], str(rand.randrange(1024, 65536)),
+                  str(1000 + rand.randrange(services)), 'tcp'))
+  return flows
+
+
+def BenchmarkAclCheck(args):
+  """Compare AclCheck and FlowChecker on the same flows."""
+  defs = SyntheticDefinitions(args.networks, args.services)
+  header = '\nheader {\n  target:: juniper bench-filter inet\n}\n'
+  pol = policy.ParsePolicy(
+      SyntheticPolicy(header, args.terms, args.networks, args.services), defs)
+  flows = _RandomFlows(random.Random(0), args.flows, args.networks,
+                       args.services)
+  linear_flows = flows[:args.aclcheck_max]
+  start = time.perf_counter()
+  expected = [str(aclcheck.AclCheck(pol, *flow)) for flow in linear_flows]
+  linear = time.perf_counter() - start
+  start = time.perf_counter()
+  checker = aclcheck.FlowChecker(pol)
+  build = time.perf_counter() - start
+  start = time.perf_counter()
+  results = [str(result) for result in checker.CheckFlows(flows)]
+  batch = time.perf_counter() - start
+  print('%d terms, %d flows' % (args.terms, len(flows)))
+  print('  AclCheck     %10.1f us/flow (%d flows)' % (
+      linear / len(linear_flows) * 1e6, len(linear_flows)))
+  print('  FlowChecker  %10.1f us/flow, %.3fs to build' % (
+      batch / len(flows) * 1e6, build))
+  if results[:len(expected)] != expected:
+    print('WARNING: check results differ')
+
+
+def BenchmarkFlowArray(args):
+  """Check arrays of flows with aclcheck_numpy.FlowArrayChecker."""
+  try:
+    import numpy as np  # pylint: disable=g-import-not-at-top
+    from capirca.lib import aclcheck_numpy  # pylint: disable=g-import-not-at-top
+  except ImportError:
+    print('flowarray needs numpy: pip install capirca[numpy]')
+    return
+  defs = SyntheticDefinitions(args.networks, args.services)
+  header = '\nheader {\n  target:: juniper bench-filter inet\n}\n'
+  pol = policy.ParsePolicy(
+      SyntheticPolicy(header, args.terms, args.networks, args.services), defs)
+  rand = np.random.default_rng(0)
+  # addresses in the networks of SyntheticDefinitions, and some outside.
+  src = (10 << 24) + rand.integers(0, args.networks * 4 * 256 * 5 // 4,
+                                   args.flows, dtype=np.uint32)
+  dst = (10 << 24) + rand.integers(0, args.networks * 4 * 256 * 5 // 4,
+                                   args.flows, dtype=np.uint32)
+  sport = rand.integers(1024, 65536, args.flows, dtype=np.uint16)
+  dport = (1000 + rand.integers(0, args.services, args.flows)).astype(
+      np.uint16)
+  proto = np.full(args.flows, 6, np.uint8)
+  start = time.perf_counter()
+  checker = aclcheck_numpy.FlowArrayChecker(pol)
+  build = time.perf_counter() - start
+  start = time.perf_counter()
+  matches = checker.Check(src, dst, sport, dport, proto)[0]
+  elapsed = time.perf_counter() - start
+  print('%d terms, %d flows' % (args.terms, args.flows))
+  print('  FlowArrayChecker %8.3fs, %.0f flows/s, %.3fs to build' % (
+      elapsed, args.flows / elapsed, build))
+  print('  %d flows matched' % (matches.term_index >= 0).sum())
+
+
+def SyntheticRedundancyPolicy(terms, networks, services, repeat_every):
+  """Return the text of a filter of overlapping terms ending in a deny.
+
+  Every fifth term matches any source and every tenth denies. Every
+  repeat_every-th term repeats the term repeat_every / 2 terms before it.
+  """
+  text = ['\nheader {\n  target:: juniper bench-filter inet\n}\n']
+  for i in range(terms):
+    source = i
+    if repeat_every and i % repeat_every == repeat_every - 1:
+      source = i - repeat_every // 2
+    lines = ['term bench-term-%d {' % i]
+    if source % 5:
+      lines.append('  source-address:: NET%d' % (source % networks))
+    lines.append('  destination-address:: NET%d' % (
+        (source * 7 + 1) % networks))
+    lines.append('  protocol:: tcp')
+    lines.append('  destination-port:: SVC%d' % (source % services))
+    lines.append('  action:: %s' % ('deny' if source % 10 == 3 else 'accept'))
+    text.append('\n'.join(lines) + '\n}\n')
+  text.append('term default-deny {\n  action:: deny\n}\n')
+  return ''.join(text)
+
+
+def _Findings(terms):
+  findings = redundancy.AnalyzeTerms('bench-filter', terms)
+  return [(finding.kind, finding.term) for finding in findings]
+
+
+def BenchmarkRedundancy(args):
+  """Find the unreachable, redundant and overlapping terms of filters."""
+  for terms in args.terms:
+    networks = args.networks or terms
+    defs = SyntheticDefinitions(networks, args.services)
+    pol = policy.ParsePolicy(
+        SyntheticRedundancyPolicy(terms, networks, args.services,
+                                  args.repeat_every),
+        defs, optimize=False, shade_check=False)
+    print('%d terms' % terms)
+    measurement = _Measure(_Findings, pol.filters[0][1])
+    _Report('  AnalyzeTerms', measurement)
+    kinds = {}
+    for kind, _ in measurement[2]:
+      kinds[kind] = kinds.get(kind, 0) + 1
+    for kind in redundancy.KINDS:
+      print('  %d %s terms' % (kinds.get(kind, 0), kind))
+
+
+def _ChangeTerms(text, terms, services, changes):
+  """Return the text of a filter with the ports of evenly spread terms changed.
+  """
+  for i in range(0, terms, max(1, terms // changes))[:changes]:
+    text = re.sub(r'(term bench-term-%d {[^}]*destination-port:: )SVC\d+' % i,
+                  r'\g<1>SVC%d' % ((i + 1) % services), text)
+  return text
+
+
+def _Diff(old_terms, new_terms):
+  diff = policydiff.DiffTerms('bench-filter', old_terms, new_terms)
+  return len(diff.permitted), len(diff.denied)
+
+
+def BenchmarkPolicyDiff(args):
+  """Find the flows permitted and denied by a few changed terms of filters."""
+  for terms in args.terms:
+    networks = args.networks or terms
+    defs = SyntheticDefinitions(networks, args.services)
+    text = SyntheticRedundancyPolicy(terms, networks, args.services, 0)
+    old = policy.ParsePolicy(text, defs, optimize=False, shade_check=False)
+    new = policy.ParsePolicy(
+        _ChangeTerms(text, terms, args.services, args.changes), defs,
+        optimize=False, shade_check=False)
+    print('%d terms, %d changed' % (terms, args.changes))
+    measurement = _Measure(_Diff, old.filters[0][1], new.filters[0][1])
+    _Report('  DiffTerms', measurement)
+    print('  %d permitted and %d denied regions' % measurement[2])
+
+
+def _WriteCgrepDefinitions(def_dir, networks, group_size, services):
+  """Write definitions of networks nested in groups, and groups of groups."""
+  lines = []
+  for i in range(networks):
+    prefixes = []
+    for j in range(4):
+      value = i * 4 + j
+      prefixes.append('%d.%d.%d.0/24' % (10 + value // 65536,
+                                         value // 256 % 256, value % 256))
+    lines.append('NET%d = %s' % (i, ' '.join(prefixes)))
+  groups = (networks + group_size - 1) // group_size
+  for i in range(groups):
+    lines.append('GROUP%d = %s' % (i, ' '.join(
+        'NET%d' % j for j in range(i * group_size,
+                                   min(networks, (i + 1) * group_size)))))
+  for i in range(0, groups, group_size):
+    lines.append('SUPER%d = %s' % (i // group_size, ' '.join(
+        'GROUP%d' % j for j in range(i, min(groups, i + group_size)))))
+  pathlib.Path(def_dir, 'NETWORK.net').write_text('\n'.join(lines) + '\n')
+  pathlib.Path(def_dir, 'SERVICES.svc').write_text(''.join(
+      'SVC%d = %d/tcp %d-%d/udp\n' % (i, 1000 + i, 1000 + i, 1010 + i)
+      for i in range(services)))
+
+
+def _CgrepNaming(def_dir, ips):
+  db = naming.Naming(def_dir)
+  return [cgrep.get_ip_parents(ip, db) for ip in ips]
+
+
+def _CgrepIndex(def_dir, index_file, ips):
+  db = cgrep.load_index(def_dir, index_file)
+  start = time.perf_counter()
+  results = [cgrep.get_ip_parents(ip, db) for ip in ips]
+  return results, time.perf_counter() - start
+
+
+def BenchmarkCgrep(args):
+  """Compare cgrep -i on Naming with a built and a loaded cgrep index."""
+  rand = random.Random(0)
+  ips = []
+  for _ in range(args.ips):
+    value = rand.randrange(args.networks * 4)
+    ips.append('%d.%d.%d.%d' % (10 + value // 65536, value // 256 % 256,
+                                value % 256, rand.randrange(256)))
+  base_dir = tempfile.mkdtemp()
+  try:
+    _WriteCgrepDefinitions(base_dir, args.networks, args.group_size,
+                           args.services)
+    index_file = os.path.join(base_dir, 'cgrep.index')
+    print('%d network tokens, %d IPs' % (args.networks, len(ips)))
+    naming_ips = ips[:args.naming_max]
+    measurement = _Measure(_CgrepNaming, base_dir, naming_ips)
+    _Report('  Naming, %d IPs' % len(naming_ips), measurement)
+    expected = measurement[2]
+    for name in ('build index', 'load index'):
+      measurement = _Measure(_CgrepIndex, base_dir, index_file, ips)
+      results, queries = measurement[2]
+      _Report('  %s, %d IPs' % (name, len(ips)), measurement)
+      print('  %.3fms per IP' % (queries / len(ips) * 1000))
+      if results[:len(expected)] != expected:
+        print('WARNING: results differ')
+  finally:
+    shutil.rmtree(base_dir)
+
+
+def _IpParentsEach(defs, ips):
+  defs.GetIpParents('0.0.0.0')  # builds the reverse lookup index.
+  start = time.perf_counter()
+  parents = [tuple(defs.GetIpParents(ip)) for ip in ips]
+  return parents, time.perf_counter() - start
+
+
+def _IpParentsBatch(defs, ips):
+  defs.GetIpParents('0.0.0.0')
+  start = time.perf_counter()
+  parents = [result[1] for result in defs.GetIpParentsBatch(ips)]
+  return parents, time.perf_counter() - start
+
+
+def BenchmarkIpParents(args):
+  """Compare Naming.GetIpParents for each IP with GetIpParentsBatch."""
+  rand = random.Random(0)
+  ips = []
+  for _ in range(args.ips):
+    value = rand.randrange(args.networks * 4)
+    ips.append('%d.%d.%d.%d' % (10 + value // 65536, value // 256 % 256,
+                                value % 256, rand.randrange(256)))
+  integers = [int(ipaddress.ip_address(ip)) for ip in ips]
+  base_dir = tempfile.mkdtemp()
+  try:
+    _WriteCgrepDefinitions(base_dir, args.networks, args.group_size,
+                           args.services)
+    defs = naming.Naming(base_dir)
+  finally:
+    shutil.rmtree(base_dir)
+  print('%d network tokens, %d IPs' % (args.networks, len(ips)))
+  each_ips = ips[:args.each_max]
+  expected = None
+  for name, func, queries in (
+      ('GetIpParents each', _IpParentsEach, each_ips),
+      ('GetIpParentsBatch', _IpParentsBatch, ips),
+      ('GetIpParentsBatch integers', _IpParentsBatch, integers)):
+    measurement = _Measure(func, defs, queries)
+    parents, elapsed = measurement[2]
+    _Report('  %s' % name, measurement)
+    print('  %.0f IPs/s' % (len(queries) / elapsed))
+    if expected is None:
+      expected = parents
+    elif parents[:len(expected)] != expected:
+      print('WARNING: parents differ')
+
+
+def _WriteDefinitionFiles(def_dir, files, networks, hosts, services):
+  """Write network tokens of many commented hosts, split in files."""
+  rand = random.Random(0)
+  for number in range(files):
+    with open(os.path.join(def_dir, 'NETWORK%d.net' % number), 'w') as f:
+      for i in range(number, networks, files):
+        f.write('NET%d = 10.%d.%d.0/24 # network %d\n' % (
+            i, i // 256 % 256, i % 256, i))
+        for j in range(hosts):
+          f.write('       %s/32  # host %d\n' % (
+              ipaddress.IPv4Address(rand.getrandbits(32)), j))
+  pathlib.Path(def_dir, 'SERVICES.svc').write_text(''.join(
+      'SVC%d = %d/tcp %d-%d/udp\n' % (i, 1000 + i, 1000 + i, 1010 + i)
+      for i in range(services)))
+
+
+def _LoadDefinitions(def_dir, snapshot_file, max_parsers):
+  defs = naming.Naming(def_dir, snapshot_file=snapshot_file,
+                       max_parsers=max_parsers)
+  return len(defs.networks), len(defs.services)
+
+
+def BenchmarkDefinitions(args):
+  """Compare parsing definition files serially, in parallel and snapshots."""
+  base_dir = tempfile.mkdtemp()
+  try:
+    _WriteDefinitionFiles(base_dir, args.files, args.networks, args.hosts,
+                          args.services)
+    snapshot = os.path.join(base_dir, 'definitions.snapshot')
+    print('%d network tokens of %d hosts in %d files' % (
+        args.networks, args.hosts, args.files))
+    for max_parsers in args.max_parsers:
+      _Report('  parse, max_parsers %d' % max_parsers,
+              _Measure(_LoadDefinitions, base_dir, None, max_parsers))
+    for name in ('parse and save snapshot', 'load snapshot'):
+      _Report('  %s' % name,
+              _Measure(_LoadDefinitions, base_dir, snapshot, 1))
+  finally:
+    shutil.rmtree(base_dir)
+
+
+def cli_options():
+  """Builds the argparse options for the benchmarks.
+
+  Returns:
+    parser: the arguments, ready to be parsed.
+  """
+  parser = argparse.ArgumentParser(description='capirca benchmarks')
+  subparsers = parser.add_subparsers(dest='benchmark')
+  subparsers.required = True
+
+  render = subparsers.add_parser(
+      'render', help='per-platform policy copies in aclgen.RenderFile')
+  render.add_argument('--terms', type=int, default=2000)
+  render.add_argument('--networks', type=int, default=500)
+  render.add_argument('--services', type=int, default=50)
+  render.set_defaults(func=BenchmarkRender)
+
+  renderers = subparsers.add_parser(
+      'renderers', help='definitions hand-off and --max_renderers scaling')
+  renderers.add_argument('--max_renderers', type=int, nargs='+',
+                         default=[1, 2, 4, 8])
+  renderers.add_argument('--files', type=int, default=200)
+  renderers.add_argument('--terms', type=int, default=20)
+  renderers.add_argument('--networks', type=int, default=20000)
+  renderers.add_argument('--services', type=int, default=50)
+  renderers.add_argument('--start_method', default=None,
+                         help='multiprocessing start method')
+  renderers.set_defaults(func=BenchmarkRenderers)
+
+  shading = subparsers.add_parser(
+      'shading', help='shading detection of policy.Policy')
+  shading.add_argument('--terms', type=int, nargs='+',
+                       default=[1000, 10000, 50000])
+  shading.add_argument('--services', type=int, default=50)
+  shading.add_argument('--shaded_every', type=int, default=100)
+  shading.add_argument('--pairwise_max', type=int, default=2000,
+                       help='largest filter compared pairwise')
+  shading.set_defaults(func=BenchmarkShading)
+
+  containment = subparsers.add_parser(
+      'containment', help='nacaddr.IsSuperNet on growing address lists')
+  containment.add_argument('--addresses', type=int, nargs='+',
+                           default=[4, 16, 64, 256, 1024, 4096])
+  containment.add_argument('--checks', type=int, default=100,
+                           help='address lists checked per size')
+  containment.set_defaults(func=BenchmarkContainment)
+
+  collapse = subparsers.add_parser(
+      'collapse', help='nacaddr.CollapseAddrList and AddressListExclude')
+  collapse.add_argument('--prefixes', type=int, nargs='+',
+                        default=[20000, 200000])
+  collapse.set_defaults(func=BenchmarkCollapse)
+
+  check = subparsers.add_parser(
+      'aclcheck', help='aclcheck.AclCheck and FlowChecker on many flows')
+  check.add_argument('--terms', type=int, default=1000)
+  check.add_argument('--networks', type=int, default=500)
+  check.add_argument('--services', type=int, default=50)
+  check.add_argument('--flows', type=int, default=50000)
+  check.add_argument('--aclcheck_max', type=int, default=2000,
+                     help='flows checked with AclCheck')
+  check.set_defaults(func=BenchmarkAclCheck)
+
+  flowarray = subparsers.add_parser(
+      'flowarray', help='aclcheck_numpy.FlowArrayChecker on arrays of flows')
+  flowarray.add_argument('--terms', type=int, default=1000)
+  flowarray.add_argument('--networks', type=int, default=500)
+  flowarray.add_argument('--services', type=int, default=50)
+  flowarray.add_argument('--flows', type=int, default=1000000)
+  flowarray.set_defaults(func=BenchmarkFlowArray)
+
+  analysis = subparsers.add_parser(
+      'redundancy', help='redundancy.AnalyzeTerms of a filter')
+  analysis.add_argument('--terms', type=int, nargs='+',
+                        default=[1000, 10000])
+  analysis.add_argument('--networks', type=int, default=None,
+                        help='network tokens, one per term by default')
+  analysis.add_argument('--services', type=int, default=50)
+  analysis.add_argument('--repeat_every', type=int, default=100)
+  analysis.set_defaults(func=BenchmarkRedundancy)
+
+  diff = subparsers.add_parser(
+      'policydiff', help='policydiff.DiffTerms of two revisions of a filter')
+  diff.add_argument('--terms', type=int, nargs='+', default=[1000, 10000])
+  diff.add_argument('--networks', type=int, default=None,
+                    help='network tokens, one per term by default')
+  diff.add_argument('--services', type=int, default=50)
+  diff.add_argument('--changes', type=int, default=10,
+                    help='terms whose destination ports change')
+  diff.set_defaults(func=BenchmarkPolicyDiff)
+
+  grep = subparsers.add_parser(
+      'cgrep', help='cgrep IP queries on Naming and on a cgrep index')
+  grep.add_argument('--networks', type=int, default=40000)
+  grep.add_argument('--group_size', type=int, default=100,
+                    help='networks per group and groups per super group')
+  grep.add_argument('--services', type=int, default=1000)
+  grep.add_argument('--ips', type=int, default=1000)
+  grep.add_argument('--naming_max', type=int, default=20,
+                    help='IPs queried on Naming')
+  grep.set_defaults(func=BenchmarkCgrep)
+
+  parents = subparsers.add_parser(
+      'ipparents', help='Naming.GetIpParents and GetIpParentsBatch')
+  parents.add_argument('--networks', type=int, default=40000)
+  parents.add_argument('--group_size', type=int, default=100,
+                       help='networks per group and groups per super group')
+  parents.add_argument('--services', type=int, default=10)
+  parents.add_argument('--ips', type=int, default=200000)
+  parents.add_argument('--each_max', type=int, default=20000,
+                       help='IPs queried one GetIpParents call at a time')
+  parents.set_defaults(func=BenchmarkIpParents)
+
+  definitions = subparsers.add_parser(
+      'definitions', help='loading naming.Naming from large definitions')
+  definitions.add_argument('--files', type=int, default=8)
+  definitions.add_argument('--networks', type=int, default=80000)
+  definitions.add_argument('--hosts', type=int, default=6,
+                           help='host lines per network token')
+  definitions.add_argument('--services', type=int, default=1000)
+  definitions.add_argument('--max_parsers', type=int, nargs='+',
+                           default=[1, 4])
+  definitions.set_defaults(func=BenchmarkDefinitions)
+
+  return parser
+
+
+def main():
+  options = cli_options().parse_args()
+  options.func(options)
+
+
+if __name__ == '__main__':
+  main()
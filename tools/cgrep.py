@@ -36,9 +36,22 @@ Examples:
 
   To find which service tokens contain port '22' and protocol 'tcp' use
   $ cgrep.py -p 22 tcp
+
+  To find out which tokens contain each IP of a file, one IP per line, use
+  $ cgrep.py -f ips.txt
+
+  To answer many queries against large definitions, keep an index of the
+  definitions in a file, rebuilt only when the definitions change
+  $ cgrep.py --index /tmp/cgrep.index -i 10.4.3.1
 """
 
 import argparse
+import collections
+import glob
+import hashlib
+import marshal
+import mmap
+import os
 import pprint
 import sys
 
@@ -46,6 +59,15 @@ from absl import app
 from absl import logging
 from capirca.lib import nacaddr
 from capirca.lib import naming
+from capirca.utils import atomicfile
+
+# Bump when the layout of TokenIndex changes, to rebuild saved indexes.
+INDEX_VERSION = 2
+
+_INDEX_MAGIC = 'capirca-cgrep-index'
+
+# network tokens expanding to more networks are looked up by prefix length.
+_SCAN_MAX = 64
 
 
 def is_valid_ip(arg):
@@ -67,6 +89,27 @@ def is_valid_ip(arg):
   return arg
 
 
+def read_ips(ip_file):
+  """Reads the IPs of a file, one per line, skipping blanks and # comments.
+
+  Args:
+    ip_file: path of the file.
+
+  Returns:
+    list of IPs as strings.
+
+  Raises:
+    argparse.ArgumentTypeError: if a line is not an IP.
+  """
+  ips = []
+  with open(ip_file) as f:
+    for line in f:
+      line = line.split('#')[0].strip()
+      if line:
+        ips.append(is_valid_ip(line))
+  return ips
+
+
 def cli_options():
   """Builds the argparse options for cgrep.
 
@@ -85,6 +128,11 @@ def cli_options():
                       help='Network Definitions directory location. \n',
                       default='./def')
 
+  parser.add_argument('--index', dest='index',
+                      help='File keeping an index of the definitions, '
+                      'rebuilt when they change.\nSpeeds up queries of '
+                      'large definitions.\n')
+
   # -i and -t can be used together, but not with any other option.
   ip_group = parser.add_argument_group()
   # take 1 or more IPs
@@ -92,6 +140,10 @@ def cli_options():
                         help='Return list of definitions containing the '
                         'IP(s).\nMultiple IPs permitted.')
 
+  ip_group.add_argument('-f', '--ip_file', dest='ip_file',
+                        help='Return list of definitions containing each IP '
+                        'of the file,\none IP per line.')
+
   ip_group.add_argument('-t', '--token', dest='token',
                         help=('See if an IP is contained within the given '
                               'token.\nMust be used in conjunction with '
@@ -131,7 +183,18 @@ def main(argv):
   del argv  # Unused.
   parser = cli_options()
   options = parser.parse_args()
-  db = naming.Naming(options.defs)
+  if options.ip_file:
+    try:
+      options.ip = (options.ip or []) + read_ips(options.ip_file)
+    except (IOError, argparse.ArgumentTypeError) as e:
+      parser.error(str(e))
+  if options.index:
+    db = load_index(options.defs, options.index)
+  else:
+    db = naming.Naming(options.defs)
+    if options.ip_file:
+      # many IPs are answered faster from an index, even built for one run.
+      db = TokenIndex(db)
   p = pprint.PrettyPrinter(indent=1, depth=4, width=1).pprint
 
   # if -i and any other option:
@@ -258,20 +321,9 @@ def check_encapsulated(obj_type, first_obj, second_obj, db):
   else:
     raise ValueError("check_encapsulated() currently only supports "
                      "'network' and 'service' for the obj_type parameter")
-  # iterates over each object in the first group, and then each obj in the
-  # second group, making sure each one in the first is contained
-  # somewhere in the second.
-  for obj in first:
-    for sec_obj in second:
-      if obj.version == sec_obj.version:
-        if obj.subnet_of(sec_obj):
-          break
-    # if we got through every object in the second group, and didn't have
-    # a match, then the first group is not entirely contained.
-    else:
-      return False
-  # if we got here, then the group was fully contained.
-  return True
+  # every object in the first group must be contained in an object of the
+  # second group of the same version.
+  return nacaddr.AddressSet(second).IsSuperSetOf(first)
 
 
 def print_diff(ip, common, diff1, diff2):
@@ -363,6 +415,8 @@ def get_nets_and_highest_prefix(ip, net_group, db):
       highest_prefix_length : the longest prefix length found,
       networks : network objects
   """
+  if isinstance(db, TokenIndex):
+    return db.GetNetsContaining(ip, net_group)
   highest_prefix_length = 0
   networks = []
   ip = nacaddr.IP(ip)
@@ -482,5 +536,327 @@ def get_services(options, db):
   return port, protocol, results
 
 
+def definitions_fingerprint(defs):
+  """Returns a digest of the network and service definition files of defs."""
+  sha = hashlib.sha256(('%d\n' % INDEX_VERSION).encode('utf-8'))
+  for def_file in sorted(glob.glob(os.path.join(defs, '*.net')) +
+                         glob.glob(os.path.join(defs, '*.svc'))):
+    sha.update(('%s\0' % os.path.basename(def_file)).encode('utf-8'))
+    with open(def_file, 'rb') as f:
+      sha.update(f.read())
+    sha.update(b'\0')
+  return sha.hexdigest()
+
+
+def load_index(defs, index_file):
+  """Loads the index of the definitions, rebuilding it if they changed.
+
+  Args:
+    defs: the definitions directory.
+    index_file: path of the index file; it does not need to exist.
+
+  Returns:
+    TokenIndex of the definitions.
+  """
+  fingerprint = definitions_fingerprint(defs)
+  index = TokenIndex.Load(index_file, fingerprint)
+  if index is None:
+    index = TokenIndex(naming.Naming(defs), fingerprint)
+    index.Save(index_file)
+  return index
+
+
+def _index_header(fingerprint):
+  # marshal data is only guaranteed to load in the Python that wrote it.
+  return (_INDEX_MAGIC, INDEX_VERSION, marshal.version,
+          tuple(sys.version_info[:2]), sys.byteorder, fingerprint)
+
+
+def _pack_errors(table):
+  """Splits the errors out of a token table, as (class name, message)."""
+  values = {}
+  errors = {}
+  for token, value in table.items():
+    if isinstance(value, naming.Error):
+      errors[token] = (type(value).__name__, str(value))
+    else:
+      values[token] = value
+  return values, errors
+
+
+def _unpack_errors(values, errors):
+  """Returns a token table holding the errors packed by _pack_errors."""
+  table = dict(values)
+  for token, (name, message) in errors.items():
+    error_class = getattr(naming, name, None)
+    if not (isinstance(error_class, type) and
+            issubclass(error_class, naming.Error)):
+      raise ValueError('unknown error %r' % name)
+    table[token] = error_class(message)
+  return table
+
+
+class TokenIndex:
+  """The naming queries of cgrep, answered from precomputed tables.
+
+  Every network token is expanded once into integer intervals, networks are
+  looked up by address with one dict lookup per prefix length in use, and the
+  ports of every service are kept by protocol. The query methods mirror those
+  of naming.Naming, so the functions above accept either.
+
+  Indexes are saved in the marshal format, which only holds data, so that
+  loading an index file can't run code.
+
+  Attributes:
+    fingerprint: digest of the definitions the index was built from.
+  """
+
+  # the tables of the index saved by Save, in order.
+  _TABLES = ('_nets', '_tables', '_holders', '_parents', '_prefixlens',
+             '_net_parents', '_services', '_ports', '_port_ranges')
+  # the tables holding errors, see _pack_errors.
+  _ERROR_TABLES = ('_nets', '_net_parents', '_services')
+
+  def __init__(self, db, fingerprint=None):
+    """Builds the index.
+
+    Args:
+      db: naming.Naming object.
+      fingerprint: digest of the definitions, see definitions_fingerprint.
+    """
+    self.fingerprint = fingerprint
+    # token -> tuple of (version, first, last, prefixlen, network, defining
+    # token, comment) for every network of the flattened token, or the error
+    # expanding it.
+    self._nets = {}
+    # the expansions of nested tokens share their entries.
+    entries = {}
+    for token in db.networks:
+      try:
+        expansion = db.GetNet(token)
+      except naming.Error as e:
+        self._nets[token] = e
+        continue
+      nets = []
+      for addr in expansion:
+        first = int(addr.network_address)
+        last = first + (1 << (addr.max_prefixlen - addr.prefixlen)) - 1
+        entry = (addr.version, first, last, addr.prefixlen, str(addr),
+                 addr.token, addr.text)
+        nets.append(entries.setdefault(entry, entry))
+      self._nets[token] = tuple(nets)
+    # token -> (version, prefixlen) -> {network: [positions in the expansion]}
+    # for the tokens too large to scan.
+    self._tables = {}
+    for token, nets in self._nets.items():
+      if isinstance(nets, Exception) or len(nets) <= _SCAN_MAX:
+        continue
+      table = collections.defaultdict(lambda: collections.defaultdict(list))
+      for position, entry in enumerate(nets):
+        table[(entry[0], entry[3])][entry[1]].append(position)
+      self._tables[token] = {k: dict(v) for k, v in table.items()}
+    # (version, prefixlen) -> {network: [tokens holding it]}, and the tokens
+    # directly holding each token, from the reverse lookups of naming.
+    self._holders = db.GetNetPrefixes()
+    self._parents = db.GetNetItemParents()
+    self._prefixlens = {
+        version: sorted(prefixlen for v, prefixlen in self._holders
+                        if v == version)
+        for version in (4, 6)}
+    # token -> the tokens nesting it, or the error finding them.
+    self._net_parents = {}
+    for token in db.networks:
+      if token not in self._parents:
+        continue
+      try:
+        self._net_parents[token] = db.GetNetParents(token)
+      except RecursionError:
+        self._net_parents[token] = naming.ReferenceCycleError(
+            '\nNetwork token is nested in itself: %s' % token)
+    # token -> expanded ports, or the error expanding it.
+    self._services = {}
+    # protocol -> {port: tokens}, and protocol -> [(first, last, token)].
+    self._ports = collections.defaultdict(lambda: collections.defaultdict(set))
+    self._port_ranges = collections.defaultdict(list)
+    for token in db.services:
+      try:
+        self._services[token] = db.GetService(token)
+      except naming.Error as e:
+        self._services[token] = e
+        continue
+      for service in self._services[token]:
+        ports, _, protocol = service.partition('/')
+        try:
+          first, _, last = ports.partition('-')
+          first = int(first)
+          last = int(last) if last else None
+        except ValueError:
+          continue
+        if last is None:
+          self._ports[protocol][first].add(token)
+        else:
+          self._port_ranges[protocol].append((first, last, token))
+    self._ports = {k: dict(v) for k, v in self._ports.items()}
+    self._port_ranges = dict(self._port_ranges)
+
+  def Save(self, index_file):
+    """Saves the index, replacing index_file atomically."""
+    tables = []
+    for name in self._TABLES:
+      table = getattr(self, name)
+      if name in self._ERROR_TABLES:
+        table = _pack_errors(table)
+      tables.append(table)
+    with atomicfile.Open(index_file, 'wb') as f:
+      marshal.dump((_index_header(self.fingerprint), tuple(tables)), f)
+
+  @classmethod
+  def Load(cls, index_file, fingerprint):
+    """Loads an index saved by Save.
+
+    Args:
+      index_file: path of the index file; it does not need to exist.
+      fingerprint: digest of the current definitions.
+
+    Returns:
+      The TokenIndex, or None if the file is missing, unreadable or was saved
+      for other definitions.
+    """
+    try:
+      with open(index_file, 'rb') as f:
+        # read the index through the page cache, without copying the file.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+          data = marshal.loads(mapped)
+    except FileNotFoundError:
+      return None
+    except (IOError, ValueError, EOFError, TypeError) as e:
+      logging.warning('ignoring unreadable index %s: %s', index_file, e)
+      return None
+    if (not isinstance(data, tuple) or len(data) != 2 or
+        data[0] != _index_header(fingerprint) or
+        not isinstance(data[1], tuple) or len(data[1]) != len(cls._TABLES)):
+      logging.info('index %s is out of date', index_file)
+      return None
+    index = cls.__new__(cls)
+    index.fingerprint = fingerprint
+    try:
+      for name, table in zip(cls._TABLES, data[1]):
+        if name in cls._ERROR_TABLES:
+          table = _unpack_errors(*table)
+        setattr(index, name, table)
+    except (TypeError, ValueError) as e:
+      logging.warning('ignoring unreadable index %s: %s', index_file, e)
+      return None
+    return index
+
+  def _Expansion(self, query):
+    token = query.split('#')[0].split()[0]
+    expansion = self._nets.get(token)
+    if expansion is None:
+      raise naming.UndefinedAddressError('%s %s' % ('\nUNDEFINED:', token))
+    if isinstance(expansion, Exception):
+      raise expansion
+    return token, expansion
+
+  def GetNet(self, query):
+    """Returns the networks of a token, see naming.Naming.GetNet."""
+    token, expansion = self._Expansion(query)
+    results = []
+    for entry in expansion:
+      addr = nacaddr.IP(entry[4], entry[6], entry[5])
+      addr.parent_token = token
+      results.append(addr)
+    return results
+
+  def GetNetsContaining(self, ip, token):
+    """Finds the networks of a token containing an IP.
+
+    Args:
+      ip: an IP string or nacaddr.IP object.
+      token: name of a network token.
+
+    Returns:
+      tuple of the longest prefix length of the networks containing ip, and
+      their list, see get_nets_and_highest_prefix.
+    """
+    ip = nacaddr.IP(ip)
+    first = int(ip.network_address)
+    last = int(ip.broadcast_address)
+    nets = self._Expansion(token)[1]
+    table = self._tables.get(token)
+    if table is None:
+      containing = [entry for entry in nets
+                    if entry[0] == ip.version and
+                    entry[1] <= first and last <= entry[2]]
+    else:
+      positions = []
+      for prefixlen in range(ip.prefixlen + 1):
+        by_network = table.get((ip.version, prefixlen))
+        if by_network:
+          mask = ((1 << prefixlen) - 1) << (ip.max_prefixlen - prefixlen)
+          positions.extend(by_network.get(first & mask, ()))
+      containing = [nets[position] for position in sorted(positions)]
+    return (max([entry[3] for entry in containing], default=0),
+            [entry[4] for entry in containing])
+
+  def GetIpParents(self, query):
+    """Returns the tokens containing an IP, see naming.Naming.GetIpParents."""
+    if (not isinstance(query, nacaddr.IPv4) and
+        not isinstance(query, nacaddr.IPv6)):
+      if query[:1].isdigit():
+        query = nacaddr.IP(query)
+    if isinstance(query, nacaddr.IPv4) or isinstance(query, nacaddr.IPv6):
+      pending = []
+      address = int(query.network_address)
+      host_bits = query.max_prefixlen
+      for prefixlen in self._prefixlens[query.version]:
+        if prefixlen > query.prefixlen:
+          break
+        mask = ((1 << prefixlen) - 1) << (host_bits - prefixlen)
+        pending.extend(self._holders[(query.version, prefixlen)].get(
+            address & mask, ()))
+    elif query[:1].isalpha():
+      pending = list(self._parents.get(query, ()))
+    else:
+      pending = []
+    parents = set()
+    while pending:
+      token = pending.pop()
+      if token in parents or not token[:1].isalpha():
+        continue
+      parents.add(token)
+      pending.extend(self._parents.get(token, ()))
+    return sorted(parents)
+
+  def GetNetParents(self, query):
+    """Returns the tokens nesting a token, see naming.Naming.GetNetParents."""
+    parents = self._net_parents.get(query, ())
+    if isinstance(parents, Exception):
+      raise parents
+    return list(parents)
+
+  def GetService(self, query):
+    """Returns the ports of a service, see naming.Naming.GetService."""
+    token = query.split('#')[0].split()[0]
+    ports = self._services.get(token)
+    if ports is None:
+      raise naming.UndefinedServiceError('\nNo such service: %s' % query)
+    if isinstance(ports, Exception):
+      raise ports
+    return list(ports)
+
+  def GetPortParents(self, query, proto):
+    """Returns the services holding a port, see naming.Naming.GetPortParents.
+    """
+    port = int(query)
+    matches = set(self._ports.get(proto, {}).get(port, ()))
+    matches.update(token for first, last, token
+                   in self._port_ranges.get(proto, ()) if first <= port <= last)
+    if not matches:
+      raise naming.UndefinedPortError(
+          '%s/%s is not found in any service tokens' % (query, proto))
+    return sorted(matches)
+
+
 if __name__ == '__main__':
   app.run(main, argv=sys.argv[:1])